@@ -0,0 +1,166 @@
+"""
+Benchmark deriving variables from MERRA data.
+
+Compares the former derivation, which built full-size temporaries for
+every unit conversion, fill and wind component, with the in-place
+kernels of MerraPowerGeneration._process_merra_data, and checks that
+both produce the same variables.
+
+    python benchmarks/bench_derivation.py [--n-lats N] [--n-lons N] [--dtype float32]
+
+Each derivation runs in a fresh process on a synthetic grid. Peak RSS
+is reported above the RSS of the loaded MERRA variables.
+"""
+import logging
+import resource
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from sys import path
+
+import numpy as np
+from netCDF4 import default_fillvals
+
+PROJECT_PATH = Path(__file__).parents[1]
+path.insert(0, str(Path(PROJECT_PATH, 'src')))
+
+from power_generation import (
+    MerraPowerGeneration,
+    DERIVED_VARIABLES,
+    HOURS_PER_YEAR,
+    ATM_PER_PASCAL,
+    KELV_CELSIUS_OFFSET,
+    BYTES_PER_MEGABYTE
+)
+
+# plausible ranges of each MERRA variable
+SYNTHETIC_RANGES = {
+    'PS' : (60000, 105000),
+    'T2M' : (230, 320),
+    'U2M' : (-15, 15),
+    'V2M' : (-15, 15),
+    'U10M' : (-20, 20),
+    'V10M' : (-20, 20),
+    'U50M' : (-30, 30),
+    'V50M' : (-30, 30),
+    'SWGDN' : (0, 1100)
+}
+
+def legacy_wind_direction(eastward_velocity, northward_velocity):
+    """Wind direction assigned case by case with boolean masks."""
+    eastward = np.logical_and(eastward_velocity > 0, northward_velocity != 0)
+    westward = np.logical_and(eastward_velocity < 0, northward_velocity != 0)
+    pure_northward = np.logical_and(eastward_velocity == 0, northward_velocity > 0)
+    pure_southward = np.logical_and(eastward_velocity == 0, northward_velocity < 0)
+    pure_eastward = np.logical_and(eastward_velocity > 0, northward_velocity == 0)
+    pure_westward = np.logical_and(eastward_velocity < 0, northward_velocity == 0)
+
+    direction = np.zeros(eastward_velocity.shape, dtype=eastward_velocity.dtype)
+    direction[westward] = 90 - np.arctan(northward_velocity[westward] / eastward_velocity[westward]) / np.pi * 180.
+    direction[eastward] = 270 - np.arctan(northward_velocity[eastward] / eastward_velocity[eastward]) / np.pi * 180.
+    direction[pure_northward] = 180
+    direction[pure_southward] = 0
+    direction[pure_eastward] = 270
+    direction[pure_westward] = 90
+
+    return direction
+
+def legacy_process_merra_data(mpg: MerraPowerGeneration):
+    """Derivation with a new array for every step."""
+    fill = mpg._fill_masked_val
+    variables = mpg.variables
+    variables['pressure_atm'] = fill(variables['PS'] * ATM_PER_PASCAL, 1.0)
+    variables['temperature_c'] = fill(variables['T2M'] - KELV_CELSIUS_OFFSET, 0.0)
+    for height in [2, 10, 50]:
+        variables[f'wind_speed_{height}_m_per_s'] = fill(
+            np.sqrt(variables[f'V{height}M']**2 + variables[f'U{height}M']**2),
+            0.0
+        )
+    variables['wind_direction_deg'] = legacy_wind_direction(variables['U50M'], variables['V50M'])
+    variables['wind_turbine_iec_class'] = mpg._get_band_wind_turbine_class()
+    variables['ghi_w_per_m_2'] = fill(variables['SWGDN'], 0.0)
+
+def get_synthetic_power_generation(n_lats: int, n_lons: int, dtype: str):
+    """Power generation holding random MERRA variables for a grid,
+    with some masked values and calm winds."""
+    mpg = MerraPowerGeneration.__new__(MerraPowerGeneration)
+    mpg.dtype = np.dtype(dtype)
+    mpg.lons = np.arange(n_lons, dtype=np.float64)
+    mpg.lat_band = slice(0, n_lats)
+    mpg.wind_class_datasets = []
+    mpg.variables = {}
+
+    rng = np.random.default_rng(0)
+    shape = (n_lats, n_lons, HOURS_PER_YEAR)
+    for variable, (low, high) in SYNTHETIC_RANGES.items():
+        # filled in place, so generating adds no temporaries
+        values = np.empty(shape, dtype=mpg.dtype)
+        rng.random(out=values, dtype=mpg.dtype)
+        values *= high - low
+        values += low
+        values[:, :, ::97] = default_fillvals['f8']
+        if variable.startswith(('U', 'V')):
+            values[:, :, ::89] = 0
+        mpg.variables[variable] = values
+
+    return mpg
+
+def get_rss_mb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() / BYTES_PER_MEGABYTE
+
+def run_derivation(legacy: bool, n_lats: int, n_lons: int, dtype: str):
+    """Time a derivation, returning seconds and peak RSS above the loaded variables."""
+    logging.disable(logging.INFO)
+    mpg = get_synthetic_power_generation(n_lats, n_lons, dtype)
+    loaded_rss = get_rss_mb()
+
+    start = time.perf_counter()
+    if legacy:
+        legacy_process_merra_data(mpg)
+    else:
+        mpg._process_merra_data()
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return elapsed, peak_rss - loaded_rss
+
+def check_derivations(dtype: str):
+    """Check that both derivations agree on a small grid."""
+    legacy = get_synthetic_power_generation(2, 3, dtype)
+    current = get_synthetic_power_generation(2, 3, dtype)
+    legacy_process_merra_data(legacy)
+    current._process_merra_data()
+    for variable in DERIVED_VARIABLES:
+        assert np.allclose(
+            legacy.variables[variable],
+            current.variables[variable],
+            rtol=1e-6 if dtype == 'float64' else 1e-4,
+            atol=1e-6 if dtype == 'float64' else 1e-3
+        ), f'{variable} differs'
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--n-lats', type=int, default=20)
+    parser.add_argument('--n-lons', type=int, default=50)
+    parser.add_argument('--dtype', choices=('float64', 'float32'), default='float64')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    check_derivations(args.dtype)
+
+    n_cells = args.n_lats * args.n_lons
+    print(f'{args.n_lats}x{args.n_lons} grid, {n_cells * HOURS_PER_YEAR * np.dtype(args.dtype).itemsize / BYTES_PER_MEGABYTE:.0f} MB per variable')
+    print(f'{"derivation":<12}{"seconds":>10}{"peak MB":>10}')
+    for name, legacy in (('before', True), ('after', False)):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            elapsed, peak_mb = executor.submit(
+                run_derivation,
+                legacy,
+                args.n_lats,
+                args.n_lons,
+                args.dtype
+            ).result()
+        print(f'{name:<12}{elapsed:>10.2f}{peak_mb:>10.0f}')
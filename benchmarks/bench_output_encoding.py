@@ -0,0 +1,121 @@
+"""
+Benchmark power generation output encodings.
+
+For each encoding, times writing synthetic capacity factors and
+temperature row by row (as run does), reports the output size, and
+times reading the time series of random cells (as downstream
+analyses of single sites do).
+
+    python benchmarks/bench_output_encoding.py [--n-lats N] [--n-lons N] [--n-reads N]
+"""
+import logging
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from sys import path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from netCDF4 import Dataset
+
+PROJECT_PATH = Path(__file__).parents[1]
+path.insert(0, str(Path(PROJECT_PATH, 'src')))
+
+from power_generation import (
+    MerraPowerGeneration,
+    DEFAULT_OUTPUT_ENCODING,
+    HOURS_PER_YEAR,
+    BYTES_PER_MEGABYTE
+)
+
+ENCODINGS = {
+    'double' : ('.nc', dict()),
+    'float32' : ('.nc', dict(dtype='float32')),
+    'scaled' : ('.nc', dict(scaled=True, temperature='float32')),
+    'scaled zlib' : ('.nc', dict(scaled=True, zlib=True, temperature='float32')),
+    'scaled zlib no temp' : ('.nc', dict(scaled=True, zlib=True, temperature='omit')),
+    'zarr double' : ('.zarr', dict()),
+    'zarr scaled zlib' : ('.zarr', dict(scaled=True, zlib=True, temperature='float32'))
+}
+
+def get_synthetic_row(rng, n_lons: int):
+    """Capacity factors and temperature of a row, with daily
+    solar cycles and autocorrelated wind."""
+    hours = np.arange(HOURS_PER_YEAR)
+    daylight = np.maximum(np.sin((hours % 24 - 6) / 12 * np.pi), 0)
+    clearness = np.repeat(rng.uniform(0.3, 1, (n_lons, HOURS_PER_YEAR // 24)), 24, axis=1)
+    solar = 0.8 * daylight * clearness
+
+    wind_speed = np.abs(np.cumsum(rng.normal(0, 0.5, (n_lons, HOURS_PER_YEAR)), axis=1) % 20 - 10) + 2
+    wind = np.clip((wind_speed - 3) / 9, 0, 1) ** 3
+
+    temperature = 15 + 10 * np.sin(hours / HOURS_PER_YEAR * 2 * np.pi) \
+        + rng.normal(0, 2, (n_lons, HOURS_PER_YEAR))
+    return solar, wind, temperature
+
+def get_size_mb(output_file: Path):
+    if output_file.is_dir():
+        return sum(
+            store_file.stat().st_size for store_file in output_file.rglob('*') if store_file.is_file()
+        ) / BYTES_PER_MEGABYTE
+    return output_file.stat().st_size / BYTES_PER_MEGABYTE
+
+def open_output(output_file: Path, mode: str):
+    if output_file.suffix == '.zarr':
+        import zarr
+        return zarr.open_group(str(output_file), mode=mode)
+    return Dataset(output_file, mode)
+
+def close_output(dataset):
+    if isinstance(dataset, Dataset):
+        dataset.close()
+
+def time_write(output_file: Path, encoding: dict, n_lats: int, n_lons: int):
+    encoding = {**DEFAULT_OUTPUT_ENCODING, **encoding}
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    dataset = MerraPowerGeneration.create_output(
+        output_file,
+        np.linspace(-60, 60, n_lats),
+        np.linspace(-180, 180, n_lons),
+        2020,
+        {},
+        encoding=encoding
+    )
+    variables, _ = MerraPowerGeneration.get_output_dimensions(encoding=encoding)
+    for lat_idx in range(n_lats):
+        row = dict(zip(
+            ('solar_capacity_factor', 'wind_capacity_factor', 'temperature'),
+            get_synthetic_row(rng, n_lons)
+        ))
+        for variable in variables:
+            MerraPowerGeneration.write_output(dataset, variable, lat_idx, row[variable])
+    close_output(dataset)
+    return time.perf_counter() - start
+
+def time_cell_reads(output_file: Path, n_lats: int, n_lons: int, n_reads: int):
+    rng = np.random.default_rng(1)
+    cells = list(zip(rng.integers(n_lats, size=n_reads), rng.integers(n_lons, size=n_reads)))
+    start = time.perf_counter()
+    dataset = open_output(output_file, 'r')
+    for lat_idx, lon_idx in cells:
+        for variable in ('solar_capacity_factor', 'wind_capacity_factor'):
+            MerraPowerGeneration.read_output(dataset, variable, (lat_idx, lon_idx))
+    close_output(dataset)
+    return (time.perf_counter() - start) / n_reads
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--n-lats', type=int, default=20)
+    parser.add_argument('--n-lons', type=int, default=50)
+    parser.add_argument('--n-reads', type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f'{"encoding":<22}{"write s":>10}{"size MB":>10}{"cell read ms":>14}')
+    with TemporaryDirectory() as tmp_dir:
+        for name, (suffix, encoding) in ENCODINGS.items():
+            output_file = Path(tmp_dir, name.replace(' ', '_') + suffix)
+            write_time = time_write(output_file, encoding, args.n_lats, args.n_lons)
+            read_time = time_cell_reads(output_file, args.n_lats, args.n_lons, args.n_reads)
+            print(f'{name:<22}{write_time:>10.2f}{get_size_mb(output_file):>10.1f}{read_time * 1000:>14.2f}')
@@ -0,0 +1,120 @@
+"""
+Benchmark building PySAM resource data for a cell.
+
+Compares the former per-hour construction of solar and wind resource
+dicts with the array-backed row builders of MerraPowerGeneration, and
+checks that both produce the same data.
+
+    python benchmarks/bench_resource_data.py <combined_merra_file> [--lat-idx I]
+
+Cells are taken from a single latitude row, whose irradiance is
+computed before timing, so that only building the dicts is timed.
+"""
+import logging
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from sys import path
+
+PROJECT_PATH = Path(__file__).parents[1]
+path.insert(0, str(Path(PROJECT_PATH, 'src')))
+
+from power_generation import MerraPowerGeneration, HOURS_PER_YEAR
+
+def legacy_solar_resource_data(mpg: MerraPowerGeneration, lat_idx, lon_idx):
+    """Solar resource data built with `list` over NumPy columns."""
+    date_times = mpg.date_times
+    dni, dhi = mpg._get_row_dni_dhi(lat_idx)
+
+    return {
+        'lat' :     mpg.variables['lat'][lat_idx],
+        'lon' :     mpg.variables['lon'][lon_idx],
+        'tz' :      0,
+        'elev' :    0,
+        'year' :    list(date_times.year),
+        'month' :   list(date_times.month),
+        'day' :     list(date_times.day),
+        'hour' :    list(date_times.hour),
+        'minute' :  list(date_times.minute),
+        'dn' :      list(dni[lon_idx]),
+        'df' :      list(dhi[lon_idx]),
+        'tdry' :    list(mpg.variables['temperature_c'][lat_idx, lon_idx, :]),
+        'wspd' :    list(mpg.variables['wind_speed_2_m_per_s'][lat_idx, lon_idx, :])
+    }
+
+def legacy_wind_resource_data(mpg: MerraPowerGeneration, lat_idx, lon_idx):
+    """Wind resource data built with scalar indexing hour by hour."""
+    field_names = ('temperature', 'pressure', 'speed', 'direction')
+    field_variables = {
+        (2, 'temperature') : 'temperature_c',
+        (2, 'pressure') : 'pressure_atm',
+        (2, 'speed') : 'wind_speed_2_m_per_s',
+        (10, 'speed') : 'wind_speed_10_m_per_s',
+        (50, 'speed') : 'wind_speed_50_m_per_s',
+        (50, 'direction') : 'wind_direction_deg',
+    }
+    wind_resource_data = {
+        'heights' : [height for height, _ in field_variables],
+        'fields' : [field_names.index(field_name) + 1 for _, field_name in field_variables],
+        'data' : []
+    }
+    for hour in range(HOURS_PER_YEAR):
+        wind_resource_data['data'].append([
+            mpg.variables[variable][lat_idx, lon_idx, hour]
+            for variable in field_variables.values()
+        ])
+
+    return wind_resource_data
+
+def time_per_cell(build, lat_idx, lon_indices):
+    start = time.perf_counter()
+    for _ in build(lat_idx, lon_indices):
+        pass
+    return (time.perf_counter() - start) / len(lon_indices)
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('combined_merra_file', type=Path)
+    parser.add_argument('--lat-idx', type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    mpg = MerraPowerGeneration(
+        args.combined_merra_file,
+        Path(PROJECT_PATH, 'output', 'bench_resource_data.nc'),
+        Path(PROJECT_PATH, 'input', 'power_curves', 'wind_turbine_power_curves.csv')
+    )
+
+    # irradiance is shared by both builders, compute it up front
+    lat_idx = args.lat_idx
+    lon_indices = list(range(len(mpg.lons)))
+    mpg._get_row_dni_dhi(lat_idx)
+
+    builders = {
+        'solar' : (
+            lambda lat_idx, lon_indices: (
+                legacy_solar_resource_data(mpg, lat_idx, lon_idx) for lon_idx in lon_indices
+            ),
+            mpg._get_row_solar_resource_data
+        ),
+        'wind' : (
+            lambda lat_idx, lon_indices: (
+                legacy_wind_resource_data(mpg, lat_idx, lon_idx) for lon_idx in lon_indices
+            ),
+            mpg._get_row_wind_resource_data
+        )
+    }
+
+    print(f'{"resource":<10}{"before ms/cell":>16}{"after ms/cell":>16}{"speedup":>10}')
+    for resource, (legacy_build, build) in builders.items():
+        legacy = next(legacy_build(lat_idx, lon_indices[:1]))
+        current = next(build(lat_idx, lon_indices[:1]))
+        for column in legacy:
+            assert legacy[column] == current[column], f'{resource} {column} differs'
+
+        legacy_time = time_per_cell(legacy_build, lat_idx, lon_indices)
+        current_time = time_per_cell(build, lat_idx, lon_indices)
+        print(
+            f'{resource:<10}{legacy_time * 1000:>16.2f}{current_time * 1000:>16.2f}'
+            f'{legacy_time / current_time:>10.1f}'
+        )
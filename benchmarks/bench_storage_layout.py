@@ -0,0 +1,86 @@
+"""
+Benchmark combined MERRA storage layouts.
+
+For each layout, times combine_merra.combine, reports file size, and
+times reading every cell's time series (as per-cell simulation does)
+and every latitude row (as banded simulation does).
+
+    python benchmarks/bench_storage_layout.py [--merra-directory DIR] [--year YEAR]
+"""
+import logging
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from sys import path
+from tempfile import TemporaryDirectory
+
+from netCDF4 import Dataset
+
+PROJECT_PATH = Path(__file__).parents[1]
+path.insert(0, str(Path(PROJECT_PATH, 'src')))
+
+from combine_merra import combine, MERRA_VARIABLES
+
+LAYOUTS = {
+    'double contiguous' : dict(),
+    'double row' : dict(chunk_layout='row'),
+    'float row zlib' : dict(storage='float', chunk_layout='row', zlib=True, shuffle=True),
+    'scaled row zlib' : dict(storage='scaled', chunk_layout='row', zlib=True, shuffle=True),
+    'scaled cell zlib' : dict(storage='scaled', chunk_layout='cell', zlib=True, shuffle=True),
+    'scaled row/240h zlib' : dict(
+        storage='scaled',
+        chunk_layout='row',
+        chunk_hours=240,
+        zlib=True,
+        shuffle=True
+    )
+}
+
+def time_reads(combined_file: Path):
+    with Dataset(combined_file) as dataset:
+        n_lats = len(dataset.dimensions['lat'])
+        n_lons = len(dataset.dimensions['lon'])
+
+        start = time.perf_counter()
+        for lat_idx in range(n_lats):
+            for lon_idx in range(n_lons):
+                for variable in MERRA_VARIABLES:
+                    dataset.variables[variable][lat_idx, lon_idx, :]
+        cell_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for lat_idx in range(n_lats):
+            for variable in MERRA_VARIABLES:
+                dataset.variables[variable][lat_idx, :, :]
+        row_seconds = time.perf_counter() - start
+
+    return cell_seconds, row_seconds
+
+def main(merra_directory: Path, year: int):
+    logging.disable(logging.INFO)
+    print(f'{"layout":<22}{"write (s)":>10}{"size (MB)":>11}{"cell reads (s)":>16}{"row reads (s)":>15}')
+
+    with TemporaryDirectory() as tmp_dir:
+        for name, options in LAYOUTS.items():
+            combined_file = Path(tmp_dir, f'{name.replace(" ", "_").replace("/", "_")}.nc')
+
+            start = time.perf_counter()
+            combine(merra_directory, year, combined_file, **options)
+            write_seconds = time.perf_counter() - start
+
+            size_mb = combined_file.stat().st_size / 1024**2
+            cell_seconds, row_seconds = time_reads(combined_file)
+
+            print(f'{name:<22}{write_seconds:>10.2f}{size_mb:>11.1f}{cell_seconds:>16.2f}{row_seconds:>15.2f}')
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument(
+        '--merra-directory',
+        type=Path,
+        default=Path(PROJECT_PATH, 'test_data', 'merra')
+    )
+    parser.add_argument('--year', type=int, default=2020)
+    args = parser.parse_args()
+
+    main(args.merra_directory, args.year)
@@ -0,0 +1,284 @@
+"""
+This script combines daily MERRA files and simulates power generation
+for a range of years, optionally merging the yearly outputs into a
+multi-year dataset.
+"""
+import logging
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from netCDF4 import Dataset
+
+from combine_merra import combine, DAYS_PER_BLOCK, STORAGE_TYPES, CHUNK_LAYOUTS
+from merge_tiles import TILE_ATTRS, open_tile, close_tile
+from power_generation import (
+    MerraPowerGeneration,
+    PROJECT_PATH,
+    HOURS_PER_YEAR,
+    SOLAR_ENGINES,
+    WIND_ENGINES,
+    DTYPES,
+    TEMPERATURE_OUTPUTS
+)
+
+# setup logging
+logging.basicConfig(level=logging.DEBUG)
+
+def get_year_files(output_dir: Path, year: int, suffix: str='.nc'):
+    """Combined MERRA file and power generation output of a year."""
+    return (
+        Path(output_dir, f'combined_merra_{year}.nc'),
+        Path(output_dir, f'merra_power_generation_{year}{suffix}')
+    )
+
+def is_combined(combined_file: Path):
+    """Whether a combined file exists with every day transferred.
+
+    Files combined before days were marked are taken as complete.
+    """
+    if not combined_file.exists():
+        return False
+    with Dataset(combined_file) as dataset:
+        if 'day_complete' not in dataset.variables:
+            return True
+        return bool((dataset['day_complete'][:] == 1).all())
+
+def run_year(
+    merra_directory: Path,
+    output_dir: Path,
+    year: int,
+    wind_power_curve_file: Path,
+    wind_power_curves: dict=None,
+    suffix: str='.nc',
+    combine_options: dict=None,
+    **power_generation_options
+):
+    """Combine a year of daily MERRA files, unless already combined,
+    and simulate its power generation. Returns the output file."""
+    combined_file, output_file = get_year_files(output_dir, year, suffix)
+    if is_combined(combined_file):
+        logging.info(f'Using combined MERRA data in {combined_file}...')
+    else:
+        # partially combined files are appended to
+        combine(merra_directory, year, combined_file, append=True, **(combine_options or {}))
+
+    MerraPowerGeneration(
+        combined_file,
+        output_file,
+        wind_power_curve_file,
+        wind_power_curves=wind_power_curves,
+        **power_generation_options
+    ).run()
+
+    return output_file
+
+def merge_years(output_files: list, multi_year_file: Path):
+    """Merge complete yearly outputs of one grid into netCDF or Zarr
+    output holding the years end to end."""
+    tiles = []
+    try:
+        for output_file in output_files:
+            tiles.append((output_file, *open_tile(output_file)))
+        tiles.sort(key=lambda tile: tile[2]['year'])
+
+        first_file, first, first_attrs = tiles[0]
+        lats = np.array(first['lat'][:])
+        lons = np.array(first['lon'][:])
+        sweep = MerraPowerGeneration.get_output_sweep(first)
+        encoding = MerraPowerGeneration.get_output_encoding(first)
+        for output_file, dataset, attrs in tiles:
+            if not (
+                np.array_equal(dataset['lat'][:], lats)
+                and np.array_equal(dataset['lon'][:], lons)
+            ):
+                raise ValueError(f'{output_file} has a different grid than {first_file}')
+            if MerraPowerGeneration.get_output_sweep(dataset) != sweep:
+                raise ValueError(f'{output_file} has a different sweep than {first_file}')
+            if MerraPowerGeneration.get_output_encoding(dataset) != encoding:
+                raise ValueError(f'{output_file} has a different output encoding than {first_file}')
+            if (np.array(dataset['row_complete'][:]) != 1).any():
+                raise ValueError(f'{output_file} has incomplete rows, resume it first')
+
+        years = [attrs['year'] for _, _, attrs in tiles]
+        if len(set(years)) != len(years):
+            raise ValueError('Outputs hold the same year more than once')
+
+        multi_year_file.parent.mkdir(parents=True, exist_ok=True)
+        merged = MerraPowerGeneration.create_output(
+            multi_year_file,
+            lats,
+            lons,
+            years[0],
+            {
+                **{name : first_attrs[name] for name in TILE_ATTRS if name != 'year'},
+                'years' : years
+            },
+            sweep,
+            encoding,
+            years
+        )
+
+        variables, _ = MerraPowerGeneration.get_output_dimensions(sweep, encoding)
+        try:
+            # copy a row at a time to bound memory
+            for lat_idx in range(len(lats)):
+                logging.info(f'Merging years of latitude {lats[lat_idx]:.2f}...')
+                for year_idx, (_, dataset, _) in enumerate(tiles):
+                    hours = slice(year_idx * HOURS_PER_YEAR, (year_idx + 1) * HOURS_PER_YEAR)
+                    for variable in variables:
+                        MerraPowerGeneration.write_output(
+                            merged,
+                            variable,
+                            (lat_idx, Ellipsis, hours),
+                            MerraPowerGeneration.read_output(dataset, variable, lat_idx)
+                        )
+
+            merged['row_complete'][:] = 1
+        finally:
+            close_tile(merged)
+    finally:
+        for _, dataset, _ in tiles:
+            close_tile(dataset)
+
+def run_batch(
+    merra_directory: Path,
+    output_dir: Path,
+    years: list,
+    wind_power_curve_file: Path,
+    concurrent_years: int=1,
+    suffix: str='.nc',
+    combine_options: dict=None,
+    multi_year_file: Path=None,
+    **power_generation_options
+):
+    """Combine and simulate each year, `concurrent_years` at a time.
+
+    Years run in long-lived processes forked from this one, so
+    libraries are imported and power curves read once rather than
+    for every year. Each year is combined and then simulated, so
+    one year's simulation overlaps the combining of the next.
+    Returns the yearly output files.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    wind_power_curves = MerraPowerGeneration.read_power_curves(wind_power_curve_file)
+    year_args = (wind_power_curve_file, wind_power_curves, suffix, combine_options)
+
+    if concurrent_years > 1:
+        logging.info(f'Running {len(years)} years, {concurrent_years} at a time...')
+        with ProcessPoolExecutor(max_workers=concurrent_years) as executor:
+            futures = [
+                executor.submit(
+                    run_year,
+                    merra_directory,
+                    output_dir,
+                    year,
+                    *year_args,
+                    **power_generation_options
+                )
+                for year in years
+            ]
+            output_files = [future.result() for future in futures]
+    else:
+        output_files = [
+            run_year(merra_directory, output_dir, year, *year_args, **power_generation_options)
+            for year in years
+        ]
+
+    if multi_year_file is not None:
+        merge_years(output_files, multi_year_file)
+
+    return output_files
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('merra_directory', type=Path)
+    parser.add_argument('output_dir', type=Path)
+    parser.add_argument('first_year', type=int)
+    parser.add_argument('last_year', type=int)
+    parser.add_argument('--concurrent-years', type=int, default=1)
+    parser.add_argument('--multi-year-file', type=Path)
+    parser.add_argument('--zarr-output', action='store_true')
+    parser.add_argument(
+        '--wind-power-curve-file',
+        type=Path,
+        default=Path(
+            PROJECT_PATH,
+            'input',
+            'power_curves',
+            'wind_turbine_power_curves.csv'
+        )
+    )
+
+    # combine options
+    parser.add_argument('--combine-workers', type=int, default=1)
+    parser.add_argument('--block-days', type=int, default=DAYS_PER_BLOCK)
+    parser.add_argument('--storage', choices=STORAGE_TYPES, default='double')
+    parser.add_argument('--chunk-layout', choices=CHUNK_LAYOUTS, default='contiguous')
+    parser.add_argument('--chunk-hours', type=int)
+    parser.add_argument('--zlib', action='store_true')
+    parser.add_argument('--complevel', type=int, default=4)
+    parser.add_argument('--shuffle', action='store_true')
+
+    # power generation options
+    parser.add_argument('--mask-files', type=Path, nargs='+')
+    parser.add_argument(
+        '--bounding-box',
+        type=float,
+        nargs=4,
+        metavar=('MIN_LAT', 'MAX_LAT', 'MIN_LON', 'MAX_LON')
+    )
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--solar-engine', choices=SOLAR_ENGINES, default='pysam')
+    parser.add_argument('--wind-engine', choices=WIND_ENGINES, default='pysam')
+    parser.add_argument('--max-memory-mb', type=float)
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--derived-cache-dir', type=Path)
+    parser.add_argument('--result-cache-dir', type=Path)
+    parser.add_argument('--result-cache-max-mb', type=float)
+    parser.add_argument('--sweep-file', type=Path)
+    parser.add_argument('--dtype', choices=DTYPES, default='float64')
+    parser.add_argument('--scaled-output', action='store_true')
+    parser.add_argument('--output-zlib', action='store_true')
+    parser.add_argument('--output-complevel', type=int, default=4)
+    parser.add_argument('--output-temperature', choices=TEMPERATURE_OUTPUTS, default='full')
+    parser.add_argument('--solar-geometry-dir', type=Path)
+
+    args = parser.parse_args()
+
+    run_batch(
+        args.merra_directory,
+        args.output_dir,
+        list(range(args.first_year, args.last_year + 1)),
+        args.wind_power_curve_file,
+        concurrent_years=args.concurrent_years,
+        suffix='.zarr' if args.zarr_output else '.nc',
+        combine_options=dict(
+            workers=args.combine_workers,
+            block_days=args.block_days,
+            storage=args.storage,
+            chunk_layout=args.chunk_layout,
+            chunk_hours=args.chunk_hours,
+            zlib=args.zlib,
+            complevel=args.complevel,
+            shuffle=args.shuffle
+        ),
+        multi_year_file=args.multi_year_file,
+        mask_files=args.mask_files,
+        bounding_box=args.bounding_box,
+        workers=args.workers,
+        solar_engine=args.solar_engine,
+        wind_engine=args.wind_engine,
+        max_memory_mb=args.max_memory_mb,
+        resume=args.resume,
+        derived_cache_dir=args.derived_cache_dir,
+        result_cache_dir=args.result_cache_dir,
+        result_cache_max_mb=args.result_cache_max_mb,
+        sweep_file=args.sweep_file,
+        dtype=args.dtype,
+        scaled_output=args.scaled_output,
+        output_zlib=args.output_zlib,
+        output_complevel=args.output_complevel,
+        output_temperature=args.output_temperature,
+        solar_geometry_dir=args.solar_geometry_dir
+    )
@@ -6,8 +6,10 @@ from argparse import ArgumentParser
 from pathlib import Path
 import pandas as pd
 import numpy as np
-from netCDF4 import Dataset
+from netCDF4 import Dataset, num2date
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
 import re
 
@@ -26,6 +28,35 @@ MERRA_VARIABLES = [
     'PS',
     'SWGDN'
 ]
+HOURS_PER_DAY = 24
+DAYS_PER_YEAR = 365
+HOURS_PER_YEAR = 24*365
+DAYS_PER_BLOCK = 10
+BYTES_PER_MEGABYTE = 1024**2
+
+# storage types for data variables
+STORAGE_TYPES = {
+    'double' : 'f8',
+    'float' : 'f4',
+    'scaled' : 'i2'
+}
+SCALED_FILL_VALUE = -32768
+
+# physical ranges packed into scaled 16-bit integers, values outside are clipped
+MERRA_VARIABLE_RANGES = {
+    'U2M' : (-100, 100),
+    'U10M' : (-100, 100),
+    'U50M' : (-100, 100),
+    'V2M' : (-100, 100),
+    'V10M' : (-100, 100),
+    'V50M' : (-100, 100),
+    'T2M' : (150, 350),
+    'PS' : (40000, 110000),
+    'SWGDN' : (0, 1500)
+}
+
+# chunk layouts tuned for reading time series of a cell or a latitude row
+CHUNK_LAYOUTS = ('contiguous', 'cell', 'row')
 
 def get_merra_files_by_date(merra_directory: Path, year: int):
     """Iterate over a directory to find all merra files.
@@ -57,10 +88,45 @@ def get_merra_dimensions(net_cdf: Path):
     lon = dataset.variables['lon'][:]
     return lat, lon
 
-def initialize_dataset(dataset: Dataset, lat: list, lon:list, year:int):
+def get_scale_offset(variable: str):
+    """Scale factor and offset packing a variable's range into 16 bits."""
+    min_val, max_val = MERRA_VARIABLE_RANGES[variable]
+    return (max_val - min_val) / (2 * (2**15 - 1)), (max_val + min_val) / 2
+
+def clip_to_range(block: np.ma.MaskedArray, variable: str):
+    """Clip a block to its variable's packed range, so that
+    out-of-range values saturate instead of overflowing 16 bits."""
+    min_val, max_val = MERRA_VARIABLE_RANGES[variable]
+    n_clipped = np.ma.filled((block < min_val) | (block > max_val), False).sum()
+    if n_clipped:
+        logging.warning(f'Clipping {n_clipped} values of {variable} to [{min_val}, {max_val}]')
+    return np.ma.clip(block, min_val, max_val)
+
+def get_chunk_shape(layout: str, n_lats: int, n_lons: int, chunk_hours: int=HOURS_PER_YEAR):
+    """Chunk shape of data variables, or None for contiguous storage."""
+    if layout == 'cell':
+        return (1, 1, chunk_hours)
+    if layout == 'row':
+        return (1, n_lons, chunk_hours)
+    return None
+
+def initialize_dataset(
+    dataset: Dataset,
+    lat: list,
+    lon:list,
+    year:int,
+    storage: str='double',
+    chunk_layout: str='contiguous',
+    chunk_hours: int=None,
+    zlib: bool=False,
+    complevel: int=4,
+    shuffle: bool=False,
+    chunk_cache_mb: float=512
+):
     dataset.createDimension('lat', len(lat))
     dataset.createDimension('lon', len(lon))
     dataset.createDimension('time', 8760)
+    dataset.createDimension('day', DAYS_PER_YEAR)
     dataset.year = year
 
     # create primary variables
@@ -69,69 +135,476 @@ def initialize_dataset(dataset: Dataset, lat: list, lon:list, year:int):
     lat_var[:] = lat
     lon_var[:] = lon
 
+    chunk_shape = get_chunk_shape(
+        chunk_layout,
+        len(lat),
+        len(lon),
+        chunk_hours or HOURS_PER_YEAR
+    )
+    storage_type = STORAGE_TYPES[storage]
+
     # create data variables
     for variable in MERRA_VARIABLES:
-        dataset.createVariable(variable, 'double', ('lat', 'lon', 'time'))
+        combined_var = dataset.createVariable(
+            variable,
+            storage_type,
+            ('lat', 'lon', 'time'),
+            zlib=zlib,
+            complevel=complevel,
+            shuffle=shuffle,
+            chunksizes=chunk_shape,
+            fill_value=SCALED_FILL_VALUE if storage == 'scaled' else None
+        )
+
+        # values are packed on write and unpacked on read
+        if storage == 'scaled':
+            combined_var.scale_factor, combined_var.add_offset = get_scale_offset(variable)
+
+    # completion marker, set once every variable of a day is written
+    dataset.createVariable('day_complete', 'i1', ('day'), fill_value=0)
+
+    set_chunk_cache(dataset, chunk_cache_mb)
+
+def set_chunk_cache(dataset: Dataset, chunk_cache_mb: float):
+    """Keep chunks of a block in cache until they are complete."""
+    for variable in MERRA_VARIABLES:
+        combined_var = dataset.variables[variable]
+        if combined_var.chunking() != 'contiguous':
+            combined_var.set_var_chunk_cache(
+                size=int(chunk_cache_mb * BYTES_PER_MEGABYTE)
+            )
+
+def initialize_zarr_store(
+    output_file: Path,
+    lat: list,
+    lon: list,
+    year: int,
+    block_days: int,
+    storage: str='double',
+    chunk_layout: str='contiguous',
+    chunk_hours: int=None,
+    zlib: bool=False,
+    complevel: int=4,
+    shuffle: bool=False
+):
+    """Create a Zarr store laid out like the combined netCDF.
+
+    Time chunks must divide blocks of days, so that workers
+    writing different blocks never share a chunk. Returns the
+    open group.
+    """
+    import zarr
+    import numcodecs
+
+    chunk_hours = chunk_hours or block_days * HOURS_PER_DAY
+    check_zarr_chunks(block_days, chunk_hours)
 
-def transfer_merra_file(combined_dataset: Dataset, merra_dataset: Dataset, day: int):
+    group = zarr.open_group(str(output_file), mode='w')
+    group.attrs['year'] = year
+
+    # create primary variables
+    for name, values in (('lat', lat), ('lon', lon)):
+        coordinate = group.create_dataset(name, data=np.asarray(values, dtype=np.float64))
+        coordinate.attrs['_ARRAY_DIMENSIONS'] = [name]
+
+    chunk_shape = get_chunk_shape(chunk_layout, len(lat), len(lon), chunk_hours) \
+        or (len(lat), len(lon), chunk_hours)
+    storage_type = STORAGE_TYPES[storage]
+    filters = [numcodecs.Shuffle(np.dtype(storage_type).itemsize)] if shuffle else None
+    compressor = numcodecs.Zlib(level=complevel) if zlib else None
+
+    # create data variables
     for variable in MERRA_VARIABLES:
-        try:
-            combined_var = combined_dataset.variables[variable]
-            daily_var = merra_dataset.variables[variable]
-
-            # MERRA orders dimensions [time, lat, lon], we reorder [lat, lon, time]
-            reordered_daily = np.transpose(daily_var[:], axes=[1, 2, 0])
-            
-            start_hour = day*24
-            end_hour = (day+1)*24
-
-            combined_var[:, :, start_hour:end_hour] = reordered_daily
-
-            assert(combined_var[0,0,start_hour] == daily_var[0,0,0])
-            assert(combined_var[0,0,end_hour-1] == daily_var[-1,0,0])
-            assert(combined_var[-1,0,start_hour] == daily_var[0,-1,0])
-            assert(combined_var[0,-1,start_hour] == daily_var[0,0,-1])
-            assert(combined_var[-1,-1,end_hour-1] == daily_var[-1,-1,-1])
-        except KeyError:
-            pass
-
-def combine(merra_directory: Path, year: int, output_file: Path):
+        combined_var = group.create_dataset(
+            variable,
+            shape=(len(lat), len(lon), HOURS_PER_YEAR),
+            chunks=chunk_shape,
+            dtype=storage_type,
+            fill_value=SCALED_FILL_VALUE if storage == 'scaled' else np.nan,
+            filters=filters,
+            compressor=compressor
+        )
+        combined_var.attrs['_ARRAY_DIMENSIONS'] = ['lat', 'lon', 'time']
+
+        # values are unpacked on read
+        if storage == 'scaled':
+            scale_factor, add_offset = get_scale_offset(variable)
+            combined_var.attrs['scale_factor'] = scale_factor
+            combined_var.attrs['add_offset'] = add_offset
+
+    # completion marker, only written by the parent process
+    marker_var = group.create_dataset(
+        'day_complete',
+        shape=(DAYS_PER_YEAR,),
+        chunks=(DAYS_PER_YEAR,),
+        dtype='i1',
+        fill_value=0
+    )
+    marker_var.attrs['_ARRAY_DIMENSIONS'] = ['day']
+
+    zarr.consolidate_metadata(group.store)
+    return group
+
+def check_zarr_chunks(block_days: int, chunk_hours: int):
+    """Raise a ValueError unless time chunks divide blocks of days."""
+    if (block_days * HOURS_PER_DAY) % chunk_hours != 0:
+        raise ValueError(
+            f'Zarr time chunks of {chunk_hours} hours do not divide '
+            f'blocks of {block_days} days'
+        )
+
+def open_combined_output(output_file: Path, lat: list, lon: list, year: int):
+    """Open an existing combined file or Zarr store for appending.
+
+    Raises a ValueError if it was written for another year or grid,
+    or without per-day bookkeeping.
+    """
+    if output_file.suffix == '.zarr':
+        import zarr
+        dataset = zarr.open_group(str(output_file), mode='r+')
+        output_year = dataset.attrs.get('year')
+        variables = list(dataset.array_keys())
+    else:
+        dataset = Dataset(output_file, 'a')
+        output_year = getattr(dataset, 'year', None)
+        variables = list(dataset.variables)
+
+    if output_year != year \
+        or not np.array_equal(dataset['lat'][:], lat) \
+        or not np.array_equal(dataset['lon'][:], lon):
+        error = f'{output_file} does not match the {year} MERRA grid'
+    elif 'day_complete' not in variables:
+        error = f'{output_file} has no day_complete bookkeeping, combine it again to append'
+    else:
+        return dataset
+
+    if isinstance(dataset, Dataset):
+        dataset.close()
+    raise ValueError(error)
+
+def get_merra_days(year: int):
+    """Dates stored in a combined file, skipping leap day."""
+    return [
+        merra_date.date()
+        for merra_date in pd.date_range(
+            datetime(year, 1, 1),
+            datetime(year, 12, 31)
+        )
+        if not (merra_date.month == 2 and merra_date.day == 29)
+    ]
+
+def get_day_blocks(days: list, block_days: int):
+    """Split sorted day indices into runs of consecutive days
+    within aligned windows of `block_days` days.
+    """
+    blocks = []
+    for day in days:
+        if blocks and day == blocks[-1][-1] + 1 and day // block_days == blocks[-1][0] // block_days:
+            blocks[-1].append(day)
+        else:
+            blocks.append([day])
+    return blocks
+
+def get_day_windows(days: list, block_days: int):
+    """Group sorted day indices by aligned windows of `block_days`
+    days, keeping gaps within a window.
+
+    Zarr time chunks divide these windows, so tasks writing
+    different windows never share a chunk.
+    """
+    windows = []
+    for day in days:
+        if windows and day // block_days == windows[-1][0] // block_days:
+            windows[-1].append(day)
+        else:
+            windows.append([day])
+    return windows
+
+def check_merra_hours(merra_file: Path, time_var):
+    """Check that a daily file holds the hours of the date in its
+    name, which places it in the combined year, in order."""
+    merra_date = datetime.strptime(
+        re.findall(r'([0-9]{8})\.nc4\.nc4$', merra_file.name)[0],
+        r'%Y%m%d'
+    ).date()
+    # MERRA's time valid_range does not fit its integer type
+    time_var.set_auto_mask(False)
+    times = num2date(
+        time_var[:],
+        time_var.units,
+        only_use_cftime_datetimes=False,
+        only_use_python_datetimes=True
+    )
+    if [(time.date(), time.hour) for time in times] != [(merra_date, hour) for hour in range(HOURS_PER_DAY)]:
+        raise ValueError(f'{merra_file} does not hold the hours of {merra_date} in order')
+
+def read_merra_file(merra_file: Path):
+    """Read the MERRA variables in a daily file."""
+    logging.info(f'Reading file {merra_file}...')
+    with Dataset(merra_file) as merra_dataset:
+        # days and hours are placed by position, so check them first
+        check_merra_hours(merra_file, merra_dataset.variables['time'])
+        # MERRA orders dimensions [time, lat, lon], we reorder [lat, lon, time]
+        return {
+            variable : np.ma.transpose(merra_dataset.variables[variable][:], axes=[1, 2, 0])
+            for variable in MERRA_VARIABLES
+            if variable in merra_dataset.variables
+        }
+
+def assemble_merra_block(daily_data: list, variable: str, day_shape: tuple, start_day: int):
+    """Assemble consecutive days of a variable into one block.
+
+    `daily_data` holds, for each day, the variables read from each of
+    that day's files. Days without data stay masked. Returns None if
+    no file has the variable.
+    """
+    block = np.ma.array(
+        np.zeros(day_shape[:2] + (len(daily_data) * HOURS_PER_DAY,)),
+        mask=True
+    )
+    found = False
+    for day, file_data in enumerate(daily_data):
+        for data in file_data:
+            if variable not in data:
+                continue
+
+            # check daily data against the combined grid
+            if data[variable].shape != day_shape:
+                raise ValueError(
+                    f'{variable} has shape {data[variable].shape} '
+                    f'on day {start_day + day}, expected {day_shape}'
+                )
+
+            block[:, :, day*HOURS_PER_DAY:(day+1)*HOURS_PER_DAY] = data[variable]
+            found = True
+
+    return block if found else None
+
+def get_complete_days(daily_data: list, start_day: int):
+    """Days of a block whose files hold every MERRA variable."""
+    return [
+        start_day + day
+        for day, file_data in enumerate(daily_data)
+        if all(any(variable in data for data in file_data) for variable in MERRA_VARIABLES)
+    ]
+
+def transfer_merra_block(combined_dataset: Dataset, daily_data: list, start_day: int):
+    """Write consecutive days of MERRA data with one write per variable.
+
+    Returns the days that are complete.
+    """
+    n_lats = len(combined_dataset.dimensions['lat'])
+    n_lons = len(combined_dataset.dimensions['lon'])
+
+    for variable in MERRA_VARIABLES:
+        combined_var = combined_dataset.variables[variable]
+        block = assemble_merra_block(
+            daily_data,
+            variable,
+            (n_lats, n_lons, HOURS_PER_DAY),
+            start_day
+        )
+
+        # scaled integers are packed from floats when written
+        if block is not None:
+            if 'scale_factor' in combined_var.ncattrs():
+                block = clip_to_range(block, variable)
+            start_hour = start_day*HOURS_PER_DAY
+            end_hour = start_hour + block.shape[2]
+            combined_var[:, :, start_hour:end_hour] = block
+
+    return get_complete_days(daily_data, start_day)
+
+def transfer_zarr_block(output_file: Path, window_files: list, window: list):
+    """Read days of MERRA files within one window and write them
+    to the window's own chunks of a Zarr store.
+
+    Days of the window missing from `window`, such as days already
+    appended, keep their stored values. Returns the days that are
+    complete.
+    """
+    import zarr
+
+    group = zarr.open_group(str(output_file), mode='r+')
+    start_day = window[0]
+    daily_data = [[] for _ in range(window[-1] - start_day + 1)]
+    for day, day_files in zip(window, window_files):
+        daily_data[day - start_day] = [read_merra_file(merra_file) for merra_file in day_files]
+
+    # hours of the days being written
+    new_hours = np.zeros(len(daily_data) * HOURS_PER_DAY, dtype=bool)
+    for day in window:
+        new_hours[(day - start_day)*HOURS_PER_DAY:(day - start_day + 1)*HOURS_PER_DAY] = True
+
+    for variable in MERRA_VARIABLES:
+        combined_var = group[variable]
+        block = assemble_merra_block(
+            daily_data,
+            variable,
+            combined_var.shape[:2] + (HOURS_PER_DAY,),
+            start_day
+        )
+        if block is None:
+            continue
+
+        # pack and fill masked values
+        if 'scale_factor' in combined_var.attrs:
+            block = np.ma.round(
+                (clip_to_range(block, variable) - combined_var.attrs['add_offset'])
+                / combined_var.attrs['scale_factor']
+            )
+        block = np.ma.filled(block, combined_var.fill_value).astype(combined_var.dtype)
+
+        start_hour = start_day*HOURS_PER_DAY
+        end_hour = start_hour + block.shape[2]
+        if not new_hours.all():
+            block = np.where(new_hours, block, combined_var[:, :, start_hour:end_hour])
+        combined_var[:, :, start_hour:end_hour] = block
+
+    return get_complete_days(daily_data, start_day)
+
+def _submit_block(executor: ProcessPoolExecutor, block_files: list):
+    return [
+        [executor.submit(read_merra_file, merra_file) for merra_file in day_files]
+        for day_files in block_files
+    ]
+
+def _read_blocks(blocks_files: list, executor: ProcessPoolExecutor=None):
+    """Yield the daily data of each block of files.
+
+    With an executor, the next block is read while the
+    current one is written.
+    """
+    if executor is None:
+        for block_files in blocks_files:
+            yield [
+                [read_merra_file(merra_file) for merra_file in day_files]
+                for day_files in block_files
+            ]
+        return
+
+    pending = _submit_block(executor, blocks_files[0]) if blocks_files else None
+    for block_idx in range(len(blocks_files)):
+        daily_data = [
+            [future.result() for future in day_futures]
+            for day_futures in pending
+        ]
+        if block_idx + 1 < len(blocks_files):
+            pending = _submit_block(executor, blocks_files[block_idx + 1])
+        yield daily_data
+
+def combine(
+    merra_directory: Path,
+    year: int,
+    output_file: Path,
+    workers: int=1,
+    block_days: int=DAYS_PER_BLOCK,
+    append: bool=False,
+    **storage_options
+):
+    """Combine a year of daily MERRA files.
+
+    With `append`, an existing combined file is opened and only days
+    not yet marked complete are transferred. `storage_options` are
+    passed to `initialize_dataset` for new files.
+    """
     logging.info('Starting program...')
     # get merra files from directory
     merra_files = get_merra_files_by_date(merra_directory, year)
 
-    # find variables and dimensions 
-    sample_net_cdf = merra_files[datetime(year, 1, 1).date()][0]
+    # find variables and dimensions, from the first day found
+    # since appended days may arrive in any order
+    sample_net_cdf = merra_files[min(merra_files)][0]
     lats, lons = get_merra_dimensions(sample_net_cdf)
 
     # make directory if necessary
     output_file.parent.mkdir(parents=True, exist_ok=True)
 
-    # write combined file
-    with Dataset(output_file, 'w') as combined_dataset:
-        initialize_dataset(combined_dataset, lats, lons, year)
+    # setup output, or reopen it to append
+    merra_days = get_merra_days(year)
+    days = range(len(merra_days))
+    zarr_output = output_file.suffix == '.zarr'
+    chunk_cache_mb = storage_options.pop('chunk_cache_mb', 512)
+    if append and output_file.exists():
+        combined_dataset = open_combined_output(output_file, lats, lons, year)
+        complete_days = np.array(combined_dataset['day_complete'][:]) == 1
+        days = [
+            day for day in days
+            if not complete_days[day] and merra_days[day] in merra_files
+        ]
+        logging.info(f'Appending {len(days)} days...')
+        if zarr_output:
+            check_zarr_chunks(block_days, combined_dataset[MERRA_VARIABLES[0]].chunks[2])
+        else:
+            set_chunk_cache(combined_dataset, chunk_cache_mb)
+    elif zarr_output:
+        combined_dataset = initialize_zarr_store(
+            output_file,
+            lats,
+            lons,
+            year,
+            block_days,
+            **storage_options
+        )
+    else:
+        combined_dataset = Dataset(output_file, 'w')
+        initialize_dataset(
+            combined_dataset,
+            lats,
+            lons,
+            year,
+            chunk_cache_mb=chunk_cache_mb,
+            **storage_options
+        )
 
-        # iterate through dates
-        day = 0
-        for merra_date in pd.date_range(
-            datetime(year, 1, 1),
-            datetime(year, 12, 31)
-        ):
-            # skip leap day
-            if merra_date.month == 2 and merra_date.day == 29:
-                continue
+    # group days into blocks of rad and slv files. Zarr blocks
+    # are whole windows, so that concurrent writers never share
+    # a chunk, even when appending days with gaps between them
+    blocks = get_day_windows(days, block_days) if zarr_output else get_day_blocks(days, block_days)
+    blocks_files = [
+        [merra_files[merra_days[day]] for day in block]
+        for block in blocks
+    ]
+
+    # a single worker reads inline, without starting processes
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    with executor or nullcontext():
+        # workers write their own blocks of a zarr store
+        if zarr_output:
+            for complete_days in (executor.map if executor else map)(
+                transfer_zarr_block,
+                [output_file] * len(blocks),
+                blocks_files,
+                blocks
+            ):
+                if complete_days:
+                    combined_dataset['day_complete'][complete_days] = 1
+            return
+
+        with combined_dataset:
+            for block, daily_data in zip(blocks, _read_blocks(blocks_files, executor)):
+                logging.info(f'Writing days {block[0]} to {block[-1]}...')
+                complete_days = transfer_merra_block(combined_dataset, daily_data, block[0])
+
+                # flush data before the marker, so a marked day is always on disk
+                combined_dataset.sync()
+                if complete_days:
+                    combined_dataset['day_complete'][complete_days] = 1
 
-            # add rad and slv files
-            for merra_file in merra_files[merra_date.date()]:
-                logging.info(f'Adding file {merra_file}...')
-                with Dataset(merra_file) as merra_dataset:
-                    transfer_merra_file(combined_dataset, merra_dataset, day)
-            day += 1
-                
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('merra_directory', type=Path)
     parser.add_argument('year', type=int)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--block-days', type=int, default=DAYS_PER_BLOCK)
+    parser.add_argument('--storage', choices=STORAGE_TYPES, default='double')
+    parser.add_argument('--chunk-layout', choices=CHUNK_LAYOUTS, default='contiguous')
+    parser.add_argument('--chunk-hours', type=int)
+    parser.add_argument('--chunk-cache-mb', type=float, default=512)
+    parser.add_argument('--zlib', action='store_true')
+    parser.add_argument('--complevel', type=int, default=4)
+    parser.add_argument('--shuffle', action='store_true')
+    parser.add_argument('--append', action='store_true')
 
     # get directory and year
     args = parser.parse_args()
@@ -144,4 +617,18 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    combine(args.merra_directory, args.year, args.output_file)
\ No newline at end of file
+    combine(
+        args.merra_directory,
+        args.year,
+        args.output_file,
+        workers=args.workers,
+        block_days=args.block_days,
+        append=args.append,
+        storage=args.storage,
+        chunk_layout=args.chunk_layout,
+        chunk_hours=args.chunk_hours,
+        chunk_cache_mb=args.chunk_cache_mb,
+        zlib=args.zlib,
+        complevel=args.complevel,
+        shuffle=args.shuffle
+    )
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+This script merges the outputs of power_generation.py tile jobs
+into a single capacity factor dataset.
+"""
+import logging
+from argparse import ArgumentParser
+from pathlib import Path
+import numpy as np
+from netCDF4 import Dataset
+
+from power_generation import MerraPowerGeneration
+
+# setup logging
+logging.basicConfig(level=logging.DEBUG)
+
+TILE_ATTRS = ('year', 'grid_n_lats', 'grid_n_lons', 'grid_lat_start', 'grid_lon_start')
+
+def open_tile(tile_file: Path):
+    """Open tile output, returning the dataset and its attributes."""
+    if tile_file.suffix == '.zarr':
+        import zarr
+        dataset = zarr.open_group(str(tile_file), mode='r')
+        attrs = dict(dataset.attrs)
+    else:
+        dataset = Dataset(tile_file)
+        attrs = {name : dataset.getncattr(name) for name in dataset.ncattrs()}
+
+    missing_attrs = [name for name in TILE_ATTRS if name not in attrs]
+    if missing_attrs:
+        raise ValueError(f'{tile_file} is not power generation output, missing {missing_attrs}')
+
+    return dataset, {name : int(attrs[name]) for name in TILE_ATTRS}
+
+def close_tile(dataset):
+    # zarr groups need no closing
+    if isinstance(dataset, Dataset):
+        dataset.close()
+
+def check_coverage(tile_files: list):
+    """Check that complete tiles cover one grid exactly once.
+
+    Returns the year, latitudes, longitudes, sweep and output encoding
+    of the merged grid. Raises a ValueError otherwise.
+    """
+    grid = None
+    coverage = None
+    for tile_file in tile_files:
+        dataset, attrs = open_tile(tile_file)
+        try:
+            tile_grid = (attrs['year'], attrs['grid_n_lats'], attrs['grid_n_lons'])
+            tile_sweep = MerraPowerGeneration.get_output_sweep(dataset)
+            tile_encoding = MerraPowerGeneration.get_output_encoding(dataset)
+            if grid is None:
+                grid = tile_grid
+                sweep = tile_sweep
+                encoding = tile_encoding
+                coverage = np.zeros(grid[1:], dtype=int)
+                lats = np.full(grid[1], np.nan)
+                lons = np.full(grid[2], np.nan)
+            elif tile_grid != grid:
+                raise ValueError(f'{tile_file} is from a different year or grid than {tile_files[0]}')
+            elif tile_sweep != sweep:
+                raise ValueError(f'{tile_file} has a different sweep than {tile_files[0]}')
+            elif tile_encoding != encoding:
+                raise ValueError(f'{tile_file} has a different output encoding than {tile_files[0]}')
+
+            # incomplete rows would be merged as fill values
+            incomplete_rows = np.flatnonzero(np.array(dataset['row_complete'][:]) != 1)
+            if len(incomplete_rows):
+                raise ValueError(f'{tile_file} has {len(incomplete_rows)} incomplete rows, resume it first')
+
+            lat_slice = slice(attrs['grid_lat_start'], attrs['grid_lat_start'] + len(dataset['lat']))
+            lon_slice = slice(attrs['grid_lon_start'], attrs['grid_lon_start'] + len(dataset['lon']))
+            coverage[lat_slice, lon_slice] += 1
+            lats[lat_slice] = dataset['lat'][:]
+            lons[lon_slice] = dataset['lon'][:]
+        finally:
+            close_tile(dataset)
+
+    if coverage is None:
+        raise ValueError('No tiles to merge')
+    if (coverage > 1).any():
+        raise ValueError(f'{(coverage > 1).sum()} cells are covered by more than one tile')
+    if (coverage == 0).any():
+        missing_rows = np.flatnonzero((coverage == 0).any(axis=1))
+        raise ValueError(
+            f'{(coverage == 0).sum()} cells are not covered by any tile, '
+            f'in latitude rows {missing_rows.tolist()}'
+        )
+
+    return grid[0], lats, lons, sweep, encoding
+
+def merge_tiles(tile_files: list, output_file: Path):
+    """Merge tile outputs into netCDF or Zarr output for the full grid."""
+    year, lats, lons, sweep, encoding = check_coverage(tile_files)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    merged = MerraPowerGeneration.create_output(
+        output_file,
+        lats,
+        lons,
+        year,
+        {
+            'grid_n_lats' : len(lats),
+            'grid_n_lons' : len(lons),
+            'grid_lat_start' : 0,
+            'grid_lon_start' : 0
+        },
+        sweep,
+        encoding
+    )
+
+    variables, _ = MerraPowerGeneration.get_output_dimensions(sweep, encoding)
+    try:
+        for tile_file in tile_files:
+            logging.info(f'Merging {tile_file}...')
+            dataset, attrs = open_tile(tile_file)
+            try:
+                # copy a row at a time to bound memory
+                lon_slice = slice(attrs['grid_lon_start'], attrs['grid_lon_start'] + len(dataset['lon']))
+                for lat_idx in range(len(dataset['lat'])):
+                    merged_lat_idx = attrs['grid_lat_start'] + lat_idx
+                    for variable in variables:
+                        MerraPowerGeneration.write_output(
+                            merged,
+                            variable,
+                            (merged_lat_idx, lon_slice),
+                            MerraPowerGeneration.read_output(dataset, variable, lat_idx)
+                        )
+            finally:
+                close_tile(dataset)
+
+        merged['row_complete'][:] = 1
+    finally:
+        close_tile(merged)
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('output_file', type=Path)
+    parser.add_argument('tile_files', type=Path, nargs='+')
+    args = parser.parse_args()
+
+    merge_tiles(args.tile_files, args.output_file)
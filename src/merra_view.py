@@ -0,0 +1,130 @@
+"""
+This script opens a year of daily MERRA netcdf's as a lazy dataset,
+laid out like the combined file written by combine_merra.py.
+"""
+import logging
+from pathlib import Path
+import numpy as np
+import xarray as xr
+from netCDF4 import Dataset, default_fillvals
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+from combine_merra import (
+    get_merra_files_by_date,
+    get_merra_dimensions,
+    get_merra_days,
+    MERRA_VARIABLES,
+    HOURS_PER_DAY,
+    HOURS_PER_YEAR
+)
+
+def get_merra_collection(merra_file: Path):
+    """Collection of a daily file, e.g. 'tavg1_2d_rad_Nx'."""
+    return merra_file.name.split('.')[1]
+
+class DailyMerraArray(BackendArray):
+    """A (lat, lon, time) variable read on demand from daily files.
+
+    Only the days and grid cells covered by an index are read. Days
+    without a file, and masked values, hold the netCDF default fill
+    value, as in a combined file.
+    """
+    def __init__(self, variable: str, day_files: list, n_lats: int, n_lons: int):
+        self.variable = variable
+        self.day_files = day_files
+        self.shape = (n_lats, n_lons, HOURS_PER_YEAR)
+        self.dtype = np.dtype(np.float64)
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key,
+            self.shape,
+            indexing.IndexingSupport.BASIC,
+            self._read
+        )
+
+    def _read(self, key: tuple):
+        # integer indices are read as length one slices and dropped after
+        int_axes = tuple(
+            axis for axis, axis_key in enumerate(key)
+            if isinstance(axis_key, (int, np.integer))
+        )
+        lat_key, lon_key, time_key = (
+            slice(axis_key, axis_key + 1) if axis in int_axes else axis_key
+            for axis, axis_key in enumerate(key)
+        )
+        hours = np.arange(HOURS_PER_YEAR)[time_key]
+        values = np.full((
+            len(range(*lat_key.indices(self.shape[0]))),
+            len(range(*lon_key.indices(self.shape[1]))),
+            len(hours)
+        ), default_fillvals['f8'])
+
+        for day in np.unique(hours // HOURS_PER_DAY):
+            merra_file = self.day_files[day]
+            if merra_file is None:
+                continue
+
+            # MERRA orders dimensions [time, lat, lon], we reorder [lat, lon, time]
+            day_hours = hours // HOURS_PER_DAY == day
+            with Dataset(merra_file) as merra_dataset:
+                day_values = merra_dataset.variables[self.variable][
+                    hours[day_hours] % HOURS_PER_DAY,
+                    lat_key,
+                    lon_key
+                ]
+            values[:, :, day_hours] = np.ma.filled(
+                np.ma.transpose(day_values, axes=[1, 2, 0]).astype(np.float64),
+                default_fillvals['f8']
+            )
+
+        return values.squeeze(axis=int_axes)
+
+def open_merra_directory(merra_directory: Path, year: int):
+    """Open a year of daily MERRA files without combining them.
+
+    Days are found as in `combine`, skipping leap day. Variables are
+    located by collection in the files of the first day found.
+    """
+    logging.info(f'Opening daily MERRA files in {merra_directory}...')
+    merra_files = get_merra_files_by_date(merra_directory, year)
+    if not merra_files:
+        raise ValueError(f'No MERRA files for {year} in {merra_directory}')
+
+    # find variables and dimensions, from the first day found
+    # since directories may start later in the year
+    sample_files = merra_files[min(merra_files)]
+    lats, lons = get_merra_dimensions(sample_files[0])
+    variable_collections = {}
+    for merra_file in sample_files:
+        with Dataset(merra_file) as merra_dataset:
+            for variable in MERRA_VARIABLES:
+                if variable in merra_dataset.variables:
+                    variable_collections[variable] = get_merra_collection(merra_file)
+
+    # files of each collection by day of the combined year
+    collection_files = [
+        {get_merra_collection(merra_file) : merra_file for merra_file in merra_files[merra_day]}
+        for merra_day in get_merra_days(year)
+    ]
+
+    return xr.Dataset(
+        {
+            variable : xr.Variable(
+                ('lat', 'lon', 'time'),
+                indexing.LazilyIndexedArray(DailyMerraArray(
+                    variable,
+                    [day_files.get(collection) for day_files in collection_files],
+                    len(lats),
+                    len(lons)
+                ))
+            )
+            for variable, collection in variable_collections.items()
+        },
+        coords={
+            'lat' : np.asarray(lats, dtype=np.float64),
+            'lon' : np.asarray(lons, dtype=np.float64)
+        },
+        attrs={'year' : year}
+    )
@@ -1,28 +1,128 @@
 from argparse import ArgumentParser
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from queue import Queue
+from threading import Event, Semaphore, Thread
 from pathlib import Path
 from typing import List
 import logging
 import math
 import csv
+import hashlib
+import json
 from datetime import datetime, timedelta
 
 import xarray as xr
 import numpy as np
+from netCDF4 import Dataset
 import pandas as pd
 import pvlib
 import PySAM.Pvwattsv8 as pv
 import PySAM.Windpower as wp
 
+from combine_merra import HOURS_PER_YEAR
+from merra_view import open_merra_directory
+from result_cache import ResultCache
+from solar_geometry import SolarGeometryStore, get_date_times, get_solar_position
+
 # setup logging
 logging.basicConfig(level=logging.DEBUG)
 
 PROJECT_PATH = Path(__file__).parents[1]
-HOURS_PER_YEAR = 24*365
 ATM_PER_PASCAL = 1 / 101325
 KELV_CELSIUS_OFFSET = 273.15
+GAS_CONSTANT_DRY_AIR = 287.05
+AIR_DENSITY_SEA_LEVEL = 1.225
 NETCDF_FILL_VALUE = 9.83e31
-
+OUTPUT_VARIABLES = ('solar_capacity_factor', 'wind_capacity_factor', 'temperature')
+
+# variables derived by _process_merra_data, cached between runs. Increment
+# the version whenever the derivation changes, so old caches are not used
+DERIVED_VARIABLES = (
+    'pressure_atm',
+    'temperature_c',
+    'wind_speed_2_m_per_s',
+    'wind_speed_10_m_per_s',
+    'wind_speed_50_m_per_s',
+    'wind_direction_deg',
+    'wind_turbine_iec_class',
+    'ghi_w_per_m_2'
+)
+DERIVATION_VERSION = 1
+
+# possible fields of PySAM wind resource data, and the fields we have
+# data for mapped to their variable names
+WIND_RESOURCE_FIELD_NAMES = ('temperature', 'pressure', 'speed', 'direction')
+WIND_RESOURCE_FIELDS = {
+    (2, 'temperature') : 'temperature_c',
+    (2, 'pressure') : 'pressure_atm',
+    (2, 'speed') : 'wind_speed_2_m_per_s',
+    (10, 'speed') : 'wind_speed_10_m_per_s',
+    (50, 'speed') : 'wind_speed_50_m_per_s',
+    (50, 'direction') : 'wind_direction_deg'
+}
+
+# derived variables each simulation reads for a cell, hashed into
+# result cache keys
+SOLAR_RESOURCE_VARIABLES = ('ghi_w_per_m_2', 'temperature_c', 'wind_speed_2_m_per_s')
+WIND_RESOURCE_VARIABLES = (
+    'pressure_atm',
+    'temperature_c',
+    'wind_speed_2_m_per_s',
+    'wind_speed_10_m_per_s',
+    'wind_speed_50_m_per_s',
+    'wind_direction_deg',
+    'wind_turbine_iec_class'
+)
+
+# settings a parameter sweep may vary per technology. Each is written to
+# output as a `<technology>_<setting>` variable over the configurations,
+# NaN where a configuration keeps the default: latitude tilt, the model's
+# DC/AC ratio and hub height, and each cell's IEC turbine class
+SWEEP_SETTINGS = {
+    'solar' : ('tilt', 'dc_ac_ratio'),
+    'wind' : ('hub_height', 'turbine_class')
+}
+
+# rough count of full-size (lat, lon, time) arrays held while
+# a latitude band is loaded, derived and simulated
+ARRAYS_PER_CELL = 20
+BYTES_PER_MEGABYTE = 1024**2
+SOLAR_ENGINES = ('pysam', 'numpy')
+WIND_ENGINES = ('pysam', 'numpy')
+
+# floating point types of MERRA data, derived variables and output.
+# PySAM resource data is converted to Python floats either way
+DTYPES = ('float64', 'float32')
+
+# output encoding. Scaled capacity factors are packed into 16-bit
+# unsigned integers at CAPACITY_FACTOR_SCALE resolution, and compressed
+# output is chunked in groups of cells holding whole time series
+DEFAULT_OUTPUT_ENCODING = {
+    'dtype' : 'float64',
+    'scaled' : False,
+    'zlib' : False,
+    'complevel' : 4,
+    'temperature' : 'full'
+}
+TEMPERATURE_OUTPUTS = ('full', 'float32', 'omit')
+CAPACITY_FACTOR_SCALE = 1e-4
+SCALED_OUTPUT_FILL_VALUE = 2**16 - 1
+OUTPUT_CHUNK_LONS = 16
+
+# PVWatts standard module and rack parameters used by the numpy solar engine
+PV_TEMPERATURE_COEFFICIENT = -0.0037
+PV_MODULE_EFFICIENCY = 0.19
+PV_NOCT = 45
+PV_ALBEDO = 0.2
+PV_GROUND_COVERAGE_RATIO = 0.3
+PV_COVER_REFRACTIVE_INDEX = 1.526
+PV_COVER_GLAZING_EXTINCTION = 4
+PV_COVER_GLAZING_THICKNESS = 0.002
+
+# each worker process keeps its own instance with initialized models
+_worker_power_generation = None
 
 class MerraPowerGeneration:
     def __init__(
@@ -30,73 +130,246 @@ class MerraPowerGeneration:
         combined_merra_file: Path, 
         output_file: Path,
         wind_power_curve_file: Path,
-        mask_files: List[Path]=None
+        mask_files: List[Path]=None,
+        workers: int=1,
+        solar_engine: str='pysam',
+        wind_engine: str='pysam',
+        max_memory_mb: float=None,
+        resume: bool=False,
+        merra_year: int=None,
+        derived_cache_dir: Path=None,
+        result_cache_dir: Path=None,
+        result_cache_max_mb: float=None,
+        bounding_box: tuple=None,
+        tile: tuple=None,
+        lat_range: tuple=None,
+        lon_range: tuple=None,
+        sweep_file: Path=None,
+        wind_class_files: List[Path]=None,
+        dtype: str='float64',
+        scaled_output: bool=False,
+        output_zlib: bool=False,
+        output_complevel: int=4,
+        output_temperature: str='full',
+        solar_geometry_dir: Path=None,
+        pipeline: bool=False,
+        queue_size: int=16,
+        wind_power_curves: dict=None,
+        cluster_fraction: float=None,
+        cluster_sample: int=10
     ):
         self.combined_merra_file = combined_merra_file
         self.output_file = output_file
         self.wind_power_curve_file = wind_power_curve_file
         self.mask_files = mask_files
+        self.bounding_box = bounding_box
+        self.tile = tile
+        self.lat_range = lat_range
+        self.lon_range = lon_range
+        self.sweep_file = sweep_file
+        self.wind_class_files = wind_class_files or []
+        self.dtype = np.dtype(dtype)
+        self.output_encoding = {
+            'dtype' : self.dtype.name,
+            'scaled' : scaled_output,
+            'zlib' : output_zlib,
+            'complevel' : output_complevel,
+            'temperature' : output_temperature
+        }
+        self.workers = workers
+        self.pipeline = pipeline
+        self.queue_size = queue_size
+        self.cluster_fraction = cluster_fraction
+        self.cluster_sample = cluster_sample
+        if self.cluster_fraction is not None and not 0 < self.cluster_fraction <= 1:
+            raise ValueError(f'Cluster fraction must be in (0, 1], got {self.cluster_fraction}')
+        self.solar_engine = solar_engine
+        self.wind_engine = wind_engine
+        self.max_memory_mb = max_memory_mb
+        self.resume = resume
+        self.merra_year = merra_year
+        self.derived_cache_dir = derived_cache_dir
+        self.result_cache = ResultCache(result_cache_dir, result_cache_max_mb) \
+            if result_cache_dir is not None else None
+
+        self._open_merra_data()
+        self._open_wind_class_data()
+        self.solar_geometry = SolarGeometryStore(
+            solar_geometry_dir,
+            self.grid_lats,
+            self.grid_lons,
+            self.year,
+            self.dtype
+        ) if solar_geometry_dir is not None else None
+
+        # with a memory budget, latitude bands are loaded during run
+        if self.max_memory_mb is None:
+            self._load_band()
 
-        self._load_merra_data()
-        self._process_merra_data()
-        self._load_power_curves()
+        self.wind_power_curves = wind_power_curves or self.read_power_curves(self.wind_power_curve_file)
         self._load_masks()
+        self._load_sweep()
+
+    def __getstate__(self):
+        """Drop the open dataset and PySAM models before pickling.
+
+        Worker processes initialize their own models.
+        """
+        state = self.__dict__.copy()
+        for attribute in ('combined_merra_dataset', 'wind_class_datasets', 'solar_model', 'wind_model'):
+            state.pop(attribute, None)
+        return state
+
+    def _open_merra_data(self):
+        """Open MERRA data from netCDF or Zarr and read coordinates.
 
-    def _load_merra_data(self):
-        """Open MERRA data from netCDF."""
-        logging.info(f'Loading MERRA data from {self.combined_merra_file}...')
-        self.combined_merra_dataset = xr.open_dataset(self.combined_merra_file)
+        A directory of daily MERRA files is opened as a lazy view
+        of `merra_year`, without writing a combined file.
+        """
+        logging.info(f'Opening MERRA data from {self.combined_merra_file}...')
+        if self.combined_merra_file.is_dir() and self.combined_merra_file.suffix != '.zarr':
+            if self.merra_year is None:
+                raise ValueError('A year is required to read a directory of daily MERRA files')
+            self.combined_merra_dataset = open_merra_directory(
+                self.combined_merra_file,
+                self.merra_year
+            )
+        else:
+            self.combined_merra_dataset = xr.open_dataset(
+                self.combined_merra_file,
+                engine='zarr' if self.combined_merra_file.suffix == '.zarr' else None
+            )
+        self._select_tile()
         self.year = self.combined_merra_dataset.year
-        self.variables = {name : np.array(var[:]) 
-            for name, var in self.combined_merra_dataset.variables.items()
+        self.date_times = get_date_times(self.year)
+        self.solar_time_columns = {
+            column : getattr(self.date_times, column).tolist()
+            for column in ('year', 'month', 'day', 'hour', 'minute')
         }
-
-    @staticmethod
-    def _fill_masked_val(arr: np.ndarray, fill_val: float):
-        return np.where(
-            arr > NETCDF_FILL_VALUE,
-            fill_val,
-            arr
+        self.lats = np.array(self.combined_merra_dataset['lat'])
+        self.lons = np.array(self.combined_merra_dataset['lon'])
+
+    def _open_wind_class_data(self):
+        """Open combined MERRA files of other years, whose wind
+        speeds are pooled with this year's to classify turbines."""
+        self.wind_class_datasets = []
+        for wind_class_file in self.wind_class_files:
+            logging.info(f'Opening MERRA wind speeds from {wind_class_file}...')
+            dataset = xr.open_dataset(
+                wind_class_file,
+                engine='zarr' if wind_class_file.suffix == '.zarr' else None
+            )[['U10M', 'V10M', 'U50M', 'V50M']]
+            try:
+                dataset = dataset.sel(lat=self.lats, lon=self.lons)
+            except KeyError:
+                raise ValueError(f'Grid of {wind_class_file} does not match {self.combined_merra_file}')
+            self.wind_class_datasets.append(dataset)
+
+    def _select_tile(self):
+        """Restrict MERRA data to the tile of this job.
+
+        Tile `i` of `N` is the i-th of N contiguous groups of
+        latitude rows, counted from 0, within the lat and lon
+        index ranges.
+        """
+        n_lats = self.combined_merra_dataset.sizes['lat']
+        n_lons = self.combined_merra_dataset.sizes['lon']
+        lat_range = self.lat_range or (0, n_lats)
+        lon_range = self.lon_range or (0, n_lons)
+
+        if self.tile is not None:
+            tile_idx, n_tiles = self.tile
+            tile_rows = np.arange(*lat_range)
+            if not 0 <= tile_idx < n_tiles <= len(tile_rows):
+                raise ValueError(
+                    f'Cannot select tile {tile_idx}/{n_tiles} of {len(tile_rows)} latitude rows'
+                )
+            tile_rows = np.array_split(tile_rows, n_tiles)[tile_idx]
+            lat_range = (tile_rows[0], tile_rows[-1] + 1)
+
+        # the solar geometry store covers the full grid, shared by tiles
+        self.grid_lats = np.array(self.combined_merra_dataset['lat'])
+        self.grid_lons = np.array(self.combined_merra_dataset['lon'])
+
+        # written to the output, so tiles can be merged
+        self.tile_attrs = {
+            'grid_n_lats' : int(n_lats),
+            'grid_n_lons' : int(n_lons),
+            'grid_lat_start' : int(lat_range[0]),
+            'grid_lon_start' : int(lon_range[0])
+        }
+        self.combined_merra_dataset = self.combined_merra_dataset.isel(
+            lat=slice(*lat_range),
+            lon=slice(*lon_range)
         )
 
-    @staticmethod
-    def _get_wind_direction(eastward_velocity, northward_velocity):
-        """Find wind travel direction (degrees from due south)"""
-        # get cases
-        eastward = np.logical_and(
-            eastward_velocity > 0,
-            northward_velocity != 0
-        ) 
-        westward = np.logical_and(
-            eastward_velocity < 0,
-            northward_velocity != 0
-        )
-        pure_northward = np.logical_and(
-            eastward_velocity == 0,
-            northward_velocity > 0
-        )
-        pure_southward = np.logical_and(
-            eastward_velocity == 0,
-            northward_velocity < 0
-        )
-        pure_eastward = np.logical_and(
-            eastward_velocity > 0,
-            northward_velocity == 0
+    def _load_merra_data(self, lat_band: slice=None):
+        """Read MERRA data for a band of latitudes into memory.
+
+        Row indices used during simulation are relative to the band.
+        """
+        self.lat_band = lat_band or slice(0, len(self.lats))
+        logging.info(
+            f'Loading MERRA data for latitudes '
+            f'{self.lats[self.lat_band.start]:.2f} to {self.lats[self.lat_band.stop - 1]:.2f}...'
         )
-        pure_westward = np.logical_and(
-            eastward_velocity < 0,
-            northward_velocity == 0
+        band_dataset = self.combined_merra_dataset.isel(lat=self.lat_band)
+        self.irradiance_row = None
+        # coordinates stay double, PySAM takes them as scalars
+        self.variables = {
+            name : np.array(var[:], dtype=np.float64 if var.ndim == 1 else self.dtype)
+            for name, var in band_dataset.variables.items()
+        }
+
+    def _get_lat_bands(self):
+        """Split latitudes into bands that fit the memory budget."""
+        n_lats = len(self.lats)
+        if self.max_memory_mb is None:
+            return [slice(0, n_lats)]
+
+        bytes_per_row = len(self.lons) * HOURS_PER_YEAR \
+            * self.dtype.itemsize * ARRAYS_PER_CELL
+        rows_per_band = max(
+            1,
+            int(self.max_memory_mb * BYTES_PER_MEGABYTE // bytes_per_row)
         )
 
-        # get direction matrix
-        direction = np.zeros(eastward_velocity.shape)
+        return [
+            slice(start, min(start + rows_per_band, n_lats))
+            for start in range(0, n_lats, rows_per_band)
+        ]
+
+    @staticmethod
+    def _fill_masked_val(arr: np.ndarray, fill_val: float, out: np.ndarray=None):
+        """Replace fill values with `fill_val`, writing into `out`
+        if given, which may be `arr` itself."""
+        # stores with a declared fill value are decoded to NaN
+        masked = np.isnan(arr)
+        masked |= np.greater(arr, NETCDF_FILL_VALUE)
+        if out is None:
+            return np.where(masked, fill_val, arr)
+
+        if out is not arr:
+            np.copyto(out, arr)
+        np.copyto(out, fill_val, where=masked)
+        return out
+
+    @staticmethod
+    def _get_wind_direction(eastward_velocity, northward_velocity, out: np.ndarray=None):
+        """Find wind travel direction (degrees from due south)
+
+        Computed in a single arctan2 pass, in place in `out` if given.
+        Calm and missing winds are assigned 0.
+        """
+        direction = np.arctan2(northward_velocity, eastward_velocity, out=out)
+        np.degrees(direction, out=direction)
+        np.subtract(270, direction, out=direction)
+        np.mod(direction, 360, out=direction)
 
-        direction[westward] = 90 - np.arctan(northward_velocity[westward] / eastward_velocity[westward]) / np.pi * 180.
-        direction[eastward] = 270 - np.arctan(northward_velocity[eastward] / eastward_velocity[eastward]) / np.pi * 180.
-        direction[pure_northward] = 180
-        direction[pure_southward] = 0
-        direction[pure_eastward] = 270
-        direction[pure_westward] = 90
+        calm = np.equal(eastward_velocity, 0)
+        calm &= np.equal(northward_velocity, 0)
+        calm |= np.isnan(direction)
+        np.copyto(direction, 0, where=calm)
 
         return direction
 
@@ -120,22 +393,38 @@ class MerraPowerGeneration:
 
         return wind_speed_height_3
 
+    @staticmethod
+    def _get_wind_speed(eastward_velocity, northward_velocity, out: np.ndarray=None):
+        """Wind speed from velocity components, 0 where masked.
+
+        Written in place in `out` if given, which may be one of
+        the components.
+        """
+        wind_speed = np.hypot(eastward_velocity, northward_velocity, out=out)
+        return MerraPowerGeneration._fill_masked_val(wind_speed, 0.0, out=wind_speed)
+
     @staticmethod
     def _get_wind_turbine_class(wind_speed_10, wind_speed_50):
         """Estimate the IEC wind turbine class based on
         median wind speed.
+
+        Latitude rows are scaled and reduced one at a time, so the
+        temporaries of `scale_wind_height` never exceed a row. The
+        median of each cell is still exact, over all of its hours.
         """
-        # approximate wind speed at 100 m
-        wind_speed_100 = MerraPowerGeneration.scale_wind_height(
-            10,
-            wind_speed_10,
-            50,
-            wind_speed_50,
-            100
-        )
+        median_wind_speed = np.empty(wind_speed_10.shape[:2])
+        for lat_idx in range(len(wind_speed_10)):
+            # approximate wind speed at 100 m
+            wind_speed_100 = MerraPowerGeneration.scale_wind_height(
+                10,
+                wind_speed_10[lat_idx],
+                50,
+                wind_speed_50[lat_idx],
+                100
+            )
 
-        # evaluate wind turbine class by annual median wind speed
-        median_wind_speed = np.median(wind_speed_100, axis=2)
+            # evaluate wind turbine class by median wind speed
+            median_wind_speed[lat_idx] = np.median(wind_speed_100, axis=-1)
 
         # classify wind turbine class by median wind speed.
         # In order of slowest to fastest wind speeds, 
@@ -145,55 +434,179 @@ class MerraPowerGeneration:
 
         return wind_turbine_class
         
+    def _get_band_wind_turbine_class(self):
+        """IEC wind turbine class of the current band, by median
+        wind speed over this year and the years of `wind_class_files`.
+
+        Other years are read a row at a time.
+        """
+        if not self.wind_class_datasets:
+            return self._get_wind_turbine_class(
+                self.variables['wind_speed_10_m_per_s'],
+                self.variables['wind_speed_50_m_per_s']
+            )
+
+        logging.info(f'Classifying wind turbines over {len(self.wind_class_datasets) + 1} years...')
+        wind_turbine_class = np.empty((self.lat_band.stop - self.lat_band.start, len(self.lons)), dtype=int)
+        for lat_idx in range(len(wind_turbine_class)):
+            wind_speeds = {
+                height : [self.variables[f'wind_speed_{height}_m_per_s'][lat_idx]]
+                for height in (10, 50)
+            }
+            for dataset in self.wind_class_datasets:
+                row = dataset.isel(lat=self.lat_band.start + lat_idx)
+                for height in wind_speeds:
+                    wind_speeds[height].append(self._get_wind_speed(
+                        np.array(row[f'U{height}M'], dtype=self.dtype),
+                        np.array(row[f'V{height}M'], dtype=self.dtype)
+                    ))
+
+            wind_turbine_class[lat_idx] = self._get_wind_turbine_class(
+                np.concatenate(wind_speeds[10], axis=-1)[np.newaxis],
+                np.concatenate(wind_speeds[50], axis=-1)[np.newaxis]
+            )[0]
+
+        return wind_turbine_class
+
     def _process_merra_data(self):
-        """Convert units, fill masked values and rename variables."""
+        """Convert units, fill masked values and rename variables.
+
+        Each derived variable is computed in place in the array of the
+        MERRA variable it replaces, so only wind direction allocates
+        a new (lat, lon, time) array.
+        """
         logging.info(f'Converting MERRA variables...')
+        variables = self.variables
+
         # pressure in atmospheres
-        self.variables['pressure_atm'] = (self.variables['PS'] * ATM_PER_PASCAL)
-        self.variables['pressure_atm'] = self._fill_masked_val(
-            self.variables['pressure_atm'],
-            1.0
-        )
+        pressure = variables.pop('PS')
+        np.multiply(pressure, ATM_PER_PASCAL, out=pressure)
+        variables['pressure_atm'] = self._fill_masked_val(pressure, 1.0, out=pressure)
 
         # temperature in C
-        self.variables['temperature_c'] = self.variables['T2M'] - KELV_CELSIUS_OFFSET
-        self.variables['temperature_c'] = self._fill_masked_val(
-            self.variables['temperature_c'],
-            0.0
+        temperature = variables.pop('T2M')
+        np.subtract(temperature, KELV_CELSIUS_OFFSET, out=temperature)
+        variables['temperature_c'] = self._fill_masked_val(temperature, 0.0, out=temperature)
+
+        # wind direction, before the 50 m components are replaced
+        variables['wind_direction_deg'] = self._get_wind_direction(
+            variables['U50M'],
+            variables['V50M']
         )
 
         # wind speed
         for height in [2, 10, 50]:
-            # wind speed
-            self.variables[f'wind_speed_{height}_m_per_s'] = np.sqrt(
-                self.variables[f'V{height}M']**2
-                + self.variables[f'U{height}M']**2
+            eastward_velocity = variables.pop(f'U{height}M')
+            variables[f'wind_speed_{height}_m_per_s'] = self._get_wind_speed(
+                eastward_velocity,
+                variables.pop(f'V{height}M'),
+                out=eastward_velocity
             )
-            self.variables[f'wind_speed_{height}_m_per_s'] = self._fill_masked_val(
-                self.variables[f'wind_speed_{height}_m_per_s'],
-                0.0
-            )
-
-        # wind direction
-        self.variables[f'wind_direction_deg'] = self._get_wind_direction(
-            self.variables['U50M'], 
-            self.variables['V50M']
-        )
 
         # wind class
-        self.variables[f'wind_turbine_iec_class'] = self._get_wind_turbine_class(
-            self.variables['wind_speed_10_m_per_s'],
-            self.variables['wind_speed_50_m_per_s']
-        )
+        variables['wind_turbine_iec_class'] = self._get_band_wind_turbine_class()
 
         # global horizontal irradiance
-        self.variables['ghi_w_per_m_2'] = self.variables['SWGDN']
-        self.variables['ghi_w_per_m_2'] = self._fill_masked_val(
-            self.variables['ghi_w_per_m_2'],
-            0.0
-        )
+        ghi = variables.pop('SWGDN')
+        variables['ghi_w_per_m_2'] = self._fill_masked_val(ghi, 0.0, out=ghi)
+
+    def _get_derived_cache_path(self):
+        """Cache directory for derived variables of the MERRA input.
+
+        The key covers the path, size and modification time of every
+        input file, rather than a hash of their contents, so that
+        checking the cache does not read the input.
+        """
+        if self.combined_merra_file.is_dir():
+            input_files = sorted(
+                input_file for input_file in self.combined_merra_file.rglob('*')
+                if input_file.is_file()
+            )
+        else:
+            input_files = [self.combined_merra_file]
+        for wind_class_file in self.wind_class_files:
+            if wind_class_file.is_dir():
+                input_files.extend(sorted(
+                    input_file for input_file in wind_class_file.rglob('*')
+                    if input_file.is_file()
+                ))
+            else:
+                input_files.append(wind_class_file)
+
+        key = json.dumps({
+            'input' : [
+                (str(input_file.resolve()), input_file.stat().st_size, input_file.stat().st_mtime_ns)
+                for input_file in input_files
+            ],
+            'year' : int(self.year),
+            'tile' : self.tile_attrs,
+            'shape' : [len(self.lats), len(self.lons)],
+            'dtype' : self.dtype.name,
+            'version' : DERIVATION_VERSION
+        })
+        return Path(self.derived_cache_dir, hashlib.sha256(key.encode()).hexdigest()[:16])
+
+    def _write_derived_cache(self, cache_path: Path):
+        """Write derived variables of the current band to the cache,
+        then mark its rows complete."""
+        cache_path.mkdir(parents=True, exist_ok=True)
+        logging.info(f'Caching derived variables in {cache_path}...')
+        for variable in DERIVED_VARIABLES + ('rows_complete',):
+            if variable == 'rows_complete':
+                values = np.ones(self.lat_band.stop - self.lat_band.start, dtype=np.int8)
+            else:
+                values = self.variables[variable]
+
+            # arrays cover the full grid and are filled band by band
+            cache_file = Path(cache_path, f'{variable}.npy')
+            if cache_file.exists():
+                cache = np.lib.format.open_memmap(cache_file, mode='r+')
+            else:
+                cache = np.lib.format.open_memmap(
+                    cache_file,
+                    mode='w+',
+                    dtype=values.dtype,
+                    shape=(len(self.lats),) + values.shape[1:]
+                )
+            cache[self.lat_band] = values
+            cache.flush()
+            del cache
+
+    def _load_band(self, lat_band: slice=None):
+        """Load and derive MERRA variables for a band of latitudes.
+
+        With a derived-variable cache, bands already cached by an
+        earlier run are memory-mapped instead of read and derived.
+        """
+        lat_band = lat_band or slice(0, len(self.lats))
+        if self.derived_cache_dir is None:
+            self._load_merra_data(lat_band)
+            self._process_merra_data()
+            return
+
+        cache_path = self._get_derived_cache_path()
+        rows_complete_file = Path(cache_path, 'rows_complete.npy')
+        if not (rows_complete_file.exists() and np.load(rows_complete_file)[lat_band].all()):
+            self._load_merra_data(lat_band)
+            self._process_merra_data()
+            self._write_derived_cache(cache_path)
+            return
+
+        logging.info(f'Memory-mapping cached derived variables from {cache_path}...')
+        self.lat_band = lat_band
+        self.irradiance_row = None
+        self.variables = {
+            'lat' : self.lats[lat_band],
+            'lon' : self.lons
+        }
+        for variable in DERIVED_VARIABLES:
+            self.variables[variable] = np.load(
+                Path(cache_path, f'{variable}.npy'),
+                mmap_mode='r'
+            )[lat_band]
 
-    def _load_power_curves(self):
+    @staticmethod
+    def read_power_curves(wind_power_curve_file: Path):
         """Load wind turbine power curves from file.
         
         PySAM requires a relationship between wind speed
@@ -205,27 +618,122 @@ class MerraPowerGeneration:
             'Composite IEC Class III'   : 3
         }
 
-        self.wind_power_curves = defaultdict(list)
+        wind_power_curves = defaultdict(list)
         
         # populate power curves.
         # the file should have three columns with the above fields.
         # each row should have a wind speed and corresponding
         # power output
-        with open(self.wind_power_curve_file) as csv_file:
+        with open(wind_power_curve_file) as csv_file:
             reader = csv.DictReader(csv_file)
             for row in reader:
                 for key in row:
-                    self.wind_power_curves[
+                    wind_power_curves[
                         wind_power_curve_fields[key]
                     ].append(float(row[key]))
 
+        return wind_power_curves
+
     def _load_masks(self):
+        """Find active cells of the grid.
+
+        A cell is active if it is inside the bounding box and
+        every mask file.
+        """
+        self.active_cells = np.ones((len(self.lats), len(self.lons)), dtype=bool)
+
+        if self.bounding_box is not None:
+            min_lat, max_lat, min_lon, max_lon = self.bounding_box
+            self.active_cells &= ((self.lats >= min_lat) & (self.lats <= max_lat))[:, np.newaxis]
+            self.active_cells &= (self.lons >= min_lon) & (self.lons <= max_lon)
+
         if self.mask_files:
             for mask_file in self.mask_files:
                 self._add_mask(mask_file)
 
+        logging.info(f'Simulating {self.active_cells.sum()} of {self.active_cells.size} cells...')
+
     def _add_mask(self, mask_file: Path):
-        pass
+        """Deactivate cells excluded by a mask file.
+
+        A netCDF mask has a (lat, lon) variable, named `mask` or the
+        only data variable, that is nonzero for included cells. The
+        mask may cover a larger grid than the MERRA data. A CSV mask
+        has `lat` and `lon` columns listing included cells, and an
+        optional `mask` column that is 0 for excluded cells.
+        """
+        logging.info(f'Applying mask {mask_file}...')
+        mask = np.zeros(self.active_cells.shape, dtype=bool)
+
+        if mask_file.suffix == '.csv':
+            with open(mask_file) as csv_file:
+                for row in csv.DictReader(csv_file):
+                    lat_indices = np.flatnonzero(np.isclose(self.lats, float(row['lat'])))
+                    lon_indices = np.flatnonzero(np.isclose(self.lons, float(row['lon'])))
+                    if len(lat_indices) and len(lon_indices) and float(row.get('mask', 1)) != 0:
+                        mask[lat_indices[0], lon_indices[0]] = True
+        else:
+            with xr.open_dataset(mask_file) as mask_dataset:
+                mask_name = 'mask' if 'mask' in mask_dataset.data_vars \
+                    else list(mask_dataset.data_vars)[0]
+                try:
+                    mask_var = mask_dataset[mask_name].transpose('lat', 'lon').sel(
+                        lat=self.lats,
+                        lon=self.lons,
+                        method='nearest',
+                        tolerance=1e-6
+                    )
+                except KeyError:
+                    raise ValueError(f'Mask {mask_file} does not cover the MERRA grid')
+                mask = np.nan_to_num(np.array(mask_var, dtype=np.float64)) != 0
+
+        self.active_cells &= mask
+
+    def _load_sweep(self):
+        """Load solar and wind configurations to simulate from a JSON file,
+        e.g. {"solar": [{"tilt": 20, "dc_ac_ratio": 1.3}], "wind": [{"hub_height": 100}]}.
+
+        Settings left out of a configuration keep their default. Without
+        a sweep file, a single default configuration is simulated and
+        output has no configuration dimension.
+        """
+        self.sweep = None
+        self.solar_configs = [{}]
+        self.wind_configs = [{}]
+        if self.sweep_file is None:
+            return
+
+        with open(self.sweep_file) as json_file:
+            sweep = json.load(json_file)
+
+        unknown_technologies = set(sweep) - set(SWEEP_SETTINGS)
+        if unknown_technologies:
+            raise ValueError(f'Unknown technologies {sorted(unknown_technologies)} in {self.sweep_file}')
+        for technology, settings in SWEEP_SETTINGS.items():
+            configs = sweep.setdefault(technology, [{}])
+            if not configs:
+                raise ValueError(f'No {technology} configurations in {self.sweep_file}')
+            for config in configs:
+                unknown_settings = set(config) - set(settings)
+                if unknown_settings:
+                    raise ValueError(
+                        f'Unknown {technology} settings {sorted(unknown_settings)} '
+                        f'in {self.sweep_file}, expected {list(settings)}'
+                    )
+                if technology == 'wind' and config.get('turbine_class', 1) not in self.wind_power_curves:
+                    raise ValueError(f'No power curve for turbine class {config["turbine_class"]}')
+
+        self.sweep = sweep
+        self.solar_configs = sweep['solar']
+        self.wind_configs = sweep['wind']
+        logging.info(
+            f'Sweeping {len(self.solar_configs)} solar and '
+            f'{len(self.wind_configs)} wind configurations...'
+        )
+
+    def _get_active_lons(self, lat_idx):
+        """Indices of active cells in a row of the current band."""
+        return np.flatnonzero(self.active_cells[self.lat_band.start + lat_idx])
 
     def _initialize_solar_model(self):
         """Initialize default parameters.
@@ -242,6 +750,7 @@ class MerraPowerGeneration:
         self.solar_model.SystemDesign.inv_eff = 96
         self.solar_model.SystemDesign.losses = 14
         self.solar_model.AdjustmentFactors.constant = 1.0
+        self.solar_model_config = self._get_model_config('solar')
 
     def _initialize_wind_model(self):
         """Initialize default parameters.
@@ -257,39 +766,357 @@ class MerraPowerGeneration:
         self.wind_model.Farm.wind_farm_wake_model = 0
         self.wind_model.Farm.wind_farm_xCoordinates = np.array([0])
         self.wind_model.Farm.wind_farm_yCoordinates = np.array([0])
+        self.wind_model_config = self._get_model_config('wind')
+
+    @staticmethod
+    def create_output(
+        output_file: Path,
+        lats,
+        lons,
+        year,
+        tile_attrs: dict,
+        sweep: dict=None,
+        encoding: dict=None,
+        years: list=None
+    ):
+        """Create empty netCDF or Zarr output for a grid.
+
+        `tile_attrs` place the grid within the combined MERRA grid.
+        With a `sweep`, capacity factors have a configuration
+        dimension per technology. `encoding` updates
+        DEFAULT_OUTPUT_ENCODING. With `years`, output holds those
+        years end to end, and time counts hours since `year`.
+        """
+        encoding = {**DEFAULT_OUTPUT_ENCODING, **(encoding or {})}
+        initialize = MerraPowerGeneration._initialize_zarr_output if output_file.suffix == '.zarr' \
+            else MerraPowerGeneration._initialize_output
+        return initialize(output_file, lats, lons, year, tile_attrs, sweep, encoding, years)
+
+    @staticmethod
+    def _get_output_hours(year, years: list=None):
+        """Hours since the start of `year` of each output time step.
+
+        Leap days are skipped, as in the simulated hours.
+        """
+        date_times = pd.DatetimeIndex(np.concatenate([
+            get_date_times(output_year) for output_year in (years or [year])
+        ]))
+        return np.asarray((date_times - datetime(year, 1, 1)) // timedelta(hours=1), dtype=np.int64)
+
+    @staticmethod
+    def get_output_dimensions(sweep: dict=None, encoding: dict=DEFAULT_OUTPUT_ENCODING):
+        """Dimensions of each output variable, and sizes of
+        the configuration dimensions."""
+        variable_dims = {
+            variable : ('lat', 'lon', 'time') for variable in OUTPUT_VARIABLES
+            if not (variable == 'temperature' and encoding['temperature'] == 'omit')
+        }
+        config_dims = {}
+        if sweep is not None:
+            for technology in SWEEP_SETTINGS:
+                config_dims[f'{technology}_config'] = len(sweep[technology])
+                variable_dims[f'{technology}_capacity_factor'] = ('lat', 'lon', f'{technology}_config', 'time')
+
+        return variable_dims, config_dims
+
+    @staticmethod
+    def _get_output_storage(variable: str, shape: tuple, encoding: dict):
+        """Storage type, fill value, packing attributes and chunk
+        shape of an output variable."""
+        if variable != 'temperature' and encoding['scaled']:
+            storage = dict(
+                dtype=np.dtype(np.uint16),
+                fill_value=SCALED_OUTPUT_FILL_VALUE,
+                attrs={'scale_factor' : CAPACITY_FACTOR_SCALE, 'add_offset' : 0.0}
+            )
+        else:
+            dtype = np.float32 if variable == 'temperature' and encoding['temperature'] == 'float32' \
+                else encoding['dtype']
+            storage = dict(dtype=np.dtype(dtype), fill_value=np.nan, attrs={})
+
+        # rows are written whole, and cells read as whole time series
+        chunk_lons = min(OUTPUT_CHUNK_LONS, shape[1]) if encoding['zlib'] else shape[1]
+        storage['chunks'] = (1, chunk_lons) + shape[2:]
 
-    def _initialize_dataset(self):
-        """Create empty netcdf dataset"""
-        coords = dict(
-            lat = self.variables['lat'],
-            lon = self.variables['lon'],
-            time = xr.date_range(
-                start=datetime(self.year, 1, 1, 0),
-                freq="1H",
-                periods=HOURS_PER_YEAR
+        return storage
+
+    @staticmethod
+    def _get_sweep_settings(sweep: dict):
+        """Values of each swept setting by configuration,
+        NaN for defaults."""
+        return {
+            f'{technology}_{setting}' : (
+                f'{technology}_config',
+                np.array([config.get(setting, np.nan) for config in sweep[technology]], dtype=np.float64)
             )
+            for technology, settings in SWEEP_SETTINGS.items()
+            for setting in settings
+        }
+
+    @staticmethod
+    def _get_output_attr(dataset, name: str):
+        """JSON attribute of netCDF or Zarr output, or None."""
+        if isinstance(dataset, Dataset):
+            value = dataset.getncattr(name) if name in dataset.ncattrs() else None
+        else:
+            value = dataset.attrs.get(name)
+        return json.loads(value) if value is not None else None
+
+    @staticmethod
+    def get_output_sweep(dataset):
+        """Sweep stored in netCDF or Zarr output, or None."""
+        return MerraPowerGeneration._get_output_attr(dataset, 'sweep')
+
+    @staticmethod
+    def get_output_encoding(dataset):
+        """Encoding of netCDF or Zarr output. Output written before
+        encodings were stored has the default encoding."""
+        encoding = MerraPowerGeneration._get_output_attr(dataset, 'encoding')
+        if encoding is None:
+            encoding = {**DEFAULT_OUTPUT_ENCODING, 'dtype' : dataset['solar_capacity_factor'].dtype.name}
+        return encoding
+
+    @staticmethod
+    def write_output(dataset, variable: str, key, values):
+        """Write values to netCDF or Zarr output, packing scaled
+        capacity factors. NaN is written as the fill value."""
+        output_var = dataset[variable]
+        attrs = output_var.ncattrs() if isinstance(dataset, Dataset) else output_var.attrs
+        if 'scale_factor' in attrs:
+            values = np.clip(values, 0, (SCALED_OUTPUT_FILL_VALUE - 1) * CAPACITY_FACTOR_SCALE)
+            if isinstance(dataset, Dataset):
+                # netCDF packs values on write, and masked values as fill
+                values = np.ma.array(np.nan_to_num(values), mask=np.isnan(values))
+            else:
+                values = np.where(
+                    np.isnan(values),
+                    SCALED_OUTPUT_FILL_VALUE,
+                    np.round(values / CAPACITY_FACTOR_SCALE)
+                ).astype(output_var.dtype)
+        output_var[key] = values
+
+    @staticmethod
+    def read_output(dataset, variable: str, key=slice(None)):
+        """Read values of netCDF or Zarr output, unpacking scaled
+        capacity factors. Fill values are read as NaN."""
+        output_var = dataset[variable]
+        if isinstance(dataset, Dataset):
+            return np.ma.filled(output_var[key], np.nan)
+
+        values = output_var[key]
+        if 'scale_factor' in output_var.attrs:
+            values = np.where(
+                values == SCALED_OUTPUT_FILL_VALUE,
+                np.nan,
+                values * output_var.attrs['scale_factor'] + output_var.attrs['add_offset']
+            )
+        return values
+
+    @staticmethod
+    def _initialize_output(
+        output_file: Path,
+        lats,
+        lons,
+        year,
+        tile_attrs: dict,
+        sweep: dict=None,
+        encoding: dict=DEFAULT_OUTPUT_ENCODING,
+        years: list=None
+    ):
+        """Create netcdf output for the grid.
+
+        Rows are written as they are simulated.
+        """
+        variable_dims, config_dims = MerraPowerGeneration.get_output_dimensions(sweep, encoding)
+        hours = MerraPowerGeneration._get_output_hours(year, years)
+        dim_sizes = {'lat' : len(lats), 'lon' : len(lons), 'time' : len(hours), **config_dims}
+        dataset = Dataset(output_file, 'w')
+        dataset.createDimension('lat', len(lats))
+        dataset.createDimension('lon', len(lons))
+        for config_dim, n_configs in config_dims.items():
+            dataset.createDimension(config_dim, n_configs)
+        dataset.createDimension('time', len(hours))
+        dataset.year = int(year)
+        dataset.setncatts(tile_attrs)
+        dataset.encoding = json.dumps(encoding)
+
+        # coordinates
+        lat_var = dataset.createVariable('lat', 'double', ('lat'))
+        lon_var = dataset.createVariable('lon', 'double', ('lon'))
+        time_var = dataset.createVariable('time', 'int64', ('time'))
+        lat_var[:] = lats
+        lon_var[:] = lons
+        time_var.units = f'hours since {year}-01-01 00:00:00'
+        time_var.calendar = 'proleptic_gregorian'
+        time_var[:] = hours
+
+        # swept settings, stored in full to recreate the layout
+        if sweep is not None:
+            dataset.sweep = json.dumps(sweep)
+            for name, (config_dim, values) in MerraPowerGeneration._get_sweep_settings(sweep).items():
+                dataset.createVariable(name, 'double', (config_dim,))[:] = values
+
+        # data variables
+        for variable, dims in variable_dims.items():
+            storage = MerraPowerGeneration._get_output_storage(
+                variable,
+                tuple(dim_sizes[dim] for dim in dims),
+                encoding
+            )
+            data_var = dataset.createVariable(
+                variable,
+                storage['dtype'],
+                dims,
+                zlib=encoding['zlib'],
+                complevel=encoding['complevel'],
+                shuffle=encoding['zlib'],
+                chunksizes=storage['chunks'] if encoding['zlib'] else None,
+                fill_value=storage['fill_value']
+            )
+            data_var.setncatts(storage['attrs'])
+
+        # completion marker, set once a row is written
+        dataset.createVariable('row_complete', 'i1', ('lat'), fill_value=0)
+
+        return dataset
+
+    @staticmethod
+    def _initialize_zarr_output(
+        output_file: Path,
+        lats,
+        lons,
+        year,
+        tile_attrs: dict,
+        sweep: dict=None,
+        encoding: dict=DEFAULT_OUTPUT_ENCODING,
+        years: list=None
+    ):
+        """Create a Zarr output store for the grid.
+
+        Each row is its own chunk, so that worker processes
+        can write rows concurrently.
+        """
+        import zarr
+        import numcodecs
+
+        variable_dims, config_dims = MerraPowerGeneration.get_output_dimensions(sweep, encoding)
+        hours = MerraPowerGeneration._get_output_hours(year, years)
+        dim_sizes = {'lat' : len(lats), 'lon' : len(lons), 'time' : len(hours), **config_dims}
+        group = zarr.open_group(str(output_file), mode='w')
+        group.attrs['year'] = int(year)
+        group.attrs.update(tile_attrs)
+        group.attrs['encoding'] = json.dumps(encoding)
+
+        # coordinates
+        for name, values in (('lat', lats), ('lon', lons)):
+            coordinate = group.create_dataset(name, data=np.asarray(values, dtype=np.float64))
+            coordinate.attrs['_ARRAY_DIMENSIONS'] = [name]
+        time_var = group.create_dataset('time', data=hours)
+        time_var.attrs['_ARRAY_DIMENSIONS'] = ['time']
+        time_var.attrs['units'] = f'hours since {year}-01-01 00:00:00'
+        time_var.attrs['calendar'] = 'proleptic_gregorian'
+
+        # swept settings, stored in full to recreate the layout
+        if sweep is not None:
+            group.attrs['sweep'] = json.dumps(sweep)
+            for name, (config_dim, values) in MerraPowerGeneration._get_sweep_settings(sweep).items():
+                setting_var = group.create_dataset(name, data=values)
+                setting_var.attrs['_ARRAY_DIMENSIONS'] = [config_dim]
+
+        # data variables
+        for variable, dims in variable_dims.items():
+            shape = tuple(dim_sizes[dim] for dim in dims)
+            storage = MerraPowerGeneration._get_output_storage(variable, shape, encoding)
+            data_var = group.create_dataset(
+                variable,
+                shape=shape,
+                chunks=storage['chunks'],
+                dtype=storage['dtype'],
+                fill_value=storage['fill_value'],
+                filters=[numcodecs.Shuffle(storage['dtype'].itemsize)] if encoding['zlib'] else None,
+                compressor=numcodecs.Zlib(level=encoding['complevel']) if encoding['zlib'] else None
+            )
+            data_var.attrs['_ARRAY_DIMENSIONS'] = list(dims)
+
+            # values are unpacked on read
+            data_var.attrs.update(storage['attrs'])
+
+        # completion marker, set once a row is written
+        marker_var = group.create_dataset(
+            'row_complete',
+            shape=(len(lats),),
+            chunks=(1,),
+            dtype='i1',
+            fill_value=0
         )
-    
-        dataset = xr.Dataset(
-            data_vars=dict(
-                solar_capacity_factor=xr.DataArray(
-                    data=np.zeros(self.variables['temperature_c'].shape),
-                    coords=coords
-                ),
-                wind_capacity_factor=xr.DataArray(
-                    data=np.zeros(self.variables['temperature_c'].shape),
-                    coords=coords
-                ),
-                temperature=xr.DataArray(
-                    data=self.variables['temperature_c'],
-                    coords=coords
+        marker_var.attrs['_ARRAY_DIMENSIONS'] = ['lat']
+
+        zarr.consolidate_metadata(group.store)
+        return group
+
+    def _open_existing_output(self):
+        """Open output of an earlier run for appending."""
+        if self.output_file.suffix == '.zarr':
+            import zarr
+            return zarr.open_group(str(self.output_file), mode='r+')
+        return Dataset(self.output_file, 'a')
+
+    @contextmanager
+    def _open_output(self):
+        """Open existing output to resume a run, or create it."""
+        if self.resume and self.output_file.exists():
+            dataset = self._open_existing_output()
+        else:
+            dataset = self.create_output(
+                self.output_file,
+                self.lats,
+                self.lons,
+                self.year,
+                self.tile_attrs,
+                self.sweep,
+                self.output_encoding
+            )
+
+        try:
+            if not (
+                np.array_equal(dataset['lat'][:], self.lats)
+                and np.array_equal(dataset['lon'][:], self.lons)
+            ):
+                raise ValueError(
+                    f'Cannot resume {self.output_file}: grid does not match '
+                    f'{self.combined_merra_file}'
                 )
-            ),
-            coords=coords
-        )
+            if self.get_output_sweep(dataset) != self.sweep:
+                raise ValueError(f'Cannot resume {self.output_file}: sweep does not match {self.sweep_file}')
+            if self.get_output_encoding(dataset) != self.output_encoding:
+                raise ValueError(f'Cannot resume {self.output_file}: output encoding does not match')
+
+            yield dataset
+        finally:
+            # zarr stores are written through on each assignment
+            if isinstance(dataset, Dataset):
+                dataset.close()
+
+    def _write_row(self, dataset, lat_idx, solar_capacity_factors, wind_capacity_factors):
+        """Write a simulated row of the current band to netCDF or
+        Zarr output, then mark it complete."""
+        output_lat_idx = self.lat_band.start + lat_idx
+        self.write_output(dataset, 'solar_capacity_factor', output_lat_idx, solar_capacity_factors)
+        self.write_output(dataset, 'wind_capacity_factor', output_lat_idx, wind_capacity_factors)
+        if self.output_encoding['temperature'] != 'omit':
+            self.write_output(dataset, 'temperature', output_lat_idx, np.where(
+                self.active_cells[output_lat_idx, :, np.newaxis],
+                self.variables['temperature_c'][lat_idx],
+                np.nan
+            ))
+
+        # flush data before the marker, so a marked row is always on disk
+        if isinstance(dataset, Dataset):
+            dataset.sync()
+        dataset['row_complete'][output_lat_idx] = 1
+        if isinstance(dataset, Dataset):
+            dataset.sync()
 
-        return dataset
-  
     @staticmethod
     def _get_dni_dhi(lat, lon, year, ghi):
         """Approximate direct normal irradiance (DNI) and 
@@ -298,12 +1125,7 @@ class MerraPowerGeneration:
         This is necessary because PySAM needs DNI and DHI, 
         but MERRA only provides GHI.
         """
-        date_times = pd.date_range(
-            datetime(year, 1, 1, 0),
-            datetime(year, 12, 31, 23),
-            freq=timedelta(hours=1)
-        )
-        date_times = date_times[(date_times.month != 2) | (date_times.day != 29)]
+        date_times = get_date_times(year)
         solar_position = pvlib.solarposition.get_solarposition(
             date_times,
             lat,
@@ -326,35 +1148,148 @@ class MerraPowerGeneration:
 
         return date_times, dni, dhi
 
-    def _get_solar_resource_data(self, lat_idx, lat, lon_idx, lon):
-        """Populate solar resource data.
-        
-        https://nrel-pysam.readthedocs.io/en/master/modules/Pvwattsv7.html
+    @staticmethod
+    def _get_grid_dni_dhi(zenith, date_times, ghi):
+        """Approximate DNI and DHI for many cells at once.
+
+        Array version of `_get_dni_dhi`. `zenith` and `ghi` have
+        shape (..., n_hours) with time along the last axis.
         """
-        date_times, dni, dhi = self._get_dni_dhi(
-            lat, 
-            lon, 
-            self.year,
-            self.variables['ghi_w_per_m_2'][lat_idx, lon_idx, :]
+        # DISC estimate of dni
+        # https://pvlib-python.readthedocs.io/en/stable/reference/generated/pvlib.irradiance.disc.html
+        disc = pvlib.irradiance.disc(ghi, zenith, np.array(date_times.dayofyear))
+        kt_prime = pvlib.irradiance.clearness_index_zenith_independent(
+            disc['kt'],
+            disc['airmass'],
+            max_clearness_index=1
         )
 
-        solar_resource_data = {
-            'lat' :     lat,
-            'lon' :     lon,
-            'tz' :      0,
-            'elev' :    0,
-            'year' :    list(date_times.year),
-            'month' :   list(date_times.month),
-            'day' :     list(date_times.day),
-            'hour' :    list(date_times.hour),
-            'minute' :  list(date_times.minute),
-            'dn' :      list(dni),
-            'df' :      list(dhi),
-            'tdry' :    list(self.variables['temperature_c'][lat_idx, lon_idx, :]),
-            'wspd' :    list(self.variables['wind_speed_2_m_per_s'][lat_idx, lon_idx, :])
+        # stability index (Perez eqn 2 and 3) along time
+        kt_next = np.roll(kt_prime, -1, axis=-1)
+        kt_previous = np.roll(kt_prime, 1, axis=-1)
+        kt_next[..., -1] = kt_previous[..., -1]
+        kt_previous[..., 0] = kt_next[..., 0]
+        delta_next = np.abs(kt_prime - kt_next)
+        delta_previous = np.abs(kt_prime - kt_previous)
+        delta_kt_prime = np.where(
+            np.isnan(delta_next) & np.isnan(delta_previous),
+            np.nan,
+            0.5 * (np.nan_to_num(delta_next) + np.nan_to_num(delta_previous))
+        )
+
+        # DIRINT coefficients, without dew point (w = -1). This is a
+        # private pvlib function, which may change on upgrade:
+        # test_row_dni_dhi_matches_cell checks the result against
+        # the public pvlib.irradiance.dirint
+        dirint_coeffs = pvlib.irradiance._dirint_coeffs(
+            pd.RangeIndex(kt_prime.size),
+            kt_prime.ravel(),
+            zenith.ravel(),
+            np.full(kt_prime.size, -1),
+            delta_kt_prime.ravel()
+        ).reshape(kt_prime.shape)
+
+        dni = disc['dni'] * dirint_coeffs
+        dni = np.where(np.isnan(dni), 0, dni)
+
+        dhi = ghi - dni * np.cos(zenith * math.pi / 180)
+
+        return dni, dhi
+
+    def _get_row_irradiance(self, lat_idx):
+        """Solar position, DNI and DHI for a latitude row.
+
+        Only active cells are computed, masked cells are NaN. Solar
+        position is read from the solar geometry store if there is
+        one. The most recent row is kept, so that resource data for
+        each cell in the row is sliced from it.
+        """
+        if self.irradiance_row is None or self.irradiance_row['lat_idx'] != lat_idx:
+            active_lons = self._get_active_lons(lat_idx)
+            if self.solar_geometry is None:
+                zenith, apparent_zenith, azimuth = get_solar_position(
+                    self.variables['lat'][lat_idx],
+                    self.variables['lon'][active_lons, np.newaxis],
+                    self.date_times
+                )
+            else:
+                grid_lat_idx = self.tile_attrs['grid_lat_start'] + self.lat_band.start + lat_idx
+                grid_lon_indices = self.tile_attrs['grid_lon_start'] + np.asarray(active_lons, dtype=int)
+                zenith, apparent_zenith, azimuth = (
+                    values[grid_lon_indices]
+                    for values in self.solar_geometry.get_row(grid_lat_idx)
+                )
+            dni, dhi = self._get_grid_dni_dhi(
+                zenith,
+                self.date_times,
+                self.variables['ghi_w_per_m_2'][lat_idx, active_lons]
+            )
+
+            self.irradiance_row = dict(lat_idx=lat_idx)
+            for name, values in (
+                ('apparent_zenith', apparent_zenith),
+                ('azimuth', np.broadcast_to(azimuth, zenith.shape)),
+                ('dni', dni),
+                ('dhi', dhi)
+            ):
+                row_values = np.full((len(self.variables['lon']), HOURS_PER_YEAR), np.nan, dtype=self.dtype)
+                row_values[active_lons] = values
+                self.irradiance_row[name] = row_values
+
+        return self.irradiance_row
+
+    def _get_row_dni_dhi(self, lat_idx):
+        """Approximate DNI and DHI for a latitude row."""
+        irradiance = self._get_row_irradiance(lat_idx)
+        return irradiance['dni'], irradiance['dhi']
+
+    def _get_row_solar_resource_data(self, lat_idx, lon_indices):
+        """Populate solar resource data for cells of a row.
+
+        Columns are converted from contiguous row arrays, and time
+        columns are shared by every cell.
+        https://nrel-pysam.readthedocs.io/en/master/modules/Pvwattsv7.html
+        """
+        lat = self.variables['lat'][lat_idx]
+        lons = self.variables['lon']
+        dni, dhi = self._get_row_dni_dhi(lat_idx)
+        data_columns = {
+            'dn' :      dni,
+            'df' :      dhi,
+            'tdry' :    self.variables['temperature_c'][lat_idx],
+            'wspd' :    self.variables['wind_speed_2_m_per_s'][lat_idx]
         }
 
-        return solar_resource_data
+        for lon_idx in lon_indices:
+            solar_resource_data = {
+                'lat' :     lat,
+                'lon' :     lons[lon_idx],
+                'tz' :      0,
+                'elev' :    0,
+                **self.solar_time_columns
+            }
+            for column, values in data_columns.items():
+                solar_resource_data[column] = values[lon_idx].tolist()
+
+            yield solar_resource_data
+
+    def _get_solar_resource_data(self, lat_idx, lat, lon_idx, lon):
+        """Populate solar resource data for a single cell."""
+        return next(self._get_row_solar_resource_data(lat_idx, [lon_idx]))
+
+    def _apply_solar_config(self, config: dict):
+        """Set swept solar settings on the model, or their defaults."""
+        self.solar_model.SystemDesign.dc_ac_ratio = config.get(
+            'dc_ac_ratio',
+            self.solar_model_config['SystemDesign']['dc_ac_ratio']
+        )
+
+    def _apply_wind_config(self, config: dict):
+        """Set swept wind settings on the model, or their defaults."""
+        self.wind_model.Turbine.wind_turbine_hub_ht = config.get(
+            'hub_height',
+            self.wind_model_config['Turbine']['wind_turbine_hub_ht']
+        )
 
     def simulate_solar(self, solar_resource_data, tilt):
         """Simulate solar output. Return hourly capacity factors"""
@@ -366,58 +1301,184 @@ class MerraPowerGeneration:
 
         return solar_generation / (self.solar_model.SystemDesign.system_capacity * 1000)
 
-    def _get_wind_resource_data(self, lat_idx, lon_idx):
-        """Populate wind resource data.
-        
+    @staticmethod
+    def _get_sky_diffuse_self_shading(tilt, gcr):
+        """Fraction of sky diffuse irradiance reaching an interior
+        row of a fixed array, averaged over the module slant."""
+        tilt = np.radians(tilt)
+        slant_position = np.linspace(0, 1, 1001)
+        masking_angle = np.arctan(
+            (1 - slant_position) * np.sin(tilt)
+            / (1 / gcr - (1 - slant_position) * np.cos(tilt))
+        )
+        sky_view = np.mean((1 + np.cos(tilt + masking_angle)) / 2)
+
+        return sky_view / ((1 + np.cos(tilt)) / 2)
+
+    def simulate_solar_numpy(
+        self,
+        apparent_zenith,
+        azimuth,
+        dni,
+        dhi,
+        temperature_c,
+        wind_speed,
+        tilt
+    ):
+        """Simulate solar output for many cells at once.
+        Return hourly capacity factors.
+
+        Vectorized approximation of `simulate_solar` following
+        PVWatts: Perez transposition with row self-shading, physical
+        cover loss, NOCT cell temperature, linear temperature
+        coefficient, system losses and the PVWatts inverter. System
+        design is read from the initialized PySAM solar model. Time is
+        the last axis.
+
+        Annual energy agrees with PySAM within 3% and hourly capacity
+        factors within 0.05 on the test data
+        (see tests/test_power_generation.py).
+        """
+        system_design = self.solar_model.SystemDesign
+        surface_azimuth = system_design.azimuth
+        sun_up = apparent_zenith < 90
+
+        # plane of array irradiance
+        aoi = pvlib.irradiance.aoi(tilt, surface_azimuth, apparent_zenith, azimuth)
+        poa_beam = np.maximum(dni * np.cos(np.radians(aoi)), 0)
+
+        dni_extra = pvlib.irradiance.get_extra_radiation(self.date_times).values
+        airmass = pvlib.atmosphere.get_relative_airmass(apparent_zenith)
+        poa_sky_diffuse = pvlib.irradiance.perez(
+            tilt,
+            surface_azimuth,
+            dhi,
+            dni,
+            dni_extra,
+            apparent_zenith,
+            azimuth,
+            airmass
+        )
+
+        # like PySAM, drop circumsolar brightening near the horizon
+        poa_sky_diffuse = np.where(
+            apparent_zenith > 87,
+            dhi * (1 + np.cos(np.radians(tilt))) / 2,
+            poa_sky_diffuse
+        )
+
+        ghi = dni * np.cos(np.radians(apparent_zenith)) + dhi
+        poa_ground_diffuse = pvlib.irradiance.get_ground_diffuse(tilt, ghi, PV_ALBEDO)
+
+        # row to row shading
+        profile_elevation = np.arctan(
+            np.tan(np.radians(90 - apparent_zenith))
+            / np.maximum(np.cos(np.radians(azimuth - surface_azimuth)), 1e-6)
+        )
+        beam_shaded_fraction = np.clip(
+            1 - np.sin(profile_elevation)
+            / (PV_GROUND_COVERAGE_RATIO * np.sin(profile_elevation + np.radians(tilt))),
+            0,
+            1
+        )
+        beam_shaded_fraction = np.where(
+            np.cos(np.radians(azimuth - surface_azimuth)) > 0,
+            beam_shaded_fraction,
+            0
+        )
+        poa_beam = poa_beam * (1 - beam_shaded_fraction)
+        poa_sky_diffuse = poa_sky_diffuse * self._get_sky_diffuse_self_shading(
+            tilt,
+            PV_GROUND_COVERAGE_RATIO
+        )
+
+        poa = np.where(sun_up, poa_beam + poa_sky_diffuse + poa_ground_diffuse, 0)
+
+        # irradiance transmitted through the module cover
+        cover_parameters = dict(
+            n=PV_COVER_REFRACTIVE_INDEX,
+            K=PV_COVER_GLAZING_EXTINCTION,
+            L=PV_COVER_GLAZING_THICKNESS
+        )
+        beam_iam = pvlib.iam.physical(aoi, **cover_parameters)
+        diffuse_iam = pvlib.iam.marion_diffuse('physical', tilt, **cover_parameters)
+        transmitted_poa = np.where(
+            sun_up,
+            poa_beam * beam_iam
+            + poa_sky_diffuse * diffuse_iam['sky']
+            + poa_ground_diffuse * diffuse_iam['ground'],
+            0
+        )
+
+        # cell temperature, ambient at night
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cell_temperature = pvlib.temperature.noct_sam(
+                poa,
+                temperature_c,
+                wind_speed,
+                PV_NOCT,
+                PV_MODULE_EFFICIENCY,
+                effective_irradiance=np.where(poa > 0, transmitted_poa, 0),
+                array_height=1,
+                mount_standoff=4
+            )
+
+        # dc output (W)
+        dc_capacity = system_design.system_capacity * 1000
+        dc = dc_capacity * transmitted_poa / 1000 \
+            * (1 + PV_TEMPERATURE_COEFFICIENT * (cell_temperature - 25)) \
+            * (1 - system_design.losses / 100)
+
+        # ac output (W)
+        inverter_efficiency = system_design.inv_eff / 100
+        ac_capacity = dc_capacity / system_design.dc_ac_ratio
+        ac = pvlib.inverter.pvwatts(
+            dc,
+            ac_capacity / inverter_efficiency,
+            eta_inv_nom=inverter_efficiency
+        )
+        ac = np.maximum(ac, 0) * (1 - self.solar_model.AdjustmentFactors.constant / 100)
+
+        # missing resource data produces no power
+        ac = np.where(np.isfinite(ac), ac, 0)
+
+        return ac / dc_capacity
+
+    def _get_row_wind_resource_data(self, lat_idx, lon_indices):
+        """Populate wind resource data for cells of a row.
+
         Primary documentation for PySAM WindPower does not 
         describe what the wind_resource_data dict should look like.
         Instead, the format is assumed from PySAM's source code.
         https://github.com/NREL/pysam/blob/d269cab0dbcaeaa2e5126decb9d1114e6dd83dc4/files/ResourceTools.py
-        """
-        wind_resource_data = {
-            'heights' : [],
-            'fields' : [],
-            'data' : []            
-        }
-
-        # these are the possible fields
-        field_names = ('temperature', 'pressure', 'speed', 'direction')
 
-        # these are the fields we have data for
+        Hourly data rows are built from contiguous row arrays rather
+        than indexed hour by hour.
+        """
+        # header information
+        heights = [height for height, _ in WIND_RESOURCE_FIELDS]
         fields = [
-            (2, 'temperature'),
-            (2, 'pressure'),
-            (2, 'speed'),
-            (10, 'speed'),
-            (50, 'speed'),
-            (50, 'direction')
+            WIND_RESOURCE_FIELD_NAMES.index(field_name) + 1
+            for _, field_name in WIND_RESOURCE_FIELDS
+        ]
+        field_rows = [
+            self.variables[variable][lat_idx]
+            for variable in WIND_RESOURCE_FIELDS.values()
         ]
 
-        # this dictionary maps the fields we have data for
-        # to their variable names
-        field_variables = {
-            (2, 'temperature') : 'temperature_c',
-            (2, 'pressure') : 'pressure_atm',
-            (2, 'speed') : 'wind_speed_2_m_per_s',
-            (10, 'speed') : 'wind_speed_10_m_per_s',
-            (50, 'speed') : 'wind_speed_50_m_per_s',
-            (50, 'direction') : 'wind_direction_deg',
-        }
-
-        # append header information
-        for height, field_name in fields:
-            wind_resource_data['heights'].append(height)
-            wind_resource_data['fields'].append(field_names.index(field_name) + 1)
-
-        # append hourly data rows
-        for hour in range(HOURS_PER_YEAR):
-            data_row = [
-                self.variables[field_variables[field]][lat_idx, lon_idx, hour]
-                for field in fields
-            ]
-            wind_resource_data['data'].append(data_row)
+        for lon_idx in lon_indices:
+            yield {
+                'heights' : list(heights),
+                'fields' : list(fields),
+                'data' : np.stack(
+                    [field_row[lon_idx] for field_row in field_rows],
+                    axis=1
+                ).tolist()
+            }
 
-        return wind_resource_data
+    def _get_wind_resource_data(self, lat_idx, lon_idx):
+        """Populate wind resource data for a single cell."""
+        return next(self._get_row_wind_resource_data(lat_idx, [lon_idx]))
 
     def simulate_wind(self, wind_resource_data, wind_turbine_class):
         """Simulate wind output. Return hourly wind capacity factors"""
@@ -433,58 +1494,642 @@ class MerraPowerGeneration:
         wind_generation = np.array(self.wind_model.Outputs.gen) 
 
         return wind_generation / self.wind_model.Farm.system_capacity 
+
+    def simulate_wind_numpy(
+        self,
+        wind_speed_50,
+        temperature_c,
+        pressure_atm,
+        wind_turbine_class
+    ):
+        """Simulate wind output for many cells at once.
+        Return hourly wind capacity factors.
+
+        Vectorized equivalent of `simulate_wind` for a single turbine
+        without a wake model. Like PySAM, the 50 m wind speed (closest
+        measurement to hub height) is extrapolated with the model's
+        fixed shear exponent, corrected for air density, and looked up
+        in the power curve of each cell's IEC class. Time is the last
+        axis; `wind_turbine_class` has the shape of the other axes.
+
+        Hourly capacity factors agree with PySAM within 1e-3 on the
+        test data (see tests/test_power_generation.py).
+        """
+        turbine = self.wind_model.Turbine
+
+        # hub height wind speed
+        hub_wind_speed = wind_speed_50 \
+            * (turbine.wind_turbine_hub_ht / 50) \
+            ** turbine.wind_resource_shear
+
+        # correct wind speed for air density
+        air_density = pressure_atm / ATM_PER_PASCAL / (
+            GAS_CONSTANT_DRY_AIR * (temperature_c + KELV_CELSIUS_OFFSET)
+        )
+        hub_wind_speed = hub_wind_speed \
+            * (air_density / AIR_DENSITY_SEA_LEVEL) ** (1 / 3)
+
+        # missing resource data produces no power, as in PySAM
+        hub_wind_speed = np.where(np.isfinite(hub_wind_speed), hub_wind_speed, 0)
+
+        # turbine output by class
+        wind_generation = np.zeros(hub_wind_speed.shape)
+        for turbine_class in np.unique(wind_turbine_class):
+            in_class = wind_turbine_class == turbine_class
+            wind_generation[in_class] = np.interp(
+                hub_wind_speed[in_class],
+                self.wind_power_curves['wind_speed'],
+                self.wind_power_curves[turbine_class]
+            )
+
+        # farm losses are compounded across categories
+        loss_factor = np.prod([
+            1 - loss / 100
+            for loss in self.wind_model.Losses.export().values()
+        ])
+
+        return wind_generation * loss_factor / self.wind_model.Farm.system_capacity
         
-    def run(self):
-        """Calculate hourly solar and wind capacity factors,
-        and store output in a netCDF file
+    def _get_model_config(self, technology: str):
+        """Model settings that determine simulated capacity factors,
+        apart from per-cell resource data and tilt.
+
+        Read when a model is initialized, since PySAM adds defaults
+        to the model when it is executed.
         """
-        # initialize output directory
-        self.output_file.parent.mkdir(parents=True, exist_ok=True)
+        if technology == 'solar':
+            config = self.solar_model.export()
+            config.pop('SolarResource', None)
+            config['SystemDesign'].pop('tilt', None)
+            engine = self.solar_engine
+        else:
+            config = self.wind_model.export()
+            config['Resource'].pop('wind_resource_data', None)
+            for field in ('wind_turbine_powercurve_windspeeds', 'wind_turbine_powercurve_powerout'):
+                config['Turbine'].pop(field, None)
+            config['power_curves'] = {
+                str(curve) : values for curve, values in self.wind_power_curves.items()
+            }
+            engine = self.wind_engine
+        config.pop('Outputs', None)
+        config['engine'] = engine
+
+        return config
+
+    def _get_cached_results(self, lat_idx, technology: str, lon_indices):
+        """Result cache keys for cells of a row, and the capacity
+        factors already cached, by cell."""
+        if self.result_cache is None:
+            return {}, {}
+
+        if technology == 'solar':
+            config = [self.solar_model_config, self.solar_configs]
+        else:
+            config = [self.wind_model_config, self.wind_configs]
+        resource_variables = SOLAR_RESOURCE_VARIABLES if technology == 'solar' \
+            else WIND_RESOURCE_VARIABLES
+        lat = float(self.variables['lat'][lat_idx])
+        keys = {
+            lon_idx : ResultCache.get_key(
+                technology,
+                config,
+                [int(self.year), lat, float(self.variables['lon'][lon_idx])],
+                *(self.variables[variable][lat_idx, lon_idx] for variable in resource_variables)
+            )
+            for lon_idx in lon_indices
+        }
+        cached = {
+            lon_idx : values
+            for lon_idx, values in zip(keys, map(self.result_cache.get, keys.values()))
+            if values is not None
+        }
 
-        # setup solar and wind models
-        self._initialize_solar_model()
-        self._initialize_wind_model()
+        return keys, cached
+
+    def _cache_results(self, keys, cached, capacity_factors):
+        """Fill cached cells of a row and store the others."""
+        for lon_idx, key in keys.items():
+            if lon_idx in cached:
+                capacity_factors[lon_idx] = cached[lon_idx]
+            else:
+                self.result_cache.put(key, capacity_factors[lon_idx])
+
+    def _prepare_row(self, lat_idx):
+        """Start simulating a latitude row.
 
-        # setup empty dataset
-        dataset = self._initialize_dataset()
-
-        # run power simulation
-        for lat_idx, lat in enumerate(self.variables['lat']):
-            for lon_idx, lon in enumerate(self.variables['lon']):
-                logging.info(f'Calculating power generation for {lat:.2f}, {lon:.2f} (lat, lon)...')
-                # get solar resource data                    
-                solar_resource_data = self._get_solar_resource_data(
-                    lat_idx,
-                    lat,
-                    lon_idx,
-                    lon
+        Returns the row's state: NaN-filled capacity factors of every
+        cell and configuration, filled from the result cache and by
+        the numpy engines, and the cells left to simulate with PySAM.
+        Masked cells are left as NaN.
+        """
+        lons = self.variables['lon']
+        active_lons = self._get_active_lons(lat_idx)
+        row = dict(lat_idx=lat_idx, lat=self.variables['lat'][lat_idx], active_lons=active_lons)
+        for technology, configs in (('solar', self.solar_configs), ('wind', self.wind_configs)):
+            row[technology] = np.full((len(lons), len(configs), HOURS_PER_YEAR), np.nan, dtype=self.dtype)
+            row[f'{technology}_keys'], row[f'cached_{technology}'] = self._get_cached_results(
+                lat_idx,
+                technology,
+                active_lons
+            )
+        solar_lons = [lon_idx for lon_idx in active_lons if lon_idx not in row['cached_solar']]
+        wind_lons = [lon_idx for lon_idx in active_lons if lon_idx not in row['cached_wind']]
+
+        if self.solar_engine == 'numpy' and solar_lons:
+            # run vectorized solar for uncached cells of the row
+            irradiance = self._get_row_irradiance(lat_idx)
+            for config_idx, config in enumerate(self.solar_configs):
+                self._apply_solar_config(config)
+                row['solar'][solar_lons, config_idx] = self.simulate_solar_numpy(
+                    irradiance['apparent_zenith'][solar_lons],
+                    irradiance['azimuth'][solar_lons],
+                    irradiance['dni'][solar_lons],
+                    irradiance['dhi'][solar_lons],
+                    self.variables['temperature_c'][lat_idx, solar_lons],
+                    self.variables['wind_speed_2_m_per_s'][lat_idx, solar_lons],
+                    config.get('tilt', abs(row['lat']))
                 )
 
-                # run PySAM solar
-                solar_capacity_factors = self.simulate_solar(
-                    solar_resource_data,
-                    abs(lat)
+        if self.wind_engine == 'numpy' and wind_lons:
+            # run vectorized wind for uncached cells of the row
+            wind_turbine_classes = self.variables['wind_turbine_iec_class'][lat_idx, wind_lons]
+            for config_idx, config in enumerate(self.wind_configs):
+                self._apply_wind_config(config)
+                row['wind'][wind_lons, config_idx] = self.simulate_wind_numpy(
+                    self.variables['wind_speed_50_m_per_s'][lat_idx, wind_lons],
+                    self.variables['temperature_c'][lat_idx, wind_lons],
+                    self.variables['pressure_atm'][lat_idx, wind_lons],
+                    np.full_like(wind_turbine_classes, config['turbine_class'])
+                    if 'turbine_class' in config else wind_turbine_classes
                 )
 
-                # write solar generation
-                dataset.variables['solar_capacity_factor'][lat_idx, lon_idx] = solar_capacity_factors
+        # cells left for PySAM
+        row['pysam_lons'] = {
+            'solar' : solar_lons if self.solar_engine == 'pysam' else [],
+            'wind' : wind_lons if self.wind_engine == 'pysam' else []
+        }
+        row['pending'] = sum(map(len, row['pysam_lons'].values()))
 
-                # get wind resource data
-                wind_resource_data = self._get_wind_resource_data(
-                    lat_idx,
-                    lon_idx
-                )
+        return row
+
+    def _get_row_tasks(self, row):
+        """Yield PySAM simulations of a prepared row, as
+        (lon_idx, technology, resource data) for each cell.
+
+        Resource data is built lazily, a cell at a time.
+        """
+        lat_idx = row['lat_idx']
+        lons = self.variables['lon']
+        resources = {
+            'solar' : self._get_row_solar_resource_data(lat_idx, row['pysam_lons']['solar']),
+            'wind' : self._get_row_wind_resource_data(lat_idx, row['pysam_lons']['wind'])
+        }
 
+        for lon_idx in row['active_lons']:
+            logging.info(f'Calculating power generation for {row["lat"]:.2f}, {lons[lon_idx]:.2f} (lat, lon)...')
+            for technology, technology_lons in row['pysam_lons'].items():
+                if lon_idx in technology_lons:
+                    yield lon_idx, technology, next(resources[technology])
+
+    def _simulate_cell(self, row, lon_idx, technology: str, resource_data):
+        """Simulate every configuration of a technology for a cell
+        with PySAM. Models must be initialized before calling."""
+        configs = self.solar_configs if technology == 'solar' else self.wind_configs
+        capacity_factors = np.empty((len(configs), HOURS_PER_YEAR), dtype=self.dtype)
+        for config_idx, config in enumerate(configs):
+            if technology == 'solar':
+                # run PySAM solar
+                self._apply_solar_config(config)
+                capacity_factors[config_idx] = self.simulate_solar(
+                    resource_data,
+                    config.get('tilt', abs(row['lat']))
+                )
+            else:
                 # run PySAM wind
-                wind_capacity_factors = self.simulate_wind(
-                    wind_resource_data, 
-                    self.variables['wind_turbine_iec_class'][lat_idx, lon_idx]
+                self._apply_wind_config(config)
+                capacity_factors[config_idx] = self.simulate_wind(
+                    resource_data,
+                    config.get(
+                        'turbine_class',
+                        self.variables['wind_turbine_iec_class'][row['lat_idx'], lon_idx]
                     )
+                )
+
+        return capacity_factors
+
+    def _finish_row(self, row):
+        """Cache a simulated row, returning its index and capacity factors."""
+        self._cache_results(row['solar_keys'], row['cached_solar'], row['solar'])
+        self._cache_results(row['wind_keys'], row['cached_wind'], row['wind'])
+
+        # without a sweep, output has no configuration dimension
+        if self.sweep is None:
+            return row['lat_idx'], row['solar'][:, 0], row['wind'][:, 0]
+        return row['lat_idx'], row['solar'], row['wind']
+
+    def _simulate_row(self, lat_idx):
+        """Calculate hourly solar and wind capacity factors
+        for the active cells of a latitude row.
+
+        Each cell's resource data is built once and simulated for every
+        swept configuration. Masked cells are left as NaN, and cells
+        found in the result cache are not simulated. Models must be
+        initialized before calling.
+        """
+        row = self._prepare_row(lat_idx)
+        for lon_idx, technology, resource_data in self._get_row_tasks(row):
+            row[technology][lon_idx] = self._simulate_cell(row, lon_idx, technology, resource_data)
 
-                # write wind generation
-                dataset.variables['wind_capacity_factor'][lat_idx, lon_idx] = wind_capacity_factors
+        return self._finish_row(row)
 
-        dataset.to_netcdf(self.output_file)
+    def _simulate_rows(self, lat_indices):
+        """Yield simulated latitude rows, in parallel if more
+        than one worker is requested, or pipelined.
+        """
+        if self.pipeline:
+            yield from self._simulate_pipelined_rows(lat_indices)
+        elif self.workers > 1:
+            logging.info(f'Simulating {len(lat_indices)} rows with {self.workers} workers...')
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_initialize_worker,
+                initargs=(self,)
+            ) as executor:
+                yield from executor.map(_simulate_worker_row, lat_indices)
+        else:
+            # setup solar and wind models
+            self._initialize_solar_model()
+            self._initialize_wind_model()
+
+            for lat_idx in lat_indices:
+                yield self._simulate_row(lat_idx)
+
+    def _prepare_pipeline(
+        self,
+        lat_indices,
+        executor: ProcessPoolExecutor,
+        submitted: Queue,
+        in_flight: Semaphore,
+        stop: Event
+    ):
+        """Pipeline stage preparing rows and submitting their PySAM
+        simulations, waiting while `queue_size` cells are in flight.
+        Returns early once `stop` is set."""
+        try:
+            for lat_idx in lat_indices:
+                if stop.is_set():
+                    return
+                row = self._prepare_row(lat_idx)
+                # rows without PySAM simulations go straight to the writer
+                if not row['pending']:
+                    submitted.put((row, None, None, None))
+                # workers only need the row's coordinates
+                cell_row = dict(lat_idx=row['lat_idx'], lat=row['lat'])
+                for lon_idx, technology, resource_data in self._get_row_tasks(row):
+                    in_flight.acquire()
+                    if stop.is_set():
+                        return
+                    submitted.put((
+                        row,
+                        lon_idx,
+                        technology,
+                        executor.submit(_simulate_worker_cell, cell_row, lon_idx, technology, resource_data)
+                    ))
+        except Exception as error:
+            submitted.put(error)
+        finally:
+            submitted.put(None)
+
+    def _simulate_pipelined_rows(self, lat_indices):
+        """Yield simulated latitude rows as they complete, with data
+        preparation, simulation and writing overlapped.
+
+        A thread prepares rows, running the numpy engines and building
+        PySAM resource data cell by cell, and submits cells to
+        `workers` processes running PySAM. Rows are written by the
+        caller. At most `queue_size` cells are in flight. The number
+        of cells in flight is sampled as each cell is collected and
+        logged for each band with the share of cells already simulated
+        when collected: a full queue of unfinished cells means
+        simulation is the bottleneck, a full queue of finished cells
+        writing, and a near empty queue preparation.
+        """
+        # models of this instance run the numpy engines
+        self._initialize_solar_model()
+        self._initialize_wind_model()
+
+        logging.info(f'Pipelining {len(lat_indices)} rows with {self.workers} workers...')
+        depths = []
+        ready = []
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_initialize_worker,
+            initargs=(self,)
+        ) as executor:
+            submitted = Queue()
+            in_flight = Semaphore(self.queue_size)
+            stop = Event()
+            preparer = Thread(
+                target=self._prepare_pipeline,
+                args=(lat_indices, executor, submitted, in_flight, stop),
+                daemon=True
+            )
+            preparer.start()
+
+            try:
+                for task in iter(submitted.get, None):
+                    if isinstance(task, Exception):
+                        raise task
+
+                    row, lon_idx, technology, future = task
+                    if future is not None:
+                        depths.append(submitted.qsize() + 1)
+                        ready.append(future.done())
+                        row[technology][lon_idx] = future.result()
+                        row['pending'] -= 1
+                        in_flight.release()
+                    if not row['pending']:
+                        yield self._finish_row(row)
+            finally:
+                # on errors, unblock the preparer so that it exits
+                # and frees the band data it holds
+                stop.set()
+                in_flight.release()
+                preparer.join()
+
+        self.queue_depths = {
+            'in_flight' : (np.mean(depths) if depths else 0.0, max(depths, default=0)),
+            'ready' : np.mean(ready) if ready else 0.0
+        }
+        logging.info('Pipeline cells in flight (mean, max of {}): {:.1f}, {}, {:.0%} simulated when collected'.format(
+            self.queue_size,
+            *self.queue_depths['in_flight'],
+            self.queue_depths['ready']
+        ))
+
+    def _get_cell_clusters(self, lat_indices):
+        """Cluster the active cells of band rows by resource.
+
+        Cells are grouped by IEC class, then clustered with k-means on
+        standardized annual mean GHI, 10th, 50th and 90th percentile
+        50 m wind speed and absolute latitude (the default tilt), into
+        `cluster_fraction` of the cells of each class. Returns a dict
+        mapping each active (lat_idx, lon_idx) to the representative of
+        its cluster, the member closest to the cluster centre.
+        """
+        from scipy.cluster.vq import kmeans2
+
+        cells = []
+        features = []
+        classes = []
+        for lat_idx in lat_indices:
+            active_lons = self._get_active_lons(lat_idx)
+            cells += [(lat_idx, lon_idx) for lon_idx in active_lons]
+            features.append(np.column_stack([
+                self.variables['ghi_w_per_m_2'][lat_idx, active_lons].mean(axis=1),
+                np.percentile(self.variables['wind_speed_50_m_per_s'][lat_idx, active_lons], (10, 50, 90), axis=1).T,
+                np.full(len(active_lons), abs(self.variables['lat'][lat_idx]))
+            ]))
+            classes.append(self.variables['wind_turbine_iec_class'][lat_idx, active_lons])
+        features = np.concatenate(features).astype(np.float64)
+        classes = np.concatenate(classes)
+
+        # features in standard deviations, so that each weighs the same
+        scale = features.std(axis=0)
+        scale[scale == 0] = 1
+        features = (features - features.mean(axis=0)) / scale
+
+        representatives = {}
+        for turbine_class in np.unique(classes):
+            class_cells = np.flatnonzero(classes == turbine_class)
+            n_clusters = math.ceil(self.cluster_fraction * len(class_cells))
+            if n_clusters < len(class_cells):
+                centroids, labels = kmeans2(features[class_cells], n_clusters, minit='++', seed=0)
+            else:
+                centroids, labels = features[class_cells], np.arange(len(class_cells))
+
+            # empty clusters have no members, and are dropped
+            for label in np.unique(labels):
+                members = class_cells[labels == label]
+                distances = ((features[members] - centroids[label])**2).sum(axis=1)
+                representative = cells[members[np.argmin(distances)]]
+                for member in members:
+                    representatives[cells[member]] = representative
+
+        return representatives
+
+    @staticmethod
+    def transfer_solar(capacity_factors, ghi, representative_ghi):
+        """Solar capacity factors of a cell from those of its cluster's
+        representative.
+
+        PV output is close to linear in irradiance, so each hour is
+        scaled by the ratio of the cell's GHI to the representative's,
+        capped at the representative's peak output. Hours without sun
+        at the representative produce nothing. Time is the last axis.
+        """
+        ratio = np.divide(
+            ghi,
+            representative_ghi,
+            out=np.zeros(np.shape(ghi)),
+            where=representative_ghi > 0
+        )
+        return np.minimum(capacity_factors * ratio, capacity_factors.max(axis=-1, keepdims=True))
+
+    @staticmethod
+    def transfer_wind(capacity_factors, wind_speed, representative_wind_speed):
+        """Wind capacity factors of a cell from those of its cluster's
+        representative.
+
+        The representative's simulated hours, ordered by wind speed,
+        form an empirical power curve that keeps its hub height, losses
+        and turbine class. Each hour of the cell is read from that curve
+        at the cell's wind speed, clamped to the representative's
+        range. Wind speeds should be density corrected. Time is the
+        last axis.
+        """
+        order = np.argsort(representative_wind_speed)
+        capacity_factors = np.asarray(capacity_factors)
+        return np.stack([
+            np.interp(wind_speed, representative_wind_speed[order], config_capacity_factors[order])
+            for config_capacity_factors in capacity_factors.reshape(-1, capacity_factors.shape[-1])
+        ]).reshape(capacity_factors.shape)
+
+    def _get_equivalent_wind_speed(self, cell):
+        """50 m wind speed of a cell, corrected to sea level air density."""
+        air_density = self.variables['pressure_atm'][cell] / ATM_PER_PASCAL / (
+            GAS_CONSTANT_DRY_AIR * (self.variables['temperature_c'][cell] + KELV_CELSIUS_OFFSET)
+        )
+        return self.variables['wind_speed_50_m_per_s'][cell] * (air_density / AIR_DENSITY_SEA_LEVEL) ** (1 / 3)
+
+    def _transfer_cell(self, cell, representative, simulated):
+        """Solar and wind capacity factors of a cell, transferred
+        from the simulated capacity factors of its representative."""
+        solar, wind = simulated[representative]
+        return (
+            self.transfer_solar(
+                solar,
+                self.variables['ghi_w_per_m_2'][cell],
+                self.variables['ghi_w_per_m_2'][representative]
+            ),
+            self.transfer_wind(
+                wind,
+                self._get_equivalent_wind_speed(cell),
+                self._get_equivalent_wind_speed(representative)
+            )
+        )
+
+    def _report_cluster_errors(self, sample, representatives, simulated):
+        """Log errors of transferred capacity factors against
+        simulations of a sample of cells."""
+        errors = defaultdict(list)
+        for cell in sample:
+            for technology, expected, transferred in zip(
+                ('solar', 'wind'),
+                simulated[cell],
+                self._transfer_cell(cell, representatives[cell], simulated)
+            ):
+                errors[technology, 'hourly'].append(np.abs(transferred - expected).mean())
+                errors[technology, 'annual'].append(np.abs(transferred.mean(axis=-1) - expected.mean(axis=-1)))
+
+        self.cluster_errors = {
+            technology : {
+                'hourly_mean_abs_error' : float(np.mean(errors[technology, 'hourly'])),
+                'annual_mean_abs_error' : float(np.mean(errors[technology, 'annual'])),
+                'annual_max_abs_error' : float(np.max(errors[technology, 'annual']))
+            }
+            for technology in ('solar', 'wind')
+        }
+        for technology, technology_errors in self.cluster_errors.items():
+            logging.info(
+                f'Clustered {technology} capacity factors of {len(sample)} sampled cells differ by '
+                f'{technology_errors["hourly_mean_abs_error"]:.4f} hourly and '
+                f'{technology_errors["annual_mean_abs_error"]:.4f} annually on average, at most '
+                f'{technology_errors["annual_max_abs_error"]:.4f} annually'
+            )
+
+    def _simulate_clustered_rows(self, lat_indices):
+        """Yield latitude rows with only cluster representatives simulated.
+
+        Other cells are transferred from their representative with
+        `transfer_solar` and `transfer_wind`. A random sample of
+        `cluster_sample` other cells is also simulated, written as
+        simulated, and used to report the error of the transfer.
+        """
+        representatives = self._get_cell_clusters(lat_indices)
+        members = [cell for cell, representative in representatives.items() if cell != representative]
+        rng = np.random.default_rng(0)
+        sample = [
+            members[member_idx]
+            for member_idx in sorted(rng.choice(len(members), min(self.cluster_sample, len(members)), replace=False))
+        ]
+        simulated_cells = set(representatives.values()) | set(sample)
+        logging.info(
+            f'Simulating {len(set(representatives.values()))} cluster representatives '
+            f'of {len(representatives)} cells, and {len(sample)} sampled cells...'
+        )
+
+        # simulate only representative and sampled cells
+        active_cells = self.active_cells
+        self.active_cells = np.zeros_like(active_cells)
+        for lat_idx, lon_idx in simulated_cells:
+            self.active_cells[self.lat_band.start + lat_idx, lon_idx] = True
+        simulated = {}
+        try:
+            for lat_idx, solar, wind in self._simulate_rows(sorted({lat_idx for lat_idx, _ in simulated_cells})):
+                for lon_idx in self._get_active_lons(lat_idx):
+                    simulated[lat_idx, lon_idx] = solar[lon_idx], wind[lon_idx]
+        finally:
+            self.active_cells = active_cells
+
+        if sample:
+            self._report_cluster_errors(sample, representatives, simulated)
+
+        solar_shape, wind_shape = (np.shape(values) for values in next(iter(simulated.values())))
+        for lat_idx in lat_indices:
+            solar = np.full((len(self.variables['lon']),) + solar_shape, np.nan, dtype=self.dtype)
+            wind = np.full((len(self.variables['lon']),) + wind_shape, np.nan, dtype=self.dtype)
+            for lon_idx in self._get_active_lons(lat_idx):
+                cell = (lat_idx, lon_idx)
+                solar[lon_idx], wind[lon_idx] = simulated[cell] if cell in simulated \
+                    else self._transfer_cell(cell, representatives[cell], simulated)
+            yield lat_idx, solar, wind
+
+    def run(self):
+        """Calculate hourly solar and wind capacity factors,
+        and store output in a netCDF file
+        """
+        # initialize output directory
+        self.output_file.parent.mkdir(parents=True, exist_ok=True)
+
+        # setup empty dataset, or reopen it to resume
+        with self._open_output() as dataset:
+            complete_rows = np.array(dataset['row_complete'][:]) == 1
+            if complete_rows.any():
+                logging.info(f'Skipping {complete_rows.sum()} completed rows...')
+
+            for lat_band in self._get_lat_bands():
+                lat_indices = [
+                    lat_idx
+                    for lat_idx in range(lat_band.stop - lat_band.start)
+                    if not complete_rows[lat_band.start + lat_idx]
+                ]
+
+                # rows without active cells are left as fill values
+                for lat_idx in list(lat_indices):
+                    if not self.active_cells[lat_band.start + lat_idx].any():
+                        dataset['row_complete'][lat_band.start + lat_idx] = 1
+                        lat_indices.remove(lat_idx)
+                if not lat_indices:
+                    continue
+
+                # load and derive each band when memory is limited
+                if self.max_memory_mb is not None:
+                    self._load_band(lat_band)
+
+                # run power simulation, or approximate it by clusters
+                simulated_rows = self._simulate_clustered_rows(lat_indices) \
+                    if self.cluster_fraction is not None else self._simulate_rows(lat_indices)
+                for lat_idx, solar_capacity_factors, wind_capacity_factors in simulated_rows:
+                    # workers write their own rows of zarr output
+                    if solar_capacity_factors is None:
+                        continue
+
+                    # write solar and wind generation
+                    self._write_row(
+                        dataset,
+                        lat_idx,
+                        solar_capacity_factors,
+                        wind_capacity_factors
+                    )
+
+        if self.result_cache is not None:
+            self.result_cache.evict()
+
+def _initialize_worker(power_generation: MerraPowerGeneration):
+    """Setup solar and wind models in a worker process."""
+    global _worker_power_generation
+    _worker_power_generation = power_generation
+    _worker_power_generation._initialize_solar_model()
+    _worker_power_generation._initialize_wind_model()
+
+def _simulate_worker_row(lat_idx):
+    result = _worker_power_generation._simulate_row(lat_idx)
+    # clustered runs transfer results to other cells before writing
+    if _worker_power_generation.output_file.suffix != '.zarr' \
+        or _worker_power_generation.cluster_fraction is not None:
+        return result
+
+    # rows are separate chunks, so workers write without a gather step
+    import zarr
+    _worker_power_generation._write_row(
+        zarr.open_group(str(_worker_power_generation.output_file), mode='r+'),
+        *result
+    )
+    return lat_idx, None, None
+
+def _simulate_worker_cell(row, lon_idx, technology, resource_data):
+    return _worker_power_generation._simulate_cell(row, lon_idx, technology, resource_data)
 
 if __name__ == '__main__':
     parser = ArgumentParser()
@@ -500,13 +2145,70 @@ if __name__ == '__main__':
             'wind_turbine_power_curves.csv'
         )
     )
+    parser.add_argument('--mask-files', type=Path, nargs='+')
+    parser.add_argument(
+        '--bounding-box',
+        type=float,
+        nargs=4,
+        metavar=('MIN_LAT', 'MAX_LAT', 'MIN_LON', 'MAX_LON')
+    )
+    parser.add_argument('--tile', type=str, metavar='I/N')
+    parser.add_argument('--lat-range', type=int, nargs=2, metavar=('START', 'STOP'))
+    parser.add_argument('--lon-range', type=int, nargs=2, metavar=('START', 'STOP'))
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--solar-engine', choices=SOLAR_ENGINES, default='pysam')
+    parser.add_argument('--wind-engine', choices=WIND_ENGINES, default='pysam')
+    parser.add_argument('--max-memory-mb', type=float)
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--merra-year', type=int)
+    parser.add_argument('--derived-cache-dir', type=Path)
+    parser.add_argument('--result-cache-dir', type=Path)
+    parser.add_argument('--result-cache-max-mb', type=float)
+    parser.add_argument('--sweep-file', type=Path)
+    parser.add_argument('--wind-class-files', type=Path, nargs='+')
+    parser.add_argument('--dtype', choices=DTYPES, default='float64')
+    parser.add_argument('--scaled-output', action='store_true')
+    parser.add_argument('--output-zlib', action='store_true')
+    parser.add_argument('--output-complevel', type=int, default=4)
+    parser.add_argument('--output-temperature', choices=TEMPERATURE_OUTPUTS, default='full')
+    parser.add_argument('--solar-geometry-dir', type=Path)
+    parser.add_argument('--pipeline', action='store_true')
+    parser.add_argument('--queue-size', type=int, default=16)
+    parser.add_argument('--cluster-fraction', type=float)
+    parser.add_argument('--cluster-sample', type=int, default=10)
 
     args = parser.parse_args()
 
     power_generation = MerraPowerGeneration(
         args.combined_merra_file,
         args.output_file,
-        args.wind_power_curve_file
+        args.wind_power_curve_file,
+        mask_files=args.mask_files,
+        bounding_box=args.bounding_box,
+        tile=tuple(map(int, args.tile.split('/'))) if args.tile else None,
+        lat_range=args.lat_range,
+        lon_range=args.lon_range,
+        workers=args.workers,
+        solar_engine=args.solar_engine,
+        wind_engine=args.wind_engine,
+        max_memory_mb=args.max_memory_mb,
+        resume=args.resume,
+        merra_year=args.merra_year,
+        derived_cache_dir=args.derived_cache_dir,
+        result_cache_dir=args.result_cache_dir,
+        result_cache_max_mb=args.result_cache_max_mb,
+        sweep_file=args.sweep_file,
+        wind_class_files=args.wind_class_files,
+        dtype=args.dtype,
+        scaled_output=args.scaled_output,
+        output_zlib=args.output_zlib,
+        output_complevel=args.output_complevel,
+        output_temperature=args.output_temperature,
+        solar_geometry_dir=args.solar_geometry_dir,
+        pipeline=args.pipeline,
+        queue_size=args.queue_size,
+        cluster_fraction=args.cluster_fraction,
+        cluster_sample=args.cluster_sample
     )
 
     power_generation.run()
@@ -0,0 +1,79 @@
+"""
+This script stores simulated capacity factors of grid cells on disk,
+so that reruns with unchanged resource data and model settings can
+skip the simulation.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import numpy as np
+
+BYTES_PER_MEGABYTE = 1024**2
+
+class ResultCache:
+    """Hourly capacity factors stored as one .npy file per key.
+
+    Reading a file refreshes its modification time, and `evict`
+    removes the least recently used files beyond `max_mb`.
+    """
+    def __init__(self, cache_dir: Path, max_mb: float=None):
+        self.cache_dir = cache_dir
+        self.max_mb = max_mb
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def get_key(*parts):
+        """Hash arrays and JSON-serializable settings into a key."""
+        key = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                key.update(np.ascontiguousarray(part).tobytes())
+            else:
+                key.update(json.dumps(part, sort_keys=True, default=str).encode())
+        return key.hexdigest()
+
+    def _get_path(self, key: str):
+        return Path(self.cache_dir, f'{key}.npy')
+
+    def get(self, key: str):
+        """Cached capacity factors, or None."""
+        cache_file = self._get_path(key)
+        try:
+            values = np.load(cache_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        os.utime(cache_file)
+        return values
+
+    def put(self, key: str, values: np.ndarray):
+        # write then rename, so concurrent workers never read partial files
+        cache_file = self._get_path(key)
+        tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_file, 'wb') as tmp:
+            np.save(tmp, values)
+        os.replace(tmp_file, cache_file)
+
+    def evict(self):
+        """Remove least recently used results until the cache fits `max_mb`."""
+        if self.max_mb is None:
+            return
+
+        cache_files = sorted(
+            (cache_file.stat().st_mtime_ns, cache_file.stat().st_size, cache_file)
+            for cache_file in self.cache_dir.glob('*.npy')
+        )
+        cache_size = sum(size for _, size, _ in cache_files)
+        max_size = self.max_mb * BYTES_PER_MEGABYTE
+        evicted = 0
+        for _, size, cache_file in cache_files:
+            if cache_size <= max_size:
+                break
+            cache_file.unlink(missing_ok=True)
+            cache_size -= size
+            evicted += 1
+
+        if evicted:
+            logging.info(f'Evicted {evicted} cached results from {self.cache_dir}...')
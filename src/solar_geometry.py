@@ -0,0 +1,170 @@
+"""
+This script stores the solar position of every cell and hour of a
+MERRA grid for a year, so that runs over the same grid and year read
+it instead of recomputing it.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pvlib
+import xarray as xr
+
+from combine_merra import HOURS_PER_YEAR
+from merra_view import open_merra_directory
+
+# increment whenever the computation changes, so old stores are not used
+GEOMETRY_VERSION = 1
+GEOMETRY_VARIABLES = ('zenith', 'apparent_zenith', 'azimuth')
+
+def get_date_times(year):
+    """Hourly timestamps for a year, without leap day."""
+    date_times = pd.date_range(
+        datetime(year, 1, 1, 0),
+        datetime(year, 12, 31, 23),
+        freq=timedelta(hours=1)
+    )
+    return date_times[(date_times.month != 2) | (date_times.day != 29)]
+
+def get_solar_position(lat, lon, date_times):
+    """Solar zenith, apparent zenith and azimuth (degrees)
+    for many cells at once.
+
+    Uses the same NREL SPA algorithm as pvlib's default
+    get_solarposition. Location-independent terms are computed
+    once per timestamp; lat and lon broadcast against them,
+    e.g. lon with shape (n_lon, 1) returns (n_lon, n_hours).
+    """
+    unixtime = np.array(date_times.view(np.int64) / 10**9)
+
+    # arguments match get_solarposition defaults at sea level
+    apparent_zenith, zenith, _, _, azimuth, _ = pvlib.spa.solar_position_numpy(
+        unixtime,
+        lat,
+        lon,
+        0,
+        101325 / 100,
+        12,
+        67.0,
+        0.5667,
+        None
+    )
+
+    return zenith, apparent_zenith, azimuth
+
+class SolarGeometryStore:
+    """Solar zenith, apparent zenith and azimuth (degrees) of a
+    grid, as memory-mapped (lat, lon, time) .npy files.
+
+    Rows are computed on demand by `get_row`, or in bulk by
+    `generate`, and marked complete once written. Stores are keyed
+    by the grid coordinates, year, dtype and pvlib version, so a
+    change to any of them uses a new store.
+    """
+    def __init__(self, store_dir: Path, lats, lons, year: int, dtype: str='float64'):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.year = int(year)
+        self.dtype = np.dtype(dtype)
+        self.path = Path(store_dir, self.get_key(self.lats, self.lons, self.year, self.dtype))
+        self._create()
+
+    @staticmethod
+    def get_key(lats: np.ndarray, lons: np.ndarray, year: int, dtype: np.dtype):
+        key = hashlib.sha256()
+        key.update(np.ascontiguousarray(lats, dtype=np.float64).tobytes())
+        key.update(np.ascontiguousarray(lons, dtype=np.float64).tobytes())
+        key.update(json.dumps({
+            'year' : year,
+            'dtype' : np.dtype(dtype).name,
+            'pvlib' : pvlib.__version__,
+            'version' : GEOMETRY_VERSION
+        }).encode())
+        return key.hexdigest()[:16]
+
+    def _create(self):
+        """Create empty files for the grid, unless they exist."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        shapes = {variable : (len(self.lats), len(self.lons), HOURS_PER_YEAR) for variable in GEOMETRY_VARIABLES}
+        shapes['rows_complete'] = (len(self.lats),)
+        for variable, shape in shapes.items():
+            store_file = Path(self.path, f'{variable}.npy')
+            if not store_file.exists():
+                np.lib.format.open_memmap(
+                    store_file,
+                    mode='w+',
+                    dtype=np.int8 if variable == 'rows_complete' else self.dtype,
+                    shape=shape
+                ).flush()
+
+    def _open(self, variable: str, mode: str='r'):
+        return np.load(Path(self.path, f'{variable}.npy'), mmap_mode=mode)
+
+    def _write_row(self, lat_idx: int):
+        """Compute a row of solar geometry and mark it complete."""
+        logging.info(f'Computing solar geometry for latitude {self.lats[lat_idx]:.2f}...')
+        geometry = get_solar_position(
+            self.lats[lat_idx],
+            self.lons[:, np.newaxis],
+            get_date_times(self.year)
+        )
+
+        # rows are separate regions of each file, so processes
+        # may write different rows concurrently
+        for variable, values in zip(GEOMETRY_VARIABLES, geometry):
+            store = self._open(variable, 'r+')
+            store[lat_idx] = np.broadcast_to(values, store.shape[1:])
+            store.flush()
+            del store
+        rows_complete = self._open('rows_complete', 'r+')
+        rows_complete[lat_idx] = 1
+        rows_complete.flush()
+
+    def get_row(self, lat_idx: int):
+        """Zenith, apparent zenith and azimuth of a row, each with
+        shape (lon, time). Missing rows are computed first."""
+        if not self._open('rows_complete')[lat_idx]:
+            self._write_row(lat_idx)
+        return tuple(self._open(variable)[lat_idx] for variable in GEOMETRY_VARIABLES)
+
+    def generate(self, workers: int=1):
+        """Compute every row not yet in the store."""
+        missing_rows = np.flatnonzero(self._open('rows_complete') != 1).tolist()
+        logging.info(f'Computing solar geometry for {len(missing_rows)} rows in {self.path}...')
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(self._write_row, missing_rows))
+        else:
+            for lat_idx in missing_rows:
+                self._write_row(lat_idx)
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('combined_merra_file', type=Path)
+    parser.add_argument('solar_geometry_dir', type=Path)
+    parser.add_argument('--merra-year', type=int)
+    parser.add_argument('--dtype', choices=('float64', 'float32'), default='float64')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    # only the grid and year are read
+    if args.combined_merra_file.is_dir() and args.combined_merra_file.suffix != '.zarr':
+        dataset = open_merra_directory(args.combined_merra_file, args.merra_year)
+    else:
+        dataset = xr.open_dataset(
+            args.combined_merra_file,
+            engine='zarr' if args.combined_merra_file.suffix == '.zarr' else None
+        )
+
+    SolarGeometryStore(
+        args.solar_geometry_dir,
+        dataset['lat'].values,
+        dataset['lon'].values,
+        dataset.year,
+        args.dtype
+    ).generate(args.workers)
@@ -1,14 +1,20 @@
 import unittest
 from sys import path
 from pathlib import Path
-from netCDF4 import Dataset
-from numpy import array_equal
+from shutil import copy, rmtree
+from unittest.mock import patch
+from netCDF4 import Dataset, default_fillvals
+import xarray as xr
+import zarr
+from numpy import array_equal, nan
+from numpy.ma import allequal
 
 # update path
 PROJECT_PATH = Path(__file__).parents[1]
 path.insert(0, str(Path(PROJECT_PATH, 'src')))
 
-from combine_merra import combine, MERRA_VARIABLES
+from combine_merra import combine, get_day_windows, MERRA_VARIABLES, MERRA_VARIABLE_RANGES
+from merra_view import open_merra_directory
 
 class TestCombineMerra(unittest.TestCase):
 	def setUp(self):
@@ -103,5 +109,255 @@ class TestCombineMerra(unittest.TestCase):
 			self.output_vars['T2M'][0,-1,start_hour]
 		)
 
+	def test_single_worker_reads_inline(self):
+		inline_output_file = Path(
+			PROJECT_PATH,
+			'test_data',
+			'tmp_inline_combined_merra_2020.nc'
+		)
+
+		# no process pool is started for one worker
+		with patch('combine_merra.ProcessPoolExecutor', side_effect=AssertionError('pool started')):
+			combine(self.test_merra_path, self.test_year, inline_output_file, block_days=2)
+
+		with Dataset(inline_output_file) as dataset:
+			for variable in MERRA_VARIABLES:
+				self.assertTrue(allequal(dataset.variables[variable][:], self.output_vars[variable]))
+
+	def test_misdated_file_is_rejected(self):
+		arriving_merra_path = Path(PROJECT_PATH, 'test_data', 'tmp_arriving_merra')
+		rmtree(arriving_merra_path, ignore_errors=True)
+		arriving_merra_path.mkdir()
+		for merra_file in self.test_merra_path.iterdir():
+			copy(merra_file, arriving_merra_path)
+
+		# a file whose hours belong to another day
+		misdated_file = next(arriving_merra_path.glob('*slv*20200102*'))
+		with Dataset(misdated_file, 'r+') as dataset:
+			dataset.variables['time'].units = 'minutes since 2020-01-03 00:30:00'
+		with self.assertRaisesRegex(ValueError, 'hours of 2020-01-02'):
+			combine(
+				arriving_merra_path,
+				self.test_year,
+				Path(PROJECT_PATH, 'test_data', 'tmp_misdated_combined_merra_2020.nc')
+			)
+
+		rmtree(arriving_merra_path)
+
+	def test_parallel_blocks(self):
+		parallel_output_file = Path(
+			PROJECT_PATH,
+			'test_data',
+			'tmp_parallel_combined_merra_2020.nc'
+		)
+
+		# blocks of two days split the three test days unevenly
+		combine(
+			self.test_merra_path,
+			self.test_year,
+			parallel_output_file,
+			workers=2,
+			block_days=2
+		)
+
+		with Dataset(parallel_output_file) as dataset:
+			for variable in MERRA_VARIABLES:
+				parallel_var = dataset.variables[variable][:]
+				self.assertTrue(array_equal(
+					parallel_var.mask,
+					self.output_vars[variable].mask
+				))
+				self.assertTrue(allequal(parallel_var, self.output_vars[variable]))
+
+	def test_scaled_compressed_storage(self):
+		scaled_output_file = Path(
+			PROJECT_PATH,
+			'test_data',
+			'tmp_scaled_combined_merra_2020.nc'
+		)
+
+		combine(
+			self.test_merra_path,
+			self.test_year,
+			scaled_output_file,
+			storage='scaled',
+			chunk_layout='row',
+			zlib=True,
+			shuffle=True
+		)
+
+		with Dataset(scaled_output_file) as dataset:
+			for variable in MERRA_VARIABLES:
+				scaled_var = dataset.variables[variable]
+				self.assertEqual(scaled_var.chunking()[1:], [len(self.output_lons), 8760])
+				self.assertTrue(scaled_var.filters()['zlib'])
+
+				# packing error is at most half a step
+				min_val, max_val = MERRA_VARIABLE_RANGES[variable]
+				self.assertLessEqual(
+					abs(scaled_var[:] - self.output_vars[variable]).max(),
+					(max_val - min_val) / 65534 / 2 + 1e-6 * max_val
+				)
+				self.assertTrue(array_equal(
+					scaled_var[:].mask,
+					self.output_vars[variable].mask
+				))
+
+	def test_scaled_storage_clips_out_of_range(self):
+		arriving_merra_path = Path(PROJECT_PATH, 'test_data', 'tmp_arriving_merra')
+		rmtree(arriving_merra_path, ignore_errors=True)
+		arriving_merra_path.mkdir()
+		for merra_file in self.test_merra_path.iterdir():
+			copy(merra_file, arriving_merra_path)
+
+		# values beyond the packed ranges on the second day
+		out_of_range = {'PS' : 200000, 'SWGDN' : -100}
+		for merra_file in arriving_merra_path.glob('*20200102*'):
+			with Dataset(merra_file, 'r+') as dataset:
+				for variable, value in out_of_range.items():
+					if variable in dataset.variables:
+						dataset.variables[variable][5, 0, 0] = value
+
+		for suffix in ('.nc', '.zarr'):
+			scaled_output_file = Path(
+				PROJECT_PATH,
+				'test_data',
+				f'tmp_scaled_combined_merra_2020{suffix}'
+			)
+			rmtree(scaled_output_file, ignore_errors=True)
+			combine(arriving_merra_path, self.test_year, scaled_output_file, storage='scaled')
+
+			# values saturate at the nearest end of the range
+			with xr.open_dataset(scaled_output_file, engine='zarr' if suffix == '.zarr' else None) as dataset:
+				for variable, value in out_of_range.items():
+					min_val, max_val = MERRA_VARIABLE_RANGES[variable]
+					self.assertAlmostEqual(
+						float(dataset[variable][0, 0, 24 + 5]),
+						max_val if value > max_val else min_val,
+						delta=(max_val - min_val) / 65534
+					)
+
+		rmtree(arriving_merra_path)
+
+	def test_zarr_store(self):
+		zarr_output_file = Path(
+			PROJECT_PATH,
+			'test_data',
+			'tmp_combined_merra_2020.zarr'
+		)
+
+		combine(
+			self.test_merra_path,
+			self.test_year,
+			zarr_output_file,
+			workers=2,
+			block_days=2,
+			zlib=True
+		)
+
+		group = zarr.open_group(str(zarr_output_file), mode='r')
+		self.assertTrue(array_equal(group['lat'][:], self.output_lats))
+		self.assertTrue(array_equal(group['lon'][:], self.output_lons))
+		for variable in MERRA_VARIABLES:
+			self.assertEqual(group[variable].chunks[2], 48)
+			self.assertTrue(array_equal(
+				group[variable][:],
+				self.output_vars[variable].filled(nan),
+				equal_nan=True
+			))
+
+	def test_append_new_days(self):
+		arriving_merra_path = Path(PROJECT_PATH, 'test_data', 'tmp_arriving_merra')
+		append_output_file = Path(
+			PROJECT_PATH,
+			'test_data',
+			'tmp_append_combined_merra_2020.nc'
+		)
+		rmtree(arriving_merra_path, ignore_errors=True)
+		arriving_merra_path.mkdir()
+		append_output_file.unlink(missing_ok=True)
+
+		# first day, and only the rad file of the second day
+		merra_files = sorted(self.test_merra_path.iterdir())
+		for merra_file in merra_files:
+			if '20200101' in merra_file.name or 'rad_Nx.20200102' in merra_file.name:
+				copy(merra_file, arriving_merra_path)
+		combine(arriving_merra_path, self.test_year, append_output_file, append=True)
+
+		with Dataset(append_output_file) as dataset:
+			self.assertEqual(list(dataset.variables['day_complete'][:3].filled(0)), [1, 0, 0])
+
+		# remaining files arrive
+		for merra_file in merra_files:
+			copy(merra_file, arriving_merra_path)
+		combine(arriving_merra_path, self.test_year, append_output_file, append=True)
+
+		with Dataset(append_output_file) as dataset:
+			self.assertEqual(dataset.variables['day_complete'][:].sum(), 3)
+			for variable in MERRA_VARIABLES:
+				append_var = dataset.variables[variable][:]
+				self.assertTrue(array_equal(append_var.mask, self.output_vars[variable].mask))
+				self.assertTrue(allequal(append_var, self.output_vars[variable]))
+
+		rmtree(arriving_merra_path)
+
+	def test_zarr_append_with_gap(self):
+		arriving_merra_path = Path(PROJECT_PATH, 'test_data', 'tmp_arriving_merra')
+		append_output_file = Path(
+			PROJECT_PATH,
+			'test_data',
+			'tmp_append_combined_merra_2020.zarr'
+		)
+		rmtree(arriving_merra_path, ignore_errors=True)
+		rmtree(append_output_file, ignore_errors=True)
+		arriving_merra_path.mkdir()
+
+		# the second day arrives first
+		merra_files = sorted(self.test_merra_path.iterdir())
+		for merra_file in merra_files:
+			if '20200102' in merra_file.name:
+				copy(merra_file, arriving_merra_path)
+		combine(arriving_merra_path, self.test_year, append_output_file, append=True)
+
+		# the days around it share its chunk, and are written by one worker
+		self.assertEqual(get_day_windows([0, 2, 10, 11], 10), [[0, 2], [10, 11]])
+		for merra_file in merra_files:
+			copy(merra_file, arriving_merra_path)
+		combine(arriving_merra_path, self.test_year, append_output_file, workers=2, append=True)
+
+		group = zarr.open_group(str(append_output_file), mode='r')
+		self.assertEqual(group['day_complete'][:].sum(), 3)
+		for variable in MERRA_VARIABLES:
+			self.assertTrue(array_equal(
+				group[variable][:],
+				self.output_vars[variable].filled(nan),
+				equal_nan=True
+			))
+
+		rmtree(arriving_merra_path)
+
+	def test_view_without_first_day(self):
+		arriving_merra_path = Path(PROJECT_PATH, 'test_data', 'tmp_arriving_merra')
+		rmtree(arriving_merra_path, ignore_errors=True)
+		arriving_merra_path.mkdir()
+
+		# a directory starting on the second day
+		for merra_file in self.test_merra_path.iterdir():
+			if '20200101' not in merra_file.name:
+				copy(merra_file, arriving_merra_path)
+		view = open_merra_directory(arriving_merra_path, self.test_year)
+
+		self.assertTrue(array_equal(view['lat'].values, self.output_lats))
+		self.assertTrue(array_equal(view['lon'].values, self.output_lons))
+		for variable in MERRA_VARIABLES:
+			values = view[variable].values
+			self.assertTrue((values[:, :, :24] == default_fillvals['f8']).all())
+			self.assertTrue(array_equal(
+				values[:, :, 24:72],
+				self.output_vars[variable][:, :, 24:72].filled(default_fillvals['f8'])
+			))
+
+		rmtree(arriving_merra_path)
+
 if __name__ == "__main__":
 	unittest.main()
\ No newline at end of file
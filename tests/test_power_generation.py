@@ -1,8 +1,15 @@
 import unittest
+import json
+import threading
 from sys import path
 from pathlib import Path
+from shutil import rmtree
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
 
 import numpy as np
+import xarray as xr
+import zarr
 from netCDF4 import Dataset
 
 # update path
@@ -10,6 +17,19 @@ PROJECT_PATH = Path(__file__).parents[1]
 path.insert(0, str(Path(PROJECT_PATH, 'src')))
 
 from power_generation import MerraPowerGeneration
+from merge_tiles import merge_tiles
+from batch import run_batch
+from solar_geometry import SolarGeometryStore
+
+def _run_tile(combined_merra_file, output_file, wind_power_curve_file, tile_kwargs):
+	MerraPowerGeneration(
+		combined_merra_file,
+		output_file,
+		wind_power_curve_file,
+		solar_engine='numpy',
+		wind_engine='numpy',
+		**tile_kwargs
+	).run()
 
 class TestPowerGeneration(unittest.TestCase):
 	def setUp(self):
@@ -66,5 +86,666 @@ class TestPowerGeneration(unittest.TestCase):
 		self.assertGreater(solar_correlation, correlation_threshold)
 		self.assertGreater(wind_correlation, correlation_threshold)
 
+class TestSmallGridPowerGeneration(unittest.TestCase):
+	def setUp(self):
+		self.combined_merra_file = Path(
+			PROJECT_PATH,
+			'test_data',
+			'combined_merra',
+			'combined_merra_2020.nc'
+		)
+		self.small_combined_merra_file = Path(
+			PROJECT_PATH,
+			'test_data',
+			'tmp_small_combined_merra_2020.nc'
+		)
+		self.wind_power_curve_file = Path(
+			PROJECT_PATH,
+			'input',
+			'power_curves',
+			'wind_turbine_power_curves.csv'
+		)
+
+		# a 2x3 subset keeps PySAM runs short
+		with xr.open_dataset(self.combined_merra_file) as combined:
+			combined.isel(lat=slice(0, 2), lon=slice(0, 3)).to_netcdf(
+				self.small_combined_merra_file
+			)
+
+	def _run(self, output_name, **kwargs):
+		output_file = Path(PROJECT_PATH, 'test_data', output_name)
+		mpg = MerraPowerGeneration(
+			self.small_combined_merra_file,
+			output_file,
+			self.wind_power_curve_file,
+			**kwargs
+		)
+		mpg.run()
+
+		if output_file.suffix == '.zarr':
+			output = zarr.open_group(str(output_file), mode='r')
+			return {
+				variable : MerraPowerGeneration.read_output(output, variable)
+				for variable in ('solar_capacity_factor', 'wind_capacity_factor')
+			}
+
+		with Dataset(output_file) as output:
+			return {
+				variable : output.variables[variable][:]
+				for variable in ('solar_capacity_factor', 'wind_capacity_factor')
+			}
+
+	def test_row_dni_dhi_matches_cell(self):
+		# guards the private pvlib.irradiance._dirint_coeffs used by
+		# rows against the public pvlib.irradiance.dirint used by cells
+		mpg = MerraPowerGeneration(
+			self.small_combined_merra_file,
+			Path(PROJECT_PATH, 'test_data', 'tmp_dni_dhi_2020.nc'),
+			self.wind_power_curve_file
+		)
+		for lat_idx in range(len(mpg.variables['lat'])):
+			row_dni, row_dhi = mpg._get_row_dni_dhi(lat_idx)
+			for lon_idx, lon in enumerate(mpg.variables['lon']):
+				_, dni, dhi = mpg._get_dni_dhi(
+					mpg.variables['lat'][lat_idx],
+					lon,
+					mpg.year,
+					mpg.variables['ghi_w_per_m_2'][lat_idx, lon_idx]
+				)
+				self.assertTrue(np.allclose(dni, row_dni[lon_idx], equal_nan=True))
+				self.assertTrue(np.allclose(dhi, row_dhi[lon_idx], equal_nan=True))
+
+	def test_row_resource_data_matches_variables(self):
+		mpg = MerraPowerGeneration(
+			self.small_combined_merra_file,
+			Path(PROJECT_PATH, 'test_data', 'tmp_resource_data_2020.nc'),
+			self.wind_power_curve_file
+		)
+		lat_idx = 1
+		lon_indices = [0, 2]
+		row_dni, _ = mpg._get_row_dni_dhi(lat_idx)
+		solar_resources = mpg._get_row_solar_resource_data(lat_idx, lon_indices)
+		wind_resources = mpg._get_row_wind_resource_data(lat_idx, lon_indices)
+
+		for lon_idx, solar_resource, wind_resource in zip(lon_indices, solar_resources, wind_resources):
+			self.assertEqual(solar_resource['lon'], mpg.variables['lon'][lon_idx])
+			self.assertEqual(solar_resource['hour'][:3], [0, 1, 2])
+			self.assertEqual(solar_resource['dn'], list(row_dni[lon_idx]))
+			self.assertEqual(
+				solar_resource['tdry'],
+				list(mpg.variables['temperature_c'][lat_idx, lon_idx])
+			)
+
+			# hourly rows hold each field in header order
+			self.assertEqual(wind_resource['heights'], [2, 2, 2, 10, 50, 50])
+			self.assertEqual(wind_resource['fields'], [1, 2, 3, 3, 3, 4])
+			self.assertEqual(len(wind_resource['data']), 8760)
+			self.assertEqual(
+				[row[4] for row in wind_resource['data']],
+				list(mpg.variables['wind_speed_50_m_per_s'][lat_idx, lon_idx])
+			)
+
+	def test_wind_direction_by_quadrant(self):
+		# components (eastward, northward) and direction from due south
+		cases = [
+			(1, 0, 270),
+			(-1, 0, 90),
+			(0, 1, 180),
+			(0, -1, 0),
+			(1, 1, 225),
+			(1, -1, 315),
+			(-1, 1, 135),
+			(-1, -1, 45),
+			(0, 0, 0),
+			(np.nan, 1, 0)
+		]
+		eastward, northward, expected = (np.array(values, dtype=np.float64) for values in zip(*cases))
+		direction = MerraPowerGeneration._get_wind_direction(eastward, northward)
+		self.assertTrue(np.allclose(direction, expected))
+
+		# computed in place
+		out = np.empty_like(eastward)
+		self.assertIs(MerraPowerGeneration._get_wind_direction(eastward, northward, out=out), out)
+
+	def test_wind_class_pools_years(self):
+		# a windier copy of the year stands in for another year
+		windy_file = Path(PROJECT_PATH, 'test_data', 'tmp_windy_2021.nc')
+		with xr.open_dataset(self.small_combined_merra_file) as combined:
+			windy = combined.load()
+		for variable in ('U10M', 'V10M', 'U50M', 'V50M'):
+			windy[variable] = windy[variable] * 1.5
+		windy.to_netcdf(windy_file)
+
+		mpg = MerraPowerGeneration(
+			self.small_combined_merra_file,
+			Path(PROJECT_PATH, 'test_data', 'tmp_wind_class_2020.nc'),
+			self.wind_power_curve_file,
+			wind_class_files=[windy_file]
+		)
+
+		# row by row classes match classifying full arrays at once
+		wind_speeds = {}
+		for height in (10, 50):
+			wind_speeds[height] = np.concatenate([
+				mpg.variables[f'wind_speed_{height}_m_per_s'],
+				mpg._get_wind_speed(
+					windy[f'U{height}M'].values.astype(np.float64),
+					windy[f'V{height}M'].values.astype(np.float64)
+				)
+			], axis=2)
+		median_wind_speed = np.median(
+			mpg.scale_wind_height(10, wind_speeds[10], 50, wind_speeds[50], 100),
+			axis=2
+		)
+		expected = np.where(median_wind_speed >= 9, 1, np.where(median_wind_speed >= 8, 2, 3))
+		self.assertTrue(np.array_equal(mpg.variables['wind_turbine_iec_class'], expected))
+
+		single_year = mpg._get_wind_turbine_class(
+			mpg.variables['wind_speed_10_m_per_s'],
+			mpg.variables['wind_speed_50_m_per_s']
+		)
+		self.assertTrue((expected <= single_year).all())
+
+	def test_parallel_matches_serial(self):
+		serial = self._run('tmp_serial_2020.nc')
+		parallel = self._run('tmp_parallel_2020.nc', workers=2)
+
+		for variable in serial:
+			self.assertTrue(np.array_equal(
+				serial[variable],
+				parallel[variable],
+				equal_nan=True
+			))
+
+	def test_pipeline_matches_serial(self):
+		serial = self._run('tmp_serial_2020.nc', wind_engine='numpy')
+		# a small queue so that stages wait on each other
+		pipelined = self._run(
+			'tmp_pipeline_2020.nc',
+			wind_engine='numpy',
+			pipeline=True,
+			workers=2,
+			queue_size=2
+		)
+
+		for variable in serial:
+			self.assertTrue(np.array_equal(
+				serial[variable],
+				pipelined[variable],
+				equal_nan=True
+			))
+
+	def test_pipeline_stops_on_error(self):
+		mpg = MerraPowerGeneration(
+			self.small_combined_merra_file,
+			Path(PROJECT_PATH, 'test_data', 'tmp_pipeline_2020.nc'),
+			self.wind_power_curve_file,
+			wind_engine='numpy',
+			pipeline=True,
+			queue_size=1
+		)
+		threads = set(threading.enumerate())
+		# workers are forked with the failing simulation
+		with patch.object(MerraPowerGeneration, '_simulate_cell', side_effect=RuntimeError('simulation failed')):
+			with self.assertRaisesRegex(RuntimeError, 'simulation failed'):
+				mpg.run()
+
+		# the preparer, waiting for a free slot, has exited
+		self.assertEqual(set(threading.enumerate()), threads)
+
+	def test_zarr_parallel_matches_netcdf(self):
+		serial = self._run('tmp_serial_2020.nc', wind_engine='numpy')
+
+		# zarr input, with workers writing their own rows
+		small_zarr_file = self.small_combined_merra_file.with_suffix('.zarr')
+		with xr.open_dataset(self.small_combined_merra_file) as small_combined:
+			small_combined.to_zarr(small_zarr_file, mode='w')
+		self.small_combined_merra_file = small_zarr_file
+		parallel = self._run('tmp_parallel_2020.zarr', wind_engine='numpy', workers=2)
+
+		for variable in serial:
+			self.assertTrue(np.array_equal(
+				serial[variable].filled(np.nan),
+				parallel[variable],
+				equal_nan=True
+			))
+
+	def test_merra_directory_matches_combined(self):
+		combined = self._run('tmp_combined_2020.nc', solar_engine='numpy', wind_engine='numpy')
+
+		# lazy view over the three daily test files, read in bands
+		self.small_combined_merra_file = Path(PROJECT_PATH, 'test_data', 'merra')
+		daily = self._run(
+			'tmp_daily_2020.nc',
+			solar_engine='numpy',
+			wind_engine='numpy',
+			max_memory_mb=5,
+			merra_year=2020
+		)
+
+		for variable in combined:
+			self.assertTrue(np.array_equal(
+				combined[variable][:2, :3],
+				daily[variable][:2, :3],
+				equal_nan=True
+			))
+
+	def test_derived_cache_matches_uncached(self):
+		uncached = self._run('tmp_serial_2020.nc', wind_engine='numpy')
+
+		derived_cache_dir = Path(PROJECT_PATH, 'test_data', 'tmp_derived_cache')
+		rmtree(derived_cache_dir, ignore_errors=True)
+		for output_name in ('tmp_cache_write_2020.nc', 'tmp_cache_read_2020.nc'):
+			cached = self._run(
+				output_name,
+				wind_engine='numpy',
+				max_memory_mb=5,
+				derived_cache_dir=derived_cache_dir
+			)
+			for variable in uncached:
+				self.assertTrue(np.array_equal(
+					uncached[variable],
+					cached[variable],
+					equal_nan=True
+				))
+
+		# a later run maps cached arrays without deriving them
+		mpg = MerraPowerGeneration(
+			self.small_combined_merra_file,
+			Path(PROJECT_PATH, 'test_data', 'tmp_cache_read_2020.nc'),
+			self.wind_power_curve_file,
+			derived_cache_dir=derived_cache_dir
+		)
+		self.assertIsInstance(mpg.variables['temperature_c'], np.memmap)
+		self.assertNotIn('T2M', mpg.variables)
+
+	def test_solar_geometry_store_matches_computed(self):
+		solar_geometry_dir = Path(PROJECT_PATH, 'test_data', 'tmp_solar_geometry')
+		rmtree(solar_geometry_dir, ignore_errors=True)
+		computed = self._run('tmp_solar_numpy_2020.nc', solar_engine='numpy', wind_engine='numpy')
+		stored = self._run(
+			'tmp_geometry_write_2020.nc',
+			solar_engine='numpy',
+			wind_engine='numpy',
+			solar_geometry_dir=solar_geometry_dir
+		)
+
+		# stored rows are read without computing solar position
+		mpg = MerraPowerGeneration(
+			self.small_combined_merra_file,
+			Path(PROJECT_PATH, 'test_data', 'tmp_geometry_read_2020.nc'),
+			self.wind_power_curve_file,
+			solar_engine='numpy',
+			wind_engine='numpy',
+			solar_geometry_dir=solar_geometry_dir
+		)
+		with patch('power_generation.get_solar_position', side_effect=AssertionError):
+			mpg.run()
+
+		with Dataset(mpg.output_file) as output:
+			for variable in computed:
+				self.assertTrue(np.array_equal(computed[variable], stored[variable]))
+				self.assertTrue(np.array_equal(computed[variable], output.variables[variable][:]))
+
+		# a new grid, year or pvlib version uses a new store
+		key = SolarGeometryStore.get_key(mpg.lats, mpg.lons, 2020, np.float64)
+		self.assertEqual(mpg.solar_geometry.path.name, key)
+		self.assertNotEqual(key, SolarGeometryStore.get_key(mpg.lats, mpg.lons, 2021, np.float64))
+		self.assertNotEqual(key, SolarGeometryStore.get_key(mpg.lats[:1], mpg.lons, 2020, np.float64))
+		with patch('pvlib.__version__', '0.0.0'):
+			self.assertNotEqual(key, SolarGeometryStore.get_key(mpg.lats, mpg.lons, 2020, np.float64))
+
+	def test_result_cache_skips_unchanged_cells(self):
+		result_cache_dir = Path(PROJECT_PATH, 'test_data', 'tmp_result_cache')
+		rmtree(result_cache_dir, ignore_errors=True)
+		uncached = self._run('tmp_serial_2020.nc', wind_engine='numpy')
+		cached = self._run(
+			'tmp_cache_write_2020.nc',
+			wind_engine='numpy',
+			result_cache_dir=result_cache_dir
+		)
+		self.assertEqual(len(list(result_cache_dir.glob('*.npy'))), 12)
+
+		# cached cells are not simulated again
+		mpg = MerraPowerGeneration(
+			self.small_combined_merra_file,
+			Path(PROJECT_PATH, 'test_data', 'tmp_cache_read_2020.nc'),
+			self.wind_power_curve_file,
+			wind_engine='numpy',
+			result_cache_dir=result_cache_dir,
+			result_cache_max_mb=0.5
+		)
+		mpg.simulate_solar = None
+		mpg.simulate_wind_numpy = None
+		mpg.run()
+
+		with Dataset(mpg.output_file) as output:
+			for variable in uncached:
+				self.assertTrue(np.array_equal(uncached[variable], cached[variable]))
+				self.assertTrue(np.array_equal(uncached[variable], output.variables[variable][:]))
+
+		# least recently used results are evicted beyond the size limit
+		self.assertEqual(len(list(result_cache_dir.glob('*.npy'))), 7)
+
+	def test_masked_cells_are_fill_values(self):
+		unmasked = self._run('tmp_unmasked_2020.nc', solar_engine='numpy', wind_engine='numpy')
+
+		with xr.open_dataset(self.small_combined_merra_file) as small_combined:
+			lats = small_combined['lat'].values
+			lons = small_combined['lon'].values
+
+		# netCDF mask excludes the first cell, CSV mask the second
+		# row's second cell, and the bounding box the last column
+		netcdf_mask_file = Path(PROJECT_PATH, 'test_data', 'tmp_mask.nc')
+		netcdf_mask = np.ones((len(lats), len(lons)), dtype=np.int8)
+		netcdf_mask[0, 0] = 0
+		xr.Dataset(
+			{'mask' : (('lat', 'lon'), netcdf_mask)},
+			coords={'lat' : lats, 'lon' : lons}
+		).to_netcdf(netcdf_mask_file)
+		csv_mask_file = Path(PROJECT_PATH, 'test_data', 'tmp_mask.csv')
+		with open(csv_mask_file, 'w') as csv_file:
+			csv_file.write('lat,lon,mask\n')
+			for lat_idx, lat in enumerate(lats):
+				for lon_idx, lon in enumerate(lons):
+					csv_file.write(f'{lat},{lon},{int((lat_idx, lon_idx) != (1, 1))}\n')
+
+		masked = self._run(
+			'tmp_masked_2020.nc',
+			solar_engine='numpy',
+			wind_engine='numpy',
+			mask_files=[netcdf_mask_file, csv_mask_file],
+			bounding_box=(lats[0], lats[-1], lons[0], lons[1])
+		)
+
+		active_cells = np.array([[False, True, False], [True, False, False]])
+		for variable in unmasked:
+			masked_values = np.ma.filled(masked[variable], np.nan)
+			self.assertTrue(np.isnan(masked_values[~active_cells]).all())
+			self.assertTrue(np.array_equal(
+				masked_values[active_cells],
+				unmasked[variable][active_cells]
+			))
+
+	def test_merged_tiles_match_full_grid(self):
+		full = self._run('tmp_full_2020.nc', solar_engine='numpy', wind_engine='numpy')
+
+		# first row as tile 0 of 2, second row split by lon range
+		tiles = {
+			'tmp_tile_0_2020.nc' : dict(tile=(0, 2)),
+			'tmp_tile_1a_2020.nc' : dict(lat_range=(1, 2), lon_range=(0, 1)),
+			'tmp_tile_1b_2020.zarr' : dict(lat_range=(1, 2), lon_range=(1, 3))
+		}
+		tile_files = [Path(PROJECT_PATH, 'test_data', tile_name) for tile_name in tiles]
+		with ProcessPoolExecutor(max_workers=3) as executor:
+			list(executor.map(
+				_run_tile,
+				[self.small_combined_merra_file] * len(tiles),
+				tile_files,
+				[self.wind_power_curve_file] * len(tiles),
+				tiles.values()
+			))
+
+		merged_file = Path(PROJECT_PATH, 'test_data', 'tmp_merged_2020.nc')
+		merge_tiles(tile_files, merged_file)
+		with Dataset(merged_file) as merged:
+			for variable in full:
+				self.assertTrue(np.array_equal(
+					full[variable],
+					merged.variables[variable][:]
+				))
+
+		# a missing tile fails coverage validation
+		with self.assertRaisesRegex(ValueError, 'not covered'):
+			merge_tiles(tile_files[:2], merged_file)
+
+	def test_batch_matches_single_years(self):
+		single = self._run('tmp_full_2020.nc', solar_engine='numpy', wind_engine='numpy')
+
+		# combined files in the batch directory are used as they are,
+		# with a copy of the year standing in for the next
+		batch_dir = Path(PROJECT_PATH, 'test_data', 'tmp_batch')
+		rmtree(batch_dir, ignore_errors=True)
+		batch_dir.mkdir()
+		with xr.open_dataset(self.small_combined_merra_file) as combined:
+			combined = combined.load()
+		for year in (2020, 2021):
+			combined.attrs['year'] = year
+			combined.to_netcdf(Path(batch_dir, f'combined_merra_{year}.nc'))
+
+		multi_year_file = Path(batch_dir, 'merra_power_generation_2020_2021.nc')
+		output_files = run_batch(
+			Path(PROJECT_PATH, 'test_data', 'merra'),
+			batch_dir,
+			[2020, 2021],
+			self.wind_power_curve_file,
+			concurrent_years=2,
+			multi_year_file=multi_year_file,
+			solar_engine='numpy',
+			wind_engine='numpy'
+		)
+		self.assertEqual(
+			[output_file.name for output_file in output_files],
+			['merra_power_generation_2020.nc', 'merra_power_generation_2021.nc']
+		)
+
+		# years follow each other, and the first matches a single run
+		with Dataset(multi_year_file) as multi_year:
+			self.assertEqual(len(multi_year.dimensions['time']), 2 * 8760)
+			for variable in single:
+				self.assertTrue(np.array_equal(single[variable], multi_year.variables[variable][:, :, :8760]))
+				with Dataset(output_files[1]) as second_year:
+					self.assertTrue(np.array_equal(
+						second_year.variables[variable][:],
+						multi_year.variables[variable][:, :, 8760:]
+					))
+
+		# time runs on into the second year, skipping leap day
+		with xr.open_dataset(multi_year_file) as multi_year:
+			times = multi_year['time'].values
+			self.assertEqual(str(times[8760])[:13], '2021-01-01T00')
+			self.assertEqual(str(times[-1])[:13], '2021-12-31T23')
+			self.assertEqual(len(np.unique(times)), len(times))
+
+			# single years label the same hours, skipping leap day too
+			for year_idx, output_file in enumerate(output_files):
+				with xr.open_dataset(output_file) as single_year:
+					self.assertTrue(np.array_equal(
+						single_year['time'].values,
+						times[year_idx * 8760:(year_idx + 1) * 8760]
+					))
+
+	def test_clustered_within_tolerance(self):
+		full = self._run('tmp_full_2020.nc', solar_engine='numpy', wind_engine='numpy')
+
+		# with every cell its own representative, nothing is transferred
+		unclustered = self._run(
+			'tmp_unclustered_2020.nc',
+			solar_engine='numpy',
+			wind_engine='numpy',
+			cluster_fraction=1
+		)
+		for variable in full:
+			self.assertTrue(np.array_equal(full[variable], unclustered[variable]))
+
+		clustered_file = Path(PROJECT_PATH, 'test_data', 'tmp_clustered_2020.nc')
+		mpg = MerraPowerGeneration(
+			self.small_combined_merra_file,
+			clustered_file,
+			self.wind_power_curve_file,
+			solar_engine='numpy',
+			wind_engine='numpy',
+			cluster_fraction=0.5,
+			cluster_sample=2
+		)
+		mpg.run()
+		representatives = mpg._get_cell_clusters(range(2))
+		self.assertLess(len(set(representatives.values())), len(representatives))
+
+		with Dataset(clustered_file) as clustered:
+			for technology in ('solar', 'wind'):
+				variable = f'{technology}_capacity_factor'
+				clustered_cf = clustered.variables[variable][:]
+				self.assertFalse(np.ma.is_masked(clustered_cf))
+
+				# representatives are simulated, other cells transferred
+				for cell in set(representatives.values()):
+					self.assertTrue(np.array_equal(full[variable][cell], clustered_cf[cell]))
+				self.assertLess(np.abs(clustered_cf - full[variable]).mean(), 0.01)
+
+				# sampled errors are reported
+				self.assertLess(mpg.cluster_errors[technology]['annual_max_abs_error'], 0.01)
+
+	def test_sweep_matches_single_configurations(self):
+		default = self._run('tmp_serial_2020.nc', wind_engine='numpy')
+		sweep = {
+			'solar' : [{}, {'tilt' : 0, 'dc_ac_ratio' : 1.3}],
+			'wind' : [{}, {'hub_height' : 100, 'turbine_class' : 2}]
+		}
+		sweep_files = {
+			'tmp_sweep_2020.nc' : sweep,
+			'tmp_sweep_single_2020.nc' : {technology : configs[1:] for technology, configs in sweep.items()}
+		}
+		outputs = {}
+		for output_name, output_sweep in sweep_files.items():
+			sweep_file = Path(PROJECT_PATH, 'test_data', output_name.replace('.nc', '.json'))
+			with open(sweep_file, 'w') as json_file:
+				json.dump(output_sweep, json_file)
+			outputs[output_name] = self._run(output_name, wind_engine='numpy', sweep_file=sweep_file)
+
+		swept = outputs['tmp_sweep_2020.nc']
+		with Dataset(Path(PROJECT_PATH, 'test_data', 'tmp_sweep_2020.nc')) as output:
+			self.assertEqual(
+				output.variables['wind_capacity_factor'].dimensions,
+				('lat', 'lon', 'wind_config', 'time')
+			)
+			self.assertTrue(np.isnan(output.variables['solar_tilt'][0]))
+			self.assertEqual(output.variables['wind_hub_height'][1], 100)
+
+		for variable in default:
+			# the default configuration matches a run without a sweep
+			self.assertEqual(swept[variable].shape, (2, 3, 2, 8760))
+			self.assertTrue(np.array_equal(swept[variable][:, :, 0], default[variable]))
+
+			# other configurations match being simulated alone
+			self.assertTrue(np.array_equal(
+				swept[variable][:, :, 1],
+				outputs['tmp_sweep_single_2020.nc'][variable][:, :, 0]
+			))
+			self.assertFalse(np.array_equal(swept[variable][:, :, 0], swept[variable][:, :, 1]))
+
+	def test_float32_within_tolerance(self):
+		double = self._run('tmp_serial_2020.nc', wind_engine='numpy')
+		single = self._run('tmp_float32_2020.nc', wind_engine='numpy', dtype='float32')
+
+		# hourly capacity factors agree within 1e-5
+		for variable in double:
+			self.assertEqual(single[variable].dtype, np.float32)
+			self.assertTrue(np.allclose(single[variable], double[variable], rtol=0, atol=1e-5, equal_nan=True))
+
+	def test_compact_output_within_resolution(self):
+		with xr.open_dataset(self.small_combined_merra_file) as small_combined:
+			lons = small_combined['lon'].values
+
+		# the bounding box leaves the last column as fill values
+		options = dict(solar_engine='numpy', wind_engine='numpy', bounding_box=(-90, 90, lons[0], lons[1]))
+		compact_options = dict(options, scaled_output=True, output_zlib=True, output_temperature='omit')
+		full = self._run('tmp_uncompressed_2020.nc', **options)
+		compact = self._run('tmp_compact_2020.nc', **compact_options)
+		compact_zarr = self._run('tmp_compact_2020.zarr', **compact_options)
+
+		# capacity factors are rounded to 1e-4
+		for variable in full:
+			full_values = np.ma.filled(full[variable], np.nan)
+			compact_values = np.ma.filled(compact[variable], np.nan)
+			self.assertTrue(np.allclose(compact_values, full_values, rtol=0, atol=0.5e-4 + 1e-9, equal_nan=True))
+			self.assertTrue(np.isnan(compact_values[:, 2]).all())
+			self.assertTrue(np.array_equal(compact_values, compact_zarr[variable], equal_nan=True))
+
+		with Dataset(Path(PROJECT_PATH, 'test_data', 'tmp_compact_2020.nc')) as output:
+			self.assertNotIn('temperature', output.variables)
+			self.assertEqual(output.variables['solar_capacity_factor'].dtype, np.uint16)
+		self.assertLess(
+			Path(PROJECT_PATH, 'test_data', 'tmp_compact_2020.nc').stat().st_size,
+			Path(PROJECT_PATH, 'test_data', 'tmp_uncompressed_2020.nc').stat().st_size / 4
+		)
+
+	def test_chunked_matches_in_memory(self):
+		in_memory = self._run('tmp_in_memory_2020.nc', wind_engine='numpy')
+
+		# budget fits a single latitude row per band
+		chunked = self._run(
+			'tmp_chunked_2020.nc',
+			wind_engine='numpy',
+			max_memory_mb=5
+		)
+
+		for variable in in_memory:
+			self.assertTrue(np.array_equal(
+				in_memory[variable],
+				chunked[variable],
+				equal_nan=True
+			))
+
+	def test_resume_skips_completed_rows(self):
+		complete = self._run('tmp_resume_2020.nc', wind_engine='numpy')
+
+		# mark the second row incomplete and tag the first row
+		with Dataset(Path(PROJECT_PATH, 'test_data', 'tmp_resume_2020.nc'), 'a') as output:
+			output.variables['row_complete'][1] = 0
+			output.variables['solar_capacity_factor'][1] = np.nan
+			output.variables['wind_capacity_factor'][0] = -1
+
+		resumed = self._run('tmp_resume_2020.nc', wind_engine='numpy', resume=True)
+
+		self.assertTrue(np.array_equal(
+			complete['solar_capacity_factor'],
+			resumed['solar_capacity_factor']
+		))
+		self.assertTrue(np.all(resumed['wind_capacity_factor'][0] == -1))
+
+	def test_numpy_wind_engine_matches_pysam(self):
+		pysam = self._run('tmp_wind_pysam_2020.nc')
+		numpy = self._run('tmp_wind_numpy_2020.nc', wind_engine='numpy')
+
+		# documented tolerance of the numpy wind engine
+		wind_tolerance = 1e-3
+
+		self.assertLess(
+			np.max(np.abs(
+				pysam['wind_capacity_factor'] - numpy['wind_capacity_factor']
+			)),
+			wind_tolerance
+		)
+		self.assertTrue(np.array_equal(
+			pysam['solar_capacity_factor'],
+			numpy['solar_capacity_factor']
+		))
+
+	def test_numpy_solar_engine_matches_pysam(self):
+		pysam = self._run('tmp_solar_pysam_2020.nc', wind_engine='numpy')
+		numpy = self._run(
+			'tmp_solar_numpy_2020.nc',
+			solar_engine='numpy',
+			wind_engine='numpy'
+		)
+
+		# documented tolerances of the numpy solar engine
+		energy_tolerance = 0.03
+		hourly_tolerance = 0.05
+
+		pysam_energy = pysam['solar_capacity_factor'].sum(axis=2)
+		numpy_energy = numpy['solar_capacity_factor'].sum(axis=2)
+		self.assertLess(
+			np.max(np.abs(numpy_energy / pysam_energy - 1)),
+			energy_tolerance
+		)
+		self.assertLess(
+			np.max(np.abs(
+				pysam['solar_capacity_factor'] - numpy['solar_capacity_factor']
+			)),
+			hourly_tolerance
+		)
+
 if __name__ == "__main__":
 	unittest.main()
\ No newline at end of file